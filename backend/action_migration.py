@@ -0,0 +1,118 @@
+# action_migration.py
+# Rewrite the 'actions' collection to one document per (user, item), keyed
+# {user_id}__{item_id}, keeping the latest action of any duplicates.
+#
+# Usage (from backend/):
+#   python action_migration.py check     # report documents to rewrite, exit 1 if any
+#   python action_migration.py migrate   # rewrite them, page by page
+#
+# Safe to run while the app is serving: each page is moved in a transaction
+# that never replaces a deterministic document with an older action, and an
+# interrupted run can simply be re-run.
+import sys
+import argparse
+
+from db import FirestoreDB, get_action_id, BATCH_SIZE
+from storage import run_transaction
+
+
+# Legacy documents per transaction: each may need one set and one delete
+PAGE_SIZE = BATCH_SIZE // 2
+
+
+def _timestamp(data: dict) -> str:
+    return str(data.get("timestamp") or "")
+
+
+def iter_pages(db: FirestoreDB, page_size: int = PAGE_SIZE):
+    """
+    The 'actions' collection in pages of document snapshots (document id order).
+    """
+    query = db.db.collection("actions").limit(page_size)
+    last = None
+    while True:
+        page = list((query.start_after(last) if last else query).stream())
+        if not page:
+            return
+        yield page
+        last = page[-1]
+
+
+def legacy_documents(page) -> list:
+    """
+    Documents of a page not yet stored under their deterministic id, as (action_id, snapshot).
+    """
+    legacy = []
+    for doc in page:
+        data = doc.to_dict() or {}
+        if data.get("user_id") and data.get("item_id"):
+            action_id = get_action_id(data["user_id"], data["item_id"])
+            if doc.id != action_id:
+                legacy.append((action_id, doc))
+    return legacy
+
+
+def migrate_page(db: FirestoreDB, legacy: list) -> int:
+    """
+    Move a page of legacy documents to their deterministic ids in one
+    transaction. A deterministic document that is as new or newer (e.g. a swipe
+    made while the migration runs, or a duplicate moved earlier) is kept.
+    Returns the number of deterministic documents written.
+    """
+    actions_ref = db.db.collection("actions")
+
+    def move(transaction):
+        action_ids = sorted({action_id for action_id, _ in legacy})
+        current = {
+            doc.id: _timestamp(doc.to_dict() or {})
+            for doc in transaction.get_all([actions_ref.document(action_id) for action_id in action_ids])
+            if doc.exists
+        }
+        latest = {}  # action_id -> data, the newest legacy document of each pair
+        for action_id, doc in legacy:
+            data = doc.to_dict()
+            if action_id not in latest or _timestamp(data) >= _timestamp(latest[action_id]):
+                latest[action_id] = data
+        written = 0
+        for action_id, data in latest.items():
+            if action_id not in current or _timestamp(data) > current[action_id]:
+                transaction.set(actions_ref.document(action_id), data)
+                written += 1
+        for _, doc in legacy:
+            transaction.delete(doc.reference)
+        return written
+
+    return run_transaction(move)
+
+
+def migrate(db: FirestoreDB, page_size: int = PAGE_SIZE):
+    written = deleted = 0
+    for page in iter_pages(db, page_size):
+        legacy = legacy_documents(page)
+        if legacy:
+            written += migrate_page(db, legacy)
+            deleted += len(legacy)
+            print(f"[migrate] {deleted} old documents moved so far")
+    print(f"[migrate] {written} actions written, {deleted} old documents deleted")
+
+
+def check(db: FirestoreDB) -> bool:
+    legacy = sum(len(legacy_documents(page)) for page in iter_pages(db))
+    print(f"[check] documents to migrate: {legacy}")
+    return not legacy
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Collapse the actions collection to one document per (user, item)")
+    parser.add_argument("command", choices=["migrate", "check"])
+    args = parser.parse_args()
+
+    db = FirestoreDB()
+    if args.command == "migrate":
+        migrate(db)
+    elif not check(db):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
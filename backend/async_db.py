@@ -0,0 +1,48 @@
+# async_db.py
+# Non-blocking facade over FirestoreDB for the async FastAPI routes.
+import os
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from db import FirestoreDB
+
+
+FIRESTORE_MAX_WORKERS = int(os.getenv("FIRESTORE_MAX_WORKERS", 32))
+
+
+class AsyncFirestoreDB:
+    """
+    Same surface as FirestoreDB, but every method is a coroutine: the blocking
+    Firestore call runs on a bounded thread pool dedicated to the data layer,
+    so the event loop (and every WebSocket on it) keeps running while Firestore
+    round-trips. The pool size bounds concurrent Firestore calls per worker.
+    """
+
+    def __init__(self, db: Optional[FirestoreDB] = None, max_workers: int = FIRESTORE_MAX_WORKERS):
+        self.sync = db or FirestoreDB()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="firestore")
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        """
+        Run any blocking callable (e.g. a matching_service function) on the pool.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.sync, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def method(*args, **kwargs):
+            return await self.run(attr, *args, **kwargs)
+
+        # Cache the wrapper so later lookups skip __getattr__
+        setattr(self, name, method)
+        return method
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,110 @@
+# bench_image_checks.py
+# Compares serial photo validation (download, then check, one photo at a time)
+# with the concurrent image_checks pipeline, against a local HTTP server that
+# serves generated photos with a simulated network latency.
+#
+# Usage (from backend/):
+#   python -m benchmarks.bench_image_checks --items 20 --photos 5 --latency-ms 100
+import io
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+import statistics
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import numpy as np
+from PIL import Image
+
+from image_checks import ImageCheckPipeline, run_checks, IMAGE_CHECKS
+
+
+def make_photos(directory: str, n: int, width: int, height: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    names = []
+    for i in range(n):
+        # Smooth gradient plus noise: compresses like a photo, not like a flat fill
+        gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+        pixels = np.clip(gradient + rng.normal(0, 40, (height, width, 3)), 0, 255).astype(np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, format="JPEG", quality=85)
+        name = f"photo{i}.jpg"
+        with open(f"{directory}/{name}", "wb") as f:
+            f.write(buffer.getvalue())
+        names.append(name)
+    return names
+
+
+def start_server(directory: str, latency: float):
+    class Handler(SimpleHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            super().do_GET()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(Handler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def check_serial(urls):
+    """
+    The pre-pipeline shape: one photo after the other, inline in the request.
+    """
+    for url in urls:
+        data = httpx.get(url).content
+        result = run_checks(data, IMAGE_CHECKS)
+        if result is not True:
+            return result
+    return True
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as directory:
+        names = make_photos(directory, args.photos, args.width, args.height)
+        server, base_url = start_server(directory, args.latency_ms / 1000)
+        urls = [f"{base_url}/{name}" for name in names]
+
+        serial = []
+        for _ in range(args.items):
+            start = time.perf_counter()
+            assert await asyncio.to_thread(check_serial, urls) is True
+            serial.append(time.perf_counter() - start)
+
+        # The stand-in server is local: allow it like tests do
+        pipeline = ImageCheckPipeline(max_workers=args.workers, allowed_hosts=["127.0.0.1"], allow_local=True)
+        pipeline.start()
+        await pipeline.check_images(urls[:1])  # warm the process pool
+        concurrent = []
+        for _ in range(args.items):
+            start = time.perf_counter()
+            assert await pipeline.check_images(urls) is True
+            concurrent.append(time.perf_counter() - start)
+        await pipeline.stop()
+        server.shutdown()
+
+    print(f"{args.photos} photos of {args.width}x{args.height}, {args.latency_ms} ms simulated latency, "
+          f"checks={','.join(IMAGE_CHECKS)}, workers={args.workers}")
+    print(f"{'path':<10} {'p50 ms':>9} {'max ms':>9}")
+    for name, timings in (("serial", serial), ("pipeline", concurrent)):
+        print(f"{name:<10} {statistics.median(timings) * 1000:9.1f} {max(timings) * 1000:9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serial vs concurrent item photo validation")
+    parser.add_argument("--items", type=int, default=20)
+    parser.add_argument("--photos", type=int, default=5)
+    parser.add_argument("--width", type=int, default=1600)
+    parser.add_argument("--height", type=int, default=1200)
+    parser.add_argument("--latency-ms", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=4)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# bench_ranking.py
+# Compares the pure-Python candidate filter/rank path with the NumPy kernel.
+#
+# Usage (from backend/):
+#   python -m benchmarks.bench_ranking --sizes 10000 100000 1000000 --k 20
+import argparse
+import math
+import random
+import time
+
+import numpy as np
+
+from item_index import ItemIndex
+
+
+CATEGORIES = ["tops", "pants_shorts", "dresses_skirts", "jackets_sweaters", "shoes", "accessories"]
+SIZES = ["XS", "S", "M", "L", "XL"]
+
+
+def make_items(n: int, n_owners: int, seed: int = 0):
+    rng = random.Random(seed)
+    items = []
+    for i in range(n):
+        item = {
+            "id": f"item{i}",
+            "ownerId": f"user{rng.randrange(n_owners)}",
+            "category": rng.choice(CATEGORIES),
+            "size": rng.choice(SIZES),
+        }
+        if rng.random() < 0.9:
+            item["location"] = {"lat": rng.uniform(36.0, 43.5), "lng": rng.uniform(-9.0, 3.3)}
+        items.append(item)
+    return items
+
+
+def python_rank(all_items, user_id, excluded_item_ids, size_prefs, location, k):
+    """
+    The pre-kernel matcher: per-item closures, then a full sort.
+    """
+    available_items = [
+        item for item in all_items
+        if item.get("ownerId") != user_id and item.get("id") not in excluded_item_ids
+    ]
+
+    def matches_size(item):
+        item_size = item.get("size")
+        item_category = item.get("category")
+        if not item_size or not item_category:
+            return False
+        allowed_sizes = size_prefs.get(item_category)
+        if allowed_sizes and isinstance(allowed_sizes, list):
+            return item_size in allowed_sizes
+        return False
+    available_items = [item for item in available_items if matches_size(item)]
+
+    def distance(item):
+        loc = item.get("location")
+        if loc and "lat" in loc and "lng" in loc:
+            R = 6371
+            dlat = math.radians(loc["lat"] - location["lat"])
+            dlon = math.radians(loc["lng"] - location["lng"])
+            a = math.sin(dlat/2)**2 + math.cos(math.radians(location["lat"])) * math.cos(math.radians(loc["lat"])) * math.sin(dlon/2)**2
+            c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+            return R * c
+        return float('inf')
+    available_items.sort(key=distance)
+    return available_items[:k]
+
+
+def timed(fn, repeat: int):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def run(n: int, k: int, repeat: int):
+    items = make_items(n, n_owners=max(10, n // 20))
+    index = ItemIndex()
+    index.load(items)
+    user_id = "user1"
+    rng = random.Random(1)
+    excluded = {f"item{rng.randrange(n)}" for _ in range(2000)}
+    size_prefs = {"tops": ["S", "M"], "pants_shorts": ["M"], "shoes": ["L", "XL"]}
+    location = {"lat": 41.39, "lng": 2.17}
+
+    py_time, py_result = timed(lambda: python_rank(items, user_id, excluded, size_prefs, location, k), repeat)
+    excluded_ordinals = np.array([index.ordinal(i) for i in excluded], dtype=np.int64)
+    np_time, np_result = timed(lambda: index.select(user_id, excluded_ordinals, size_prefs, location, k=k), repeat)
+    same = [i["id"] for i in py_result] == [i["id"] for i in np_result]
+    print(f"n={n:>9,}  python={py_time * 1000:9.2f} ms  kernel={np_time * 1000:8.2f} ms  "
+          f"speedup={py_time / np_time:6.1f}x  same_top_{k}={same}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark candidate ranking: pure Python vs NumPy kernel")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    for n in args.sizes:
+        run(n, args.k, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+# load_test.py
+# Seeds synthetic users, items and actions into the in-memory store, boots the
+# app in-process and drives the swipe, match and chat hot paths.
+#
+# Usage (from backend/):
+#   pip install -r benchmarks/requirements.txt
+#   python -m benchmarks.load_test --users 1000 --items 20000 --actions 50000 \
+#       --requests 2000 --concurrency 32 --mix match=50,action=30,matches=10,chat_list=5,ws_chat=5 \
+#       --output bench_output.json
+#
+# Latency and throughput come from the mixed phase. Store operations per request
+# come from a short sequential calibration phase per scenario, since the store
+# counters are process-wide.
+import os
+os.environ.setdefault("CIRCLOTH_STORE", "memory")
+
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import logging
+import socket
+import subprocess
+import threading
+import statistics
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+import httpx
+import uvicorn
+import websockets
+
+from benchmarks.bench_ranking import CATEGORIES, SIZES
+from db import get_action_id
+
+
+# --- Seeding ---
+def seed(client, n_users: int, n_items: int, n_actions: int, n_chats: int, rng: random.Random):
+    now = datetime.utcnow()
+    users = [f"user{i}" for i in range(n_users)]
+    batch = client.batch()
+    ops = 0
+
+    def write(ref, data):
+        nonlocal batch, ops
+        batch.set(ref, data)
+        ops += 1
+        if ops % 500 == 0:
+            batch.commit()
+            batch = client.batch()
+
+    for user_id in users:
+        write(client.collection("users").document(user_id), {
+            "id": user_id,
+            "name": user_id,
+            "created_at": now.isoformat() + "Z",
+            "size_preferences": {c: rng.sample(SIZES, 2) for c in rng.sample(CATEGORIES, 3)},
+        })
+    items = []
+    for i in range(n_items):
+        item = {
+            "id": f"item{i}",
+            "ownerId": rng.choice(users),
+            "category": rng.choice(CATEGORIES),
+            "size": rng.choice(SIZES),
+            "itemStory": "story",
+            "photoURLs": [f"https://example.com/item{i}.jpg"],
+            "location": {"lat": rng.uniform(41.2, 41.6), "lng": rng.uniform(1.9, 2.3)},
+            "created_at": now.isoformat() + "Z",
+        }
+        items.append(item)
+        write(client.collection("items").document(item["id"]), item)
+    for _ in range(n_actions):
+        user_id = rng.choice(users)
+        item = rng.choice(items)
+        if item["ownerId"] == user_id:
+            continue
+        ts = now - timedelta(seconds=rng.randrange(7 * 24 * 3600))
+        write(client.collection("actions").document(get_action_id(user_id, item["id"])), {
+            "user_id": user_id,
+            "item_id": item["id"],
+            "action": "like" if rng.random() < 0.4 else "pass",
+            "timestamp": ts.isoformat() + "Z",
+        })
+    batch.commit()
+
+    chats = []
+    for _ in range(n_chats):
+        user1, user2 = rng.sample(users, 2)
+        chats.append((user1, user2))
+    return users, items, chats
+
+
+# --- Server ---
+def start_server():
+    import main
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    config = uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="error")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, f"http://127.0.0.1:{port}", f"ws://127.0.0.1:{port}"
+
+
+# --- Scenarios ---
+class Scenarios:
+    def __init__(self, http: httpx.AsyncClient, ws_url: str, users, items, chats, rng: random.Random):
+        self.http = http
+        self.ws_url = ws_url
+        self.users = users
+        self.items = items
+        self.chats = chats
+        self.rng = rng
+
+    async def match(self):
+        user_id = self.rng.choice(self.users)
+        body = {"user_id": user_id, "filter_by_size": self.rng.random() < 0.3}
+        if self.rng.random() < 0.5:
+            body["location"] = {"lat": self.rng.uniform(41.2, 41.6), "lng": self.rng.uniform(1.9, 2.3)}
+        r = await self.http.post("/match", json=body)
+        r.raise_for_status()
+
+    async def action(self):
+        r = await self.http.post("/action", json={
+            "user_id": self.rng.choice(self.users),
+            "item_id": self.rng.choice(self.items)["id"],
+            "action": self.rng.choice(["like", "pass"]),
+        })
+        r.raise_for_status()
+
+    async def matches(self):
+        r = await self.http.get(f"/matches/{self.rng.choice(self.users)}")
+        r.raise_for_status()
+
+    async def chat_list(self):
+        user1, user2 = self.rng.choice(self.chats)
+        r = await self.http.post("/chat/list", json={"user1": user1, "user2": user2, "limit": 50})
+        r.raise_for_status()
+
+    async def ws_chat(self):
+        """
+        Round trip of one message through /ws/chat: send, then wait for the broadcast.
+        """
+        user1, user2 = self.rng.choice(self.chats)
+        async with websockets.connect(f"{self.ws_url}/ws/chat/{user1}/{user2}") as ws:
+            content = f"msg-{self.rng.random()}"
+            await ws.send(json.dumps({"sender": user1, "receiver": user2, "content": content}))
+            while True:
+                data = json.loads(await asyncio.wait_for(ws.recv(), timeout=10))
+                if data.get("content") == content:
+                    return
+
+
+def percentile(samples, q: float) -> float:
+    if len(samples) < 2:
+        return samples[0] if samples else 0.0
+    return statistics.quantiles(samples, n=100, method="inclusive")[int(q) - 1]
+
+
+async def run_mixed(scenarios: Scenarios, mix: dict, n_requests: int, concurrency: int, rng: random.Random):
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    plan = rng.choices(names, weights=weights, k=n_requests)
+    latencies = defaultdict(list)
+    errors = Counter()
+    queue = asyncio.Queue()
+    for name in plan:
+        queue.put_nowait(name)
+
+    async def worker():
+        while True:
+            try:
+                name = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            start = time.perf_counter()
+            try:
+                await getattr(scenarios, name)()
+                latencies[name].append((time.perf_counter() - start) * 1000)
+            except Exception as e:
+                errors[name] += 1
+                logging.debug(f"{name} failed: {e}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    return latencies, errors, elapsed
+
+
+async def calibrate_store_ops(scenarios: Scenarios, store, names, n: int) -> dict:
+    ops_per_request = {}
+    for name in names:
+        before = Counter(store.ops)
+        for _ in range(n):
+            await getattr(scenarios, name)()
+        after = Counter(store.ops)
+        ops_per_request[name] = {k: round((after[k] - before[k]) / n, 2) for k in after}
+    return ops_per_request
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+async def main_async(args):
+    from storage import get_client
+    store = get_client()
+    rng = random.Random(args.seed)
+    mix = {k: float(v) for k, v in (part.split("=") for part in args.mix.split(","))}
+
+    t0 = time.perf_counter()
+    users, items, chats = seed(store, args.users, args.items, args.actions, args.chats, rng)
+    seed_seconds = time.perf_counter() - t0
+    server, http_url, ws_url = start_server()
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=http_url, limits=limits, timeout=30) as http:
+        scenarios = Scenarios(http, ws_url, users, items, chats, rng)
+        # Warm up the in-memory indexes before measuring
+        await scenarios.match()
+        await scenarios.matches()
+        ops_per_request = await calibrate_store_ops(scenarios, store, list(mix), args.calibration)
+        latencies, errors, elapsed = await run_mixed(scenarios, mix, args.requests, args.concurrency, rng)
+
+    server.should_exit = True
+
+    results = {}
+    for name in mix:
+        samples = latencies.get(name, [])
+        results[name] = {
+            "count": len(samples),
+            "errors": errors[name],
+            "p50_ms": round(percentile(samples, 50), 3),
+            "p95_ms": round(percentile(samples, 95), 3),
+            "p99_ms": round(percentile(samples, 99), 3),
+            "mean_ms": round(statistics.fmean(samples), 3) if samples else 0.0,
+            "rps": round(len(samples) / elapsed, 1),
+            "store_ops_per_request": ops_per_request.get(name, {}),
+        }
+    total = sum(len(v) for v in latencies.values())
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "params": vars(args),
+        "seed_seconds": round(seed_seconds, 2),
+        "elapsed_seconds": round(elapsed, 3),
+        "total_rps": round(total / elapsed, 1),
+        "results": results,
+    }
+
+    print(f"{'scenario':<10} {'count':>6} {'err':>4} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'rps':>8}  store ops/req")
+    for name, r in results.items():
+        ops = ", ".join(f"{k}={v}" for k, v in sorted(r["store_ops_per_request"].items()) if v)
+        print(f"{name:<10} {r['count']:>6} {r['errors']:>4} {r['p50_ms']:>8} {r['p95_ms']:>8} {r['p99_ms']:>8} {r['rps']:>8}  {ops}")
+    print(f"total: {total} requests in {elapsed:.2f}s ({report['total_rps']} req/s), commit {report['commit']}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+        print(f"results written to {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the swipe, match and chat hot paths against the in-memory store")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--items", type=int, default=10000)
+    parser.add_argument("--actions", type=int, default=20000)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--mix", default="match=50,action=30,matches=10,chat_list=5,ws_chat=5",
+                        help="comma-separated scenario=weight (match, action, matches, chat_list, ws_chat)")
+    parser.add_argument("--calibration", type=int, default=20, help="sequential requests per scenario for store op counts")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write machine-readable results (JSON) to this file")
+    args = parser.parse_args()
+    if os.environ["CIRCLOTH_STORE"] != "memory":
+        sys.exit("The load test seeds synthetic data and must run with CIRCLOTH_STORE=memory")
+    logging.getLogger().setLevel(logging.ERROR)
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
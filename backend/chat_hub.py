@@ -0,0 +1,195 @@
+# chat_hub.py
+# Per-worker registry of chat websockets with per-connection outbound queues.
+#
+# Every connection gets a bounded queue and its own writer task, so a broadcast
+# only enqueues and one slow client never delays the rest of the room. When a
+# queue is full the slow-consumer policy applies:
+#   drop_oldest (default) - discard the oldest queued message
+#   drop_newest           - discard the new message
+#   disconnect            - close the connection
+# A heartbeat ping is queued on every connection each CHAT_HEARTBEAT_SECONDS,
+# which clients answer with a pong. A connection the client has sent nothing on
+# (pong or message) for two intervals is evicted: a finished send does not
+# prove a half-open connection is alive.
+import os
+import time
+import asyncio
+import logging
+from collections import Counter, defaultdict
+from typing import Dict, Optional, Set
+
+from fastapi import WebSocket
+
+from metrics import Histogram, registry
+
+
+CHAT_QUEUE_SIZE = int(os.getenv("CHAT_QUEUE_SIZE", 100))
+CHAT_SLOW_CONSUMER_POLICY = os.getenv("CHAT_SLOW_CONSUMER_POLICY", "drop_oldest")
+CHAT_SEND_TIMEOUT_SECONDS = int(os.getenv("CHAT_SEND_TIMEOUT_SECONDS", 10))
+CHAT_HEARTBEAT_SECONDS = int(os.getenv("CHAT_HEARTBEAT_SECONDS", 30))
+
+PING = {"type": "ping"}
+
+
+class ChatConnection:
+    def __init__(self, hub: "ChatHub", websocket: WebSocket, room_id: str):
+        self.hub = hub
+        self.websocket = websocket
+        self.room_id = room_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=hub.queue_size)
+        self.last_received = time.monotonic()
+        self.closed = False
+        self.writer: Optional[asyncio.Task] = None
+
+    def received(self):
+        """
+        Record a frame from the client (any frame, pongs included).
+        """
+        self.last_received = time.monotonic()
+
+    def enqueue(self, message: dict) -> bool:
+        """
+        Queue a message for this connection; False if it was dropped.
+        """
+        if self.closed:
+            return False
+        item = (time.perf_counter(), message)
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except asyncio.QueueFull:
+            pass
+        policy = self.hub.slow_consumer_policy
+        if policy == "disconnect":
+            self.hub.stats["slow_consumer_disconnects"] += 1
+            self.hub.evict(self)
+            return False
+        self.hub.stats["messages_dropped"] += 1
+        if policy == "drop_newest":
+            return False
+        self.queue.get_nowait()
+        self.queue.put_nowait(item)
+        return True
+
+    async def run_writer(self):
+        while True:
+            enqueued_at, message = await self.queue.get()
+            try:
+                await asyncio.wait_for(self.websocket.send_json(message), timeout=self.hub.send_timeout)
+            except Exception as e:
+                self.hub.stats["send_errors"] += 1
+                logging.info(f"[CHAT] dropping connection in room {self.room_id}: {e!r}")
+                self.hub.evict(self)
+                return
+            if message is not PING:
+                self.hub.stats["messages_sent"] += 1
+                self.hub.send_latency.observe(time.perf_counter() - enqueued_at)
+
+
+class ChatHub:
+    def __init__(self, queue_size: int = CHAT_QUEUE_SIZE, slow_consumer_policy: str = CHAT_SLOW_CONSUMER_POLICY,
+                 send_timeout: float = CHAT_SEND_TIMEOUT_SECONDS, heartbeat_seconds: float = CHAT_HEARTBEAT_SECONDS):
+        if slow_consumer_policy not in ("drop_oldest", "drop_newest", "disconnect"):
+            raise ValueError(f"Unknown CHAT_SLOW_CONSUMER_POLICY: {slow_consumer_policy}")
+        self.queue_size = queue_size
+        self.slow_consumer_policy = slow_consumer_policy
+        self.send_timeout = send_timeout
+        self.heartbeat_seconds = heartbeat_seconds
+        self.rooms: Dict[str, Set[ChatConnection]] = defaultdict(set)
+        self.stats: Counter = Counter()  # messages_sent, messages_dropped, send_errors, slow_consumer_disconnects, heartbeat_evictions
+        self.send_latency = Histogram("circloth_chat_send_latency_seconds", "Time from broadcast to websocket send completion")
+        self._heartbeat_task: Optional[asyncio.Task] = None
+
+    def connect(self, websocket: WebSocket, room_id: str) -> ChatConnection:
+        """
+        Register an accepted websocket and start its writer task.
+        """
+        conn = ChatConnection(self, websocket, room_id)
+        conn.writer = asyncio.ensure_future(conn.run_writer())
+        self.rooms[room_id].add(conn)
+        return conn
+
+    def _detach(self, conn: ChatConnection) -> bool:
+        """
+        Unregister a connection and stop its writer; False if already detached.
+        """
+        if conn.closed:
+            return False
+        conn.closed = True
+        room = self.rooms.get(conn.room_id)
+        if room is not None:
+            room.discard(conn)
+            if not room:
+                del self.rooms[conn.room_id]
+        if conn.writer and conn.writer is not asyncio.current_task():
+            conn.writer.cancel()
+        return True
+
+    async def _close(self, conn: ChatConnection):
+        if conn.writer and conn.writer is not asyncio.current_task():
+            await asyncio.gather(conn.writer, return_exceptions=True)
+        try:
+            await conn.websocket.close()
+        except Exception:
+            pass  # already closed by the client
+
+    async def disconnect(self, conn: ChatConnection):
+        if self._detach(conn):
+            await self._close(conn)
+
+    def evict(self, conn: ChatConnection):
+        """
+        Disconnect without waiting (from a broadcast or a writer task).
+        """
+        if self._detach(conn):
+            asyncio.ensure_future(self._close(conn))
+
+    def broadcast(self, room_id: str, message: dict) -> int:
+        """
+        Queue a message on every connection of the room in this worker; returns
+        how many accepted it. Never waits on a socket.
+        """
+        return sum(conn.enqueue(message) for conn in list(self.rooms.get(room_id, ())))
+
+    # --- Heartbeats ---
+    async def start(self):
+        if self._heartbeat_task is None:
+            self._heartbeat_task = asyncio.ensure_future(self._heartbeat_loop())
+
+    async def stop(self):
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+        for conn in [c for room in self.rooms.values() for c in room]:
+            await self.disconnect(conn)
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            await self.heartbeat()
+
+    async def heartbeat(self):
+        now = time.monotonic()
+        for conn in [c for room in self.rooms.values() for c in room]:
+            if now - conn.last_received > 2 * self.heartbeat_seconds:
+                # No pong (nor anything else) from the client for two pings
+                self.stats["heartbeat_evictions"] += 1
+                self.evict(conn)
+                continue
+            conn.enqueue(PING)
+
+    # --- Metrics ---
+    def collect(self):
+        connections = [c for room in self.rooms.values() for c in room]
+        depths = [c.queue.qsize() for c in connections]
+        yield ("circloth_chat_connections", "gauge", "Connected chat websockets in this worker", [({}, len(connections))])
+        yield ("circloth_chat_rooms", "gauge", "Chat rooms with a connected websocket in this worker", [({}, len(self.rooms))])
+        yield ("circloth_chat_queue_depth", "gauge", "Messages queued across chat connections", [({}, sum(depths))])
+        yield ("circloth_chat_queue_depth_max", "gauge", "Deepest chat connection queue", [({}, max(depths, default=0))])
+        for counter in ("messages_sent", "messages_dropped", "send_errors", "slow_consumer_disconnects", "heartbeat_evictions"):
+            yield (f"circloth_chat_{counter}_total", "counter", f"Chat {counter.replace('_', ' ')}", [({}, self.stats[counter])])
+        yield from self.send_latency.collect()
+
+
+chat_hub = ChatHub()
+registry.register(chat_hub.collect)
@@ -0,0 +1,359 @@
+# chat_writer.py
+# Write-behind persistence for websocket chat messages.
+#
+# The websocket handler delivers a message first and then enqueues it here. A
+# flusher thread writes the queued messages of each room in one batched commit
+# (messages + last_message from the in-hand newest message), creating the chat
+# document only the first time this worker sees the room.
+#
+# Durability: every message gets its id before it is queued (so re-writing is
+# idempotent) and is appended to a local journal by a journal thread, so the
+# event loop never waits on the disk. The journal is a series of segments
+# rotated every CHAT_JOURNAL_SEGMENT_MESSAGES messages; a segment is deleted
+# once all of its messages are committed, so messages are written to the
+# journal once however long they stay queued. Failed rooms are retried with
+# backoff. Segments left by a crashed worker are replayed at startup; each live
+# segment is flock()ed, so workers never replay each other's. stop() flushes.
+import os
+import glob
+import json
+import time
+import logging
+import tempfile
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: no journal
+    fcntl = None
+
+from db import FirestoreDB, compare_to_cursor, new_message_id
+from metrics import Histogram
+
+
+CHAT_FLUSH_INTERVAL_MS = int(os.getenv("CHAT_FLUSH_INTERVAL_MS", 50))
+CHAT_FLUSH_MAX_MESSAGES = int(os.getenv("CHAT_FLUSH_MAX_MESSAGES", 200))
+CHAT_FLUSH_SHUTDOWN_TIMEOUT_SECONDS = int(os.getenv("CHAT_FLUSH_SHUTDOWN_TIMEOUT_SECONDS", 10))
+CHAT_RETRY_MAX_BACKOFF_SECONDS = int(os.getenv("CHAT_RETRY_MAX_BACKOFF_SECONDS", 30))
+CHAT_KNOWN_ROOMS = int(os.getenv("CHAT_KNOWN_ROOMS", 100000))
+# Empty disables the journal (messages queued at a crash are then lost)
+CHAT_JOURNAL_DIR = os.getenv("CHAT_JOURNAL_DIR", os.path.join(tempfile.gettempdir(), "circloth-chat-journal"))
+CHAT_JOURNAL_FSYNC = os.getenv("CHAT_JOURNAL_FSYNC", "0") == "1"
+CHAT_JOURNAL_SEGMENT_MESSAGES = int(os.getenv("CHAT_JOURNAL_SEGMENT_MESSAGES", 10000))
+
+
+class _Segment:
+    """
+    One append-only, flock()ed journal file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "a", encoding="utf-8")
+        fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self.written = 0
+        self.outstanding = 0  # journaled messages not committed yet
+
+    def append_many(self, records: List[dict]):
+        self.file.write("".join(json.dumps(record) + "\n" for record in records))
+        self.file.flush()
+        if CHAT_JOURNAL_FSYNC:
+            os.fsync(self.file.fileno())
+        self.written += len(records)
+
+    def delete(self):
+        os.unlink(self.path)
+        self.file.close()
+
+
+class ChatWriter:
+    def __init__(self, db: Optional[FirestoreDB] = None, journal_dir: str = CHAT_JOURNAL_DIR):
+        self.db = db or FirestoreDB()
+        self.journal_dir = journal_dir if (journal_dir and fcntl) else None
+        self._cond = threading.Condition()
+        self._pending: "OrderedDict[str, List[dict]]" = OrderedDict()  # room_id -> [record]
+        self._pending_count = 0
+        self._retry_at: Dict[str, float] = {}
+        self._failures: Dict[str, int] = {}
+        self._known_rooms: "OrderedDict[str, None]" = OrderedDict()
+        # Journal state, guarded by _journal_cond (never held by the event loop for I/O)
+        self._journal_cond = threading.Condition()
+        self._journal_buffer: List[dict] = []
+        self._segment: Optional[_Segment] = None
+        self._segment_seq = 0
+        self._segment_of: Dict[str, _Segment] = {}  # message id -> segment, until committed
+        self._committed_early: Set[str] = set()  # committed before the journal thread reached them
+        self._journal_thread: Optional[threading.Thread] = None
+        self._journal_stopping = False
+        self._in_flight = 0
+        self._taken: Dict[str, List[dict]] = {}  # room_id -> records being committed
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self.stats: Counter = Counter()  # enqueued, persisted, batches, failures, replayed
+        self.flush_latency = Histogram("circloth_chat_flush_latency_seconds", "Write-behind chat batch commit latency")
+
+    # --- Producer side ---
+    def enqueue(self, sender: str, receiver: str, content: str, timestamp: str) -> dict:
+        """
+        Queue a message for persistence and return it (with its id). Only
+        hands it to the journal thread; never waits on the disk or Firestore.
+        """
+        record = {
+            "room_id": self.db._get_conversation_id(sender, receiver),
+            "id": new_message_id(timestamp),
+            "sender": sender,
+            "receiver": receiver,
+            "content": content,
+            "timestamp": timestamp,
+        }
+        with self._cond:
+            self._add_pending([record])
+            self.stats["enqueued"] += 1
+            if self._pending_count >= CHAT_FLUSH_MAX_MESSAGES:
+                self._cond.notify()
+        if self.journal_dir:
+            with self._journal_cond:
+                self._journal_buffer.append(record)
+                self._journal_cond.notify()
+        return record
+
+    def _add_pending(self, records: List[dict]):
+        for record in records:
+            self._pending.setdefault(record["room_id"], []).append(record)
+        self._pending_count += len(records)
+
+    def pending_count(self) -> int:
+        return self._pending_count
+
+    def merge_pending(self, user1: str, user2: str, page: dict, limit: int,
+                      before: Optional[Tuple[str, Optional[str]]] = None,
+                      after: Optional[Tuple[str, Optional[str]]] = None) -> dict:
+        """
+        Add this worker's not-yet-committed messages of a chat to a page from
+        FirestoreDB.get_chat_messages (same before/after cursors), so a
+        sender reads its own writes.
+        """
+        room_id = self.db._get_conversation_id(user1, user2)
+        with self._cond:
+            records = self._taken.get(room_id, []) + self._pending.get(room_id, [])
+        records = [
+            r for r in records
+            if (not before or compare_to_cursor(r, before) < 0) and (not after or compare_to_cursor(r, after) > 0)
+        ]
+        if not records:
+            return page
+        messages = page["messages"]
+        seen = {m.get("id") for m in messages}
+        merged = messages + [{k: v for k, v in r.items() if k != "room_id"} for r in records if r["id"] not in seen]
+        merged.sort(key=lambda m: (m["timestamp"], m.get("id") or ""))
+        has_more = page["has_more"] or len(merged) > limit
+        # Pages read forward (after) keep the oldest messages, the others the newest
+        merged = merged[:limit] if after else merged[-limit:]
+        return {"messages": merged, "has_more": has_more}
+
+    # --- Lifecycle ---
+    def start(self):
+        if self._thread:
+            return
+        if self.journal_dir:
+            os.makedirs(self.journal_dir, exist_ok=True)
+            self._replay_orphaned_segments()
+            if self._segment is None:
+                self._segment = self._new_segment()
+            self._journal_stopping = False
+            self._journal_thread = threading.Thread(target=self._run_journal, name="chat-journal", daemon=True)
+            self._journal_thread.start()
+        self._thread = threading.Thread(target=self._run, name="chat-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = CHAT_FLUSH_SHUTDOWN_TIMEOUT_SECONDS) -> bool:
+        """
+        Flush everything queued (retrying failed rooms until timeout) and stop.
+        Returns False if messages were left unpersisted (they stay journaled).
+        """
+        if not self._thread:
+            return True
+        with self._cond:
+            self._stopping = True
+            self._retry_at.clear()
+            self._cond.notify()
+        self._thread.join(timeout)
+        self._thread = None
+        if self._journal_thread:
+            with self._journal_cond:
+                self._journal_stopping = True
+                self._journal_cond.notify()
+            self._journal_thread.join(timeout)
+            self._journal_thread = None
+        left = self._pending_count + self._in_flight
+        if left:
+            logging.error(f"[CHAT] {left} messages not persisted at shutdown" + (" (kept in journal)" if self.journal_dir else ""))
+        elif self._segment:
+            self._segment.delete()
+            self._segment = None
+        return left == 0
+
+    def _new_segment(self) -> _Segment:
+        self._segment_seq += 1
+        return _Segment(os.path.join(self.journal_dir, f"{os.getpid()}-{int(time.time())}-{self._segment_seq}.jsonl"))
+
+    def _replay_orphaned_segments(self):
+        """
+        Queue the messages of segments no live writer holds a lock on.
+        """
+        for path in sorted(glob.glob(os.path.join(self.journal_dir, "*.jsonl"))):
+            try:
+                segment = _Segment(path)
+            except (BlockingIOError, FileNotFoundError):
+                continue  # owned by a live writer, or already replayed
+            with open(path, encoding="utf-8") as f:
+                records = []
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line of a crashed write
+                    if record.get("id") not in self._segment_of:
+                        records.append(record)
+                        self._segment_of[record.get("id")] = None
+            # Re-journal into our own segment before dropping the orphan
+            with self._journal_cond:
+                if self._segment is None:
+                    self._segment = self._new_segment()
+                if records:
+                    self._segment.append_many(records)
+                for record in records:
+                    self._segment_of[record["id"]] = self._segment
+                self._segment.outstanding += len(records)
+            with self._cond:
+                self._add_pending(records)
+                self.stats["replayed"] += len(records)
+            segment.delete()
+            if records:
+                logging.warning(f"[CHAT] replaying {len(records)} unpersisted messages from {path}")
+
+    # --- Flusher ---
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._stopping:
+                    self._cond.wait(CHAT_FLUSH_INTERVAL_MS / 1000)
+                if self._stopping and not self._pending:
+                    return
+                # While stopping, retry failed rooms without waiting for their backoff
+                now = time.monotonic()
+                rooms = [room_id for room_id in self._pending if self._stopping or self._retry_at.get(room_id, 0) <= now]
+                if not rooms:
+                    continue
+                taken = {room_id: self._pending.pop(room_id) for room_id in rooms}
+                self._taken = taken
+                self._pending_count -= sum(len(records) for records in taken.values())
+                self._in_flight = sum(len(records) for records in taken.values())
+
+            failed = []
+            for room_id, records in taken.items():
+                if self._persist_room(room_id, records):
+                    self._acknowledge(records)
+                else:
+                    failed.extend(records)
+
+            with self._cond:
+                if failed:
+                    # Failed messages (still in their journal segments) go back
+                    # in front of anything queued meanwhile
+                    queued = self._pending
+                    self._pending = OrderedDict()
+                    self._add_pending(failed)
+                    for room_id, records in queued.items():
+                        self._pending.setdefault(room_id, []).extend(records)
+                self._in_flight = 0
+                self._taken = {}
+            if failed and self._stopping:
+                time.sleep(0.2)
+
+    # --- Journal ---
+    def _run_journal(self):
+        while True:
+            with self._journal_cond:
+                while not self._journal_buffer and not self._journal_stopping:
+                    self._journal_cond.wait()
+                if not self._journal_buffer:
+                    return
+                records, self._journal_buffer = self._journal_buffer, []
+                records = [r for r in records if not self._take_committed(r["id"])]
+                segment = self._segment
+                for record in records:
+                    self._segment_of[record["id"]] = segment
+                segment.outstanding += len(records)
+            if records:
+                try:
+                    segment.append_many(records)
+                except OSError as e:
+                    logging.error(f"[CHAT] journaling {len(records)} messages failed: {e}")
+            retired = None
+            with self._journal_cond:
+                if segment is self._segment and segment.written >= CHAT_JOURNAL_SEGMENT_MESSAGES:
+                    self._segment = self._new_segment()
+                    if segment.outstanding == 0:
+                        retired = segment
+            if retired:
+                retired.delete()
+
+    def _take_committed(self, message_id: str) -> bool:
+        if message_id in self._committed_early:
+            self._committed_early.discard(message_id)
+            return True
+        return False
+
+    def _acknowledge(self, records: List[dict]):
+        """
+        Mark committed messages; delete the retired segments left with none pending.
+        """
+        if not self.journal_dir:
+            return
+        retired = []
+        with self._journal_cond:
+            for record in records:
+                segment = self._segment_of.pop(record["id"], None)
+                if segment is None:
+                    self._committed_early.add(record["id"])
+                    continue
+                segment.outstanding -= 1
+                if segment.outstanding == 0 and segment is not self._segment and segment not in retired:
+                    retired.append(segment)
+        for segment in retired:
+            segment.delete()
+
+    def _persist_room(self, room_id: str, records: List[dict]) -> bool:
+        start = time.perf_counter()
+        try:
+            if room_id not in self._known_rooms:
+                self.db._ensure_chat_doc(records[0]["sender"], records[0]["receiver"], records[0]["timestamp"])
+            messages = [{k: v for k, v in record.items() if k != "room_id"} for record in records]
+            self.db.add_chat_messages(room_id, messages)
+        except Exception as e:
+            failures = self._failures.get(room_id, 0) + 1
+            self._failures[room_id] = failures
+            self._retry_at[room_id] = time.monotonic() + min(CHAT_RETRY_MAX_BACKOFF_SECONDS, 0.5 * 2 ** failures)
+            self.stats["failures"] += 1
+            logging.error(f"[CHAT] persisting {len(records)} messages of {room_id} failed (attempt {failures}): {e}")
+            return False
+        self.flush_latency.observe(time.perf_counter() - start)
+        self._known_rooms[room_id] = None
+        self._known_rooms.move_to_end(room_id)
+        while len(self._known_rooms) > CHAT_KNOWN_ROOMS:
+            self._known_rooms.popitem(last=False)
+        self._failures.pop(room_id, None)
+        self._retry_at.pop(room_id, None)
+        self.stats["persisted"] += len(records)
+        self.stats["batches"] += 1
+        return True
+
+    # --- Metrics ---
+    def collect(self):
+        yield ("circloth_chat_write_pending", "gauge", "Chat messages queued for persistence", [({}, self._pending_count + self._in_flight)])
+        for counter in ("enqueued", "persisted", "batches", "failures", "replayed"):
+            yield (f"circloth_chat_write_{counter}_total", "counter", f"Write-behind chat {counter}", [({}, self.stats[counter])])
+        yield from self.flush_latency.collect()
@@ -1,8 +1,149 @@
 # Firestore database logic for Circloth backend
-from firebase_admin import firestore
-from typing import List, Optional
-import json
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import os
+import logging
+import time
+import uuid
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from storage import get_client, increment, run_transaction, DESCENDING
+from item_index import item_index
+from match_engine import like_index, build_match_record, get_pair_id
+from metrics import store_metrics
+from doc_cache import user_cache, item_cache, user_items_cache
+from event_bus import bus, EventBus
+
+
+# Document references per get_all() call; chunks are fetched concurrently
+MULTI_GET_CHUNK_SIZE = int(os.getenv("MULTI_GET_CHUNK_SIZE", 100))
+MULTI_GET_MAX_WORKERS = int(os.getenv("MULTI_GET_MAX_WORKERS", 8))
+_multi_get_executor = ThreadPoolExecutor(max_workers=MULTI_GET_MAX_WORKERS, thread_name_prefix="multi-get")
+BATCH_SIZE = 500  # Firestore max writes per batch
+# Chat inbox entries keep a preview of the last message and a snippet of the other participant
+CHAT_PREVIEW_LENGTH = int(os.getenv("CHAT_PREVIEW_LENGTH", 140))
+# Reads of a chat within this long of the reader's last recorded access do not write it again
+CHAT_LAST_ACCESS_MIN_INTERVAL_SECONDS = int(os.getenv("CHAT_LAST_ACCESS_MIN_INTERVAL_SECONDS", 30))
+INBOX_USER_FIELDS = ("name",)
+
+
+def new_message_id(timestamp: str) -> str:
+    """
+    Chat message ids sort by time and are assigned once, before persistence,
+    so a retried write cannot duplicate a message.
+    """
+    return f"{timestamp}_{uuid.uuid4().hex[:12]}"
+
+
+def get_message_timestamp(message_id: str) -> Optional[str]:
+    """
+    Timestamp embedded in a message id from new_message_id; None for older ids.
+    """
+    timestamp, _, suffix = message_id.rpartition("_")
+    if len(suffix) != 12 or not timestamp.endswith("Z"):
+        return None
+    try:
+        datetime.fromisoformat(timestamp[:-1])
+    except ValueError:
+        return None
+    return timestamp
+
+
+def _accessed_within(last_access: Optional[str], seconds: float) -> bool:
+    if not last_access or seconds <= 0:
+        return False
+    try:
+        accessed_at = datetime.fromisoformat(last_access.replace("Z", ""))
+    except ValueError:
+        return False
+    return (datetime.utcnow() - accessed_at).total_seconds() < seconds
+
+
+def compare_to_cursor(message: dict, cursor: Tuple[str, Optional[str]]) -> int:
+    """
+    -1, 0 or 1 as a message sorts before, at or after a history cursor in
+    (timestamp, id) order. A cursor without id compares timestamps only.
+    """
+    timestamp, message_id = cursor
+    key, cursor_key = (message["timestamp"], message.get("id") or ""), (timestamp, message_id)
+    if not message_id:
+        key, cursor_key = key[0], timestamp
+    return (key > cursor_key) - (key < cursor_key)
+
+
+def get_user_snippet(user: Optional[dict]) -> dict:
+    user = user or {}
+    return {field: user.get(field) for field in INBOX_USER_FIELDS}
+
+
+def get_message_preview(message: dict) -> dict:
+    preview = {k: v for k, v in message.items() if k != "id"}
+    preview["content"] = (preview.get("content") or "")[:CHAT_PREVIEW_LENGTH]
+    return preview
+
+
+def build_inbox_entry(conv_id: str, user_id: str, other_id: str) -> dict:
+    """
+    Identity fields of the inbox entry users/{user_id}/inbox/{conv_id}.
+    """
+    return {"id": conv_id, "participants": sorted([user_id, other_id]), "other_user_id": other_id}
+
+
+def get_action_id(user_id: str, item_id: str) -> str:
+    """
+    Actions are keyed by (user, item): at most one stored action per swipe target.
+    """
+    return f"{user_id}__{item_id}"
+
+
+def invalidate_item_caches(item_id: str, owner_id: Optional[str]):
+    item_cache.invalidate(item_id)
+    if owner_id:
+        user_items_cache.invalidate(owner_id)
+    else:
+        # Owner unknown (item not indexed yet): drop every cached listing
+        user_items_cache.clear()
+
+
+def register_event_handlers(event_bus: EventBus):
+    """
+    Apply the change events published by the FirestoreDB writes of other
+    workers to this worker's caches and indexes.
+    """
+    def on_user_updated(payload):
+        user_cache.invalidate(payload["user_id"])
+
+    def on_item_updated(payload):
+        item_id = payload["item_id"]
+        if payload.get("deleted"):
+            item_index.remove(item_id)
+        elif payload.get("merge") and item_index.get(item_id) is None:
+            # A patch of an item this worker has not loaded yet: its next resync reads it whole
+            pass
+        else:
+            item_index.upsert(item_id, payload["data"], merge=payload.get("merge", False))
+        invalidate_item_caches(item_id, payload.get("owner_id"))
+
+    def on_action_saved(payload):
+        like_index.remove_like(payload["user_id"], payload["item_id"])
+        if payload["action"] == "like":
+            like_index.add_like(payload["user_id"], payload["item_id"])
+
+    def on_action_deleted(payload):
+        like_index.remove_like(payload["user_id"], payload["item_id"])
+
+    def on_item_likes_removed(payload):
+        like_index.remove_item(payload["item_id"])
+
+    def on_user_actions_deleted(payload):
+        like_index.remove_user_likes(payload["user_id"])
+
+    event_bus.subscribe("user_updated", on_user_updated)
+    event_bus.subscribe("item_updated", on_item_updated)
+    event_bus.subscribe("action_saved", on_action_saved)
+    event_bus.subscribe("action_deleted", on_action_deleted)
+    event_bus.subscribe("item_likes_removed", on_item_likes_removed)
+    event_bus.subscribe("user_actions_deleted", on_user_actions_deleted)
 
 
 class FirestoreDB:
@@ -17,192 +158,349 @@ class FirestoreDB:
         """
         Returns all items of profile_user_id that were liked by visitor_user_id.
         """
-        actions_ref = self.db.collection("actions")
-        liked_actions = actions_ref.where("user_id", "==", visitor_user_id).where("action", "==", "like").stream()
-        liked_item_ids = [a.to_dict()["item_id"] for a in liked_actions]
-        if not liked_item_ids:
-            return []
-        items_ref = self.db.collection("items")
-        items = items_ref.where("ownerId", "==", profile_user_id).where("id", "in", liked_item_ids).stream()
-        return [item.to_dict() for item in items]
+        like_index.ensure_loaded(self.stream_like_actions)
+        liked_item_ids = sorted(like_index.items_liked_by(profile_user_id, visitor_user_id))
+        items = self.get_items_many(liked_item_ids)
+        return [
+            items[item_id] for item_id in liked_item_ids
+            if items.get(item_id) and items[item_id].get("ownerId") == profile_user_id
+        ]
 
     def get_all_matches_for_user(self, user_id: str):
-        # Fetch all 'like' actions from the global actions collection
-        actions_query = self.db.collection("actions").where("action", "==", "like")
-        all_actions = self._log_and_stream("get_all_matches_for_user", actions_query)
-
-        # Fetch all items once for lookup
-        all_items = {i.id: i.to_dict() for i in self.db.collection("items").stream()}
-        # Process actions and items
-        my_items = {item["id"]: item for item in self.list_user_items(user_id)}
-        my_item_ids = set(my_items.keys())
-        my_likes = set()
-        received_likes = {}
-
-        for act_doc in all_actions:
-            act = act_doc.to_dict()
-            other_id = act.get("user_id")
-            item_id = act.get("item_id")
-
-            if other_id == user_id:
-                my_likes.add(item_id)
-            elif item_id in my_item_ids:
-                received_likes[(other_id, item_id)] = True
-
-        # Collect all their_user_ids needed
-        needed_user_ids = set()
-        for liked_item_id in my_likes - my_item_ids:
-            their_item = all_items.get(liked_item_id)
-            if not their_item:
-                continue
-            their_user_id = their_item.get("ownerId")
-            if not their_user_id or their_user_id == user_id:
-                continue
-            needed_user_ids.add(their_user_id)
+        """
+        Reciprocal-like matches of user_id, read from the materialized 'matches'
+        collection: one entry per item of another user that user_id liked, with
+        the user_id items that user liked back.
+        """
+        matches_query = self.db.collection("matches").where("users", "array_contains", user_id)
+        records = [doc.to_dict() for doc in self._log_and_stream("get_all_matches_for_user", matches_query)]
 
         # Batch fetch all needed user docs
-        user_docs = {}
-        if needed_user_ids:
-            users_ref = self.db.collection("users")
-            # Firestore batch get
-            docs = self._log_and_get("get_all_matches_for_user_users", users_ref.where("id", "in", list(needed_user_ids)))
-            for doc in docs:
-                user_docs[doc.id] = doc.to_dict()
+        user_docs = self.get_users_many(u for record in records for u in record["users"] if u != user_id)
 
         # Build matches
-        grouped = {}
-        for liked_item_id in my_likes - my_item_ids:  # only items not owned by user
-            their_item = all_items.get(liked_item_id)
-            if not their_item:
-                continue
-            their_user_id = their_item.get("ownerId")
-            if not their_user_id or their_user_id == user_id:
+        item_index.ensure_loaded(self.list_all_items)
+        matches = []
+        for record in records:
+            their_user_id = next((u for u in record["users"] if u != user_id), None)
+            if not their_user_id:
                 continue
-
-            # Check reciprocal like
-            for my_item_id in my_item_ids:
-                if received_likes.get((their_user_id, my_item_id)):
-                    key = (their_user_id, liked_item_id)
-                    if key not in grouped:
-                        other_user = user_docs.get(their_user_id) or {"id": their_user_id}
-                        grouped[key] = {
-                            "id": f"{user_id}_{their_user_id}_{liked_item_id}",
-                            "otherUser": other_user,
-                            "theirItem": their_item,
-                            "yourItems": []
-                        }
-                    grouped[key]["yourItems"].append(my_items[my_item_id])
-
-        return list(grouped.values())
+            your_items = item_index.items(record["likes"].get(their_user_id, []))
+            for liked_item_id in record["likes"].get(user_id, []):
+                their_item = item_index.get(liked_item_id)
+                if not their_item or not your_items:
+                    continue
+                matches.append({
+                    "id": f"{user_id}_{their_user_id}_{liked_item_id}",
+                    "otherUser": user_docs.get(their_user_id) or {"id": their_user_id},
+                    "theirItem": their_item,
+                    "yourItems": your_items
+                })
+        return matches
+
+    def refresh_match_record(self, user_a: str, user_b: str) -> Optional[Dict[str, List[str]]]:
+        """
+        Write the materialized match of two users if they liked each other's
+        items, otherwise delete it. Reciprocity is read from the stored items
+        and actions in a transaction, not from this worker's like index, which
+        may lag behind the other workers. Returns the pair's likes, or None.
+        """
+        match_ref = self.db.collection("matches").document(get_pair_id(user_a, user_b))
+
+        def refresh(transaction):
+            pair_likes = self._read_pair_likes(transaction, user_a, user_b)
+            if pair_likes:
+                transaction.set(match_ref, build_match_record(pair_likes, datetime.utcnow().isoformat() + "Z"))
+            elif transaction.get(match_ref).exists:
+                transaction.delete(match_ref)
+            return pair_likes
+
+        start = time.perf_counter()
+        pair_likes = run_transaction(refresh)
+        store_metrics.observe("refresh_match_record", 1, time.perf_counter() - start)
+        return pair_likes
+
+    def _read_pair_likes(self, transaction, user_a: str, user_b: str) -> Optional[Dict[str, List[str]]]:
+        """
+        Same shape as LikeIndex.pair_likes, read within the transaction.
+        """
+        if user_a == user_b:
+            return None
+        pair_likes = {}
+        # user_b's side first: user_a is usually the one who just liked
+        for liker_id, owner_id in ((user_b, user_a), (user_a, user_b)):
+            items_query = self.db.collection("items").where("ownerId", "==", owner_id)
+            item_ids = [doc.id for doc in transaction.get(items_query)]
+            if not item_ids:
+                return None
+            actions = transaction.get_all([self._action_ref(liker_id, item_id) for item_id in item_ids])
+            liked = sorted(doc.get("item_id") for doc in actions if doc.exists and doc.get("action") == "like")
+            if not liked:
+                return None
+            pair_likes[liker_id] = liked
+        return pair_likes
+
+    def stream_like_actions(self):
+        """
+        Stream every 'like' action (used to (re)build the in-memory like index).
+        """
+        # The like index resolves item owners through the item index
+        item_index.ensure_loaded(self.list_all_items)
+        actions_query = self.db.collection("actions").where("action", "==", "like")
+        for doc in self._log_and_stream("stream_like_actions", actions_query):
+            yield doc.to_dict()
 
     def __init__(self):
-        self.read_counts = {}
-        self.log_file = "firestore_read_log.json"
-        # Ensure Firestore client is initialized once and reused
-        if not hasattr(FirestoreDB, "_db_client"):
-            FirestoreDB._db_client = firestore.client()
-        self.db = FirestoreDB._db_client
-
-    def _log_read(self, function_name):
-        if function_name not in self.read_counts:
-            self.read_counts[function_name] = 0
-        self.read_counts[function_name] += 1
-        self._write_log()
-
-    def _write_log(self):
-        try:
-            with open(self.log_file, "r") as f:
-                existing_data = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            existing_data = {}
+        # The store client (Firestore or in-memory, see storage.py) is created once and reused
+        self.db = get_client()
 
-        # Merge existing data with current read counts
-        for key, value in self.read_counts.items():
-            if key in existing_data:
-                existing_data[key] += value
-            else:
-                existing_data[key] = value
+    def get_users_many(self, user_ids: Iterable[str]) -> Dict[str, dict]:
+        """
+        {user_id: user} for the distinct ids that exist, via the user cache and
+        chunked get_all() calls.
+        """
+        users = user_cache.get_many_or_load(user_ids, lambda ids: self._load_many("users", ids, "get_users_many"))
+        return {user_id: user for user_id, user in users.items() if user is not None}
 
-        with open(self.log_file, "w") as f:
-            json.dump(existing_data, f, indent=4)
+    def get_items_many(self, item_ids: Iterable[str]) -> Dict[str, dict]:
+        """
+        {item_id: item} for the distinct ids that exist, via the item cache and
+        chunked get_all() calls.
+        """
+        items = item_cache.get_many_or_load(item_ids, lambda ids: self._load_many("items", ids, "get_items_many"))
+        return {item_id: item for item_id, item in items.items() if item is not None}
+
+    def _load_many(self, collection: str, doc_ids: List[str], function_name: str) -> Dict[str, dict]:
+        """
+        Fetch documents by id with get_all() in chunks of MULTI_GET_CHUNK_SIZE,
+        issuing the chunks concurrently. This has no 'in' query cap.
+        """
+        collection_ref = self.db.collection(collection)
 
-        # Reset in-memory read counts after writing to file
-        self.read_counts = {}
+        def fetch(chunk):
+            start = time.perf_counter()
+            snapshots = [doc for doc in self.db.get_all([collection_ref.document(doc_id) for doc_id in chunk]) if doc.exists]
+            store_metrics.observe(function_name, len(snapshots), time.perf_counter() - start)
+            return snapshots
 
+        chunks = [doc_ids[i:i + MULTI_GET_CHUNK_SIZE] for i in range(0, len(doc_ids), MULTI_GET_CHUNK_SIZE)]
+        if len(chunks) == 1:
+            results = [fetch(chunks[0])]
+        else:
+            results = list(_multi_get_executor.map(fetch, chunks))
+        return {doc.id: doc.to_dict() for snapshots in results for doc in snapshots}
 
     def _log_and_get(self, function_name, ref, *args, **kwargs):
+        start = time.perf_counter()
         result = ref.get(*args, **kwargs)
-        self._log_read(function_name)
+        if isinstance(result, list):
+            documents = len(result)
+        else:
+            documents = 1 if getattr(result, "exists", False) else 0
+        store_metrics.observe(function_name, documents, time.perf_counter() - start)
         return result
 
     def _log_and_stream(self, function_name, ref, *args, **kwargs):
-        result = ref.stream(*args, **kwargs)
-        self._log_read(function_name)
-        return result
-
-    def list_user_chats(self, user_id: str):
-        # Fetch all chats where user is a participant
-        chats_query = self.db.collection("chats").where("participants", "array_contains", user_id)
-        chat_docs = self._log_and_get("list_user_chats", chats_query)
-        chats = []
-
-        for doc in chat_docs:
-            chat = doc.to_dict()
-            chat_id = chat["id"]
+        """
+        Stream ref, recording the call once the stream is exhausted or closed, so
+        latency covers fetching the documents and not just opening the query.
+        """
+        start = time.perf_counter()
+        documents = 0
+        try:
+            for doc in ref.stream(*args, **kwargs):
+                documents += 1
+                yield doc
+        finally:
+            store_metrics.observe(function_name, documents, time.perf_counter() - start)
 
-            # Use last_message field if available for efficiency
-            last_message = chat.get("last_message")
-            last_msg_ts = last_message["timestamp"] if last_message else None
-            last_access = chat.get("last_access", {}).get(user_id)
-            is_unread = last_msg_ts and last_access and last_msg_ts > last_access
-
-            chat["is_unread"] = is_unread
-            chat["last_message"] = last_message
-
-            # Fallback: fetch last message if not present in chat doc
-            if not last_message:
-                msg_query = (
-                    self.db.collection("chats")
-                    .document(chat_id)
-                    .collection("messages")
-                    .order_by("timestamp", direction=firestore.Query.DESCENDING)
-                    .limit(1)
-                )
-                last_msg_docs = self._log_and_get("list_user_chats_last_message", msg_query)
-                last_msg = list(last_msg_docs)
-                chat["last_message"] = last_msg[0].to_dict() if last_msg else None
-                last_msg_ts = chat["last_message"]["timestamp"] if chat["last_message"] else None
-                chat["is_unread"] = last_msg_ts and last_access and last_msg_ts > last_access
-
-            chats.append(chat)
-
-        return chats
-
-    def update_chat_last_access(self, user1: str, user2: str, user_id: str):
+    def list_user_chats(self, user_id: str, limit: int = 50, start_after: Optional[str] = None) -> dict:
+        """
+        One page of the user's chat inbox, most recent first: each entry has the
+        chat id, participants, a last message preview, unread_count/is_unread
+        and the other participant's snippet. start_after is a chat id.
+        """
+        inbox_ref = self.db.collection("users").document(user_id).collection("inbox")
+        query = inbox_ref.order_by("updated_at", direction=DESCENDING)
+        if start_after:
+            start_after_doc = inbox_ref.document(start_after).get()
+            if start_after_doc.exists:
+                query = query.start_after(start_after_doc)
+        entries = [self._doc_with_id(doc) for doc in self._log_and_stream("list_user_chats", query.limit(limit + 1))]
+        has_more = len(entries) > limit
+        entries = entries[:limit]
+
+        # Entries written before the other participant's snippet was known
+        missing = [e["other_user_id"] for e in entries if e.get("other_user") is None and e.get("other_user_id")]
+        users = self.get_users_many(missing) if missing else {}
+        for entry in entries:
+            if entry.get("other_user") is None and entry.get("other_user_id"):
+                entry["other_user"] = get_user_snippet(users.get(entry["other_user_id"]))
+            entry["unread_count"] = entry.get("unread_count") or 0
+            entry["is_unread"] = entry["unread_count"] > 0
+        return {"chats": entries, "has_more": has_more}
+
+    def update_chat_last_access(self, user1: str, user2: str, user_id: str, force: bool = False) -> Optional[str]:
+        """
+        Mark the chat read by user_id and return their previous last access.
+        Costs one read of their inbox entry; unless forced, the write is skipped
+        when the entry has no unread messages, so reopening a read chat (or one
+        whose only news are user_id's own messages) never writes, and when the
+        recorded last access is under CHAT_LAST_ACCESS_MIN_INTERVAL_SECONDS old,
+        so polling a busy chat writes at most once per interval.
+        """
         conv_id = self._get_conversation_id(user1, user2)
-        chat_ref = self.db.collection("chats").document(conv_id)
-        chat_doc = chat_ref.get()
-        if not chat_doc.exists:
-            # Ensure all mandatory fields are set if chat does not exist
-            self._ensure_chat_doc(user1, user2)
+        other_id = user2 if user_id == user1 else user1
+        inbox_ref = self._inbox_ref(user_id, conv_id)
+        entry_doc = self._log_and_get("update_chat_last_access", inbox_ref)
+        entry = entry_doc.to_dict() if entry_doc.exists else None
+        if entry is None:
+            # New chat, or a chat from before the inbox: (re)build the entry from the chat document
+            chat_ref = self.db.collection("chats").document(conv_id)
+            chat_doc = self._log_and_get("update_chat_last_access_chat", chat_ref)
+            if not chat_doc.exists:
+                # Ensure all mandatory fields are set if chat does not exist
+                self._ensure_chat_doc(user1, user2)
+                return None
+            chat = chat_doc.to_dict() or {}
+            last_message = chat.get("last_message")
+            entry = {
+                **build_inbox_entry(conv_id, user_id, other_id),
+                "last_message": get_message_preview(last_message) if last_message else None,
+                "updated_at": last_message["timestamp"] if last_message else chat.get("created_at"),
+                "last_access": (chat.get("last_access") or {}).get(user_id),
+            }
+        elif not force and (not entry.get("unread_count") or _accessed_within(entry.get("last_access"), CHAT_LAST_ACCESS_MIN_INTERVAL_SECONDS)):
+            return entry.get("last_access")
         now = datetime.utcnow().isoformat() + "Z"
-        chat_ref.set({"last_access": {user_id: now}}, merge=True)
-
-    def delete_item_matches(self, item_id: str):
         batch = self.db.batch()
-        actions_query = self.db.collection("actions").where("item_id", "==", item_id).where("action", "==", "like")
-        action_docs = self._log_and_get("delete_item_matches", actions_query)
-        for doc in action_docs:
-            batch.delete(doc.reference)
+        batch.set(self.db.collection("chats").document(conv_id), {"last_access": {user_id: now}}, merge=True)
+        batch.set(inbox_ref, {**entry, **build_inbox_entry(conv_id, user_id, other_id), "unread_count": 0, "last_access": now}, merge=True)
         batch.commit()
+        return entry.get("last_access")
+
+    # --- Cascade deletes (paged, bounded batches; see deletion_jobs.py) ---
+    def _delete_query_in_pages(self, function_name: str, query, on_page: Optional[Callable[[int], None]] = None,
+                               on_docs: Optional[Callable[[list], None]] = None) -> int:
+        """
+        Delete every document matching query, one page of at most BATCH_SIZE
+        documents per batched commit. Deleted documents drop out of the query,
+        so each page simply re-runs it. on_docs sees each deleted page's
+        snapshots. Returns the number of deleted documents.
+        """
+        deleted = 0
+        while True:
+            docs = list(self._log_and_stream(function_name, query.limit(BATCH_SIZE)))
+            if not docs:
+                return deleted
+            batch = self.db.batch()
+            for doc in docs:
+                batch.delete(doc.reference)
+            batch.commit()
+            deleted += len(docs)
+            if on_docs:
+                on_docs(docs)
+            if on_page:
+                on_page(len(docs))
+
+    def delete_item_actions(self, item_id: str, on_page: Optional[Callable[[int], None]] = None) -> int:
+        """
+        Delete every action on the item and refresh the matches of everyone who
+        liked it (taken from the deleted likes, not only from the like index).
+        """
+        likers = set()
+
+        def collect_likers(docs):
+            for doc in docs:
+                data = doc.to_dict() or {}
+                if data.get("action") == "like" and data.get("user_id"):
+                    likers.add(data["user_id"])
 
-    def delete_item_actions(self, item_id: str):
-        batch = self.db.batch()
         actions_query = self.db.collection("actions").where("item_id", "==", item_id)
-        action_docs = self._log_and_get("delete_item_actions", actions_query)
-        for doc in action_docs:
-            batch.delete(doc.reference)
-        batch.commit()
+        deleted = self._delete_query_in_pages("delete_item_actions", actions_query, on_page, collect_likers)
+        self._remove_item_likes(item_id, likers)
+        return deleted
+
+    def delete_item_cascade(self, item_id: str, on_page: Optional[Callable[[str, int], None]] = None):
+        """
+        Delete an item with its actions; matches that relied on its likes are refreshed.
+        """
+        self.delete_item_actions(item_id, on_page=on_page and (lambda n: on_page("actions", n)))
+        self.delete_item(item_id)
+        if on_page:
+            on_page("items", 1)
+
+    def delete_user_items(self, user_id: str, on_page: Optional[Callable[[str, int], None]] = None) -> int:
+        """
+        Cascade-delete the user's items, one page of item ids at a time.
+        """
+        deleted = 0
+        items_query = self.db.collection("items").where("ownerId", "==", user_id).limit(BATCH_SIZE)
+        while True:
+            item_ids = [doc.id for doc in self._log_and_stream("delete_user_items", items_query)]
+            if not item_ids:
+                return deleted
+            for item_id in item_ids:
+                self.delete_item_cascade(item_id, on_page)
+            deleted += len(item_ids)
+
+    def delete_user_actions(self, user_id: str, on_page: Optional[Callable[[int], None]] = None) -> int:
+        """
+        Delete every action made by the user and tear down the matches that
+        relied on the user's likes.
+        """
+        actions_query = self.db.collection("actions").where("user_id", "==", user_id)
+        deleted = self._delete_query_in_pages("delete_user_actions", actions_query, on_page)
+        like_index.ensure_loaded(self.stream_like_actions)
+        owners = like_index.remove_user_likes(user_id)
+        bus.publish("user_actions_deleted", {"user_id": user_id})
+        for owner_id in owners:
+            self.refresh_match_record(user_id, owner_id)
+        return deleted
+
+    def delete_user_matches(self, user_id: str, on_page: Optional[Callable[[int], None]] = None) -> int:
+        matches_query = self.db.collection("matches").where("users", "array_contains", user_id)
+        return self._delete_query_in_pages("delete_user_matches", matches_query, on_page)
+
+    def delete_user_chats(self, user_id: str, on_page: Optional[Callable[[str, int], None]] = None) -> int:
+        """
+        Delete the user's chats, each one's 'messages' subcollection first, so an
+        interrupted run still finds the chat and resumes.
+        """
+        deleted = 0
+        chats_query = self.db.collection("chats").where("participants", "array_contains", user_id).limit(BATCH_SIZE)
+        while True:
+            chat_docs = list(self._log_and_stream("delete_user_chats", chats_query))
+            if not chat_docs:
+                # Leftover entries of chats deleted before their inbox entries
+                inbox_query = self.db.collection("users").document(user_id).collection("inbox")
+                self._delete_query_in_pages("delete_user_chats_inbox", inbox_query)
+                return deleted
+            for chat_doc in chat_docs:
+                messages_query = chat_doc.reference.collection("messages")
+                self._delete_query_in_pages("delete_user_chats_messages", messages_query, on_page and (lambda n: on_page("messages", n)))
+                for participant in (chat_doc.to_dict() or {}).get("participants", []):
+                    self._inbox_ref(participant, chat_doc.id).delete()
+                chat_doc.reference.delete()
+                if on_page:
+                    on_page("chats", 1)
+            deleted += len(chat_docs)
+
+    def delete_user(self, user_id: str):
+        self.db.collection("users").document(user_id).delete()
+        user_cache.invalidate(user_id)
+        bus.publish("user_updated", {"user_id": user_id})
+
+    def _remove_item_likes(self, item_id: str, likers: Iterable[str] = ()):
+        like_index.ensure_loaded(self.stream_like_actions)
+        owner_id, indexed_likers = like_index.remove_item(item_id)
+        bus.publish("item_likes_removed", {"item_id": item_id})
+        owner_id = owner_id or (self.get_item(item_id) or {}).get("ownerId")
+        if not owner_id:
+            return
+        for liker_id in sorted(indexed_likers | set(likers)):
+            if liker_id != owner_id:
+                self.refresh_match_record(owner_id, liker_id)
 
     def _doc_with_id(self, doc):
         data = doc.to_dict() or {}
@@ -211,6 +509,9 @@ class FirestoreDB:
 
     # --- User logic ---
     def get_user(self, user_id: str) -> Optional[dict]:
+        return user_cache.get_or_load(user_id, lambda: self._load_user(user_id))
+
+    def _load_user(self, user_id: str) -> Optional[dict]:
         user_query = self.db.collection("users").document(user_id)
         user_doc = self._log_and_get("get_user", user_query)
         return user_doc.to_dict() if user_doc.exists else None
@@ -221,15 +522,24 @@ class FirestoreDB:
         """
         user_ref = self.db.collection("users").document(user_id)
         user_ref.set(updates, merge=True)
+        user_cache.invalidate(user_id)
+        bus.publish("user_updated", {"user_id": user_id})
+        if any(field in updates for field in INBOX_USER_FIELDS):
+            self._update_inbox_snippets(user_id)
 
     def create_user(self, user_id: str, data: dict):
         now = datetime.utcnow().isoformat() + "Z"
         data["created_at"] = now
         data["last_active"] = now
         self.db.collection("users").document(user_id).set(data)
+        user_cache.invalidate(user_id)
+        bus.publish("user_updated", {"user_id": user_id})
 
     # --- Item logic ---
     def get_item(self, item_id: str) -> Optional[dict]:
+        return item_cache.get_or_load(item_id, lambda: self._load_item(item_id))
+
+    def _load_item(self, item_id: str) -> Optional[dict]:
         item_query = self.db.collection("items").document(item_id)
         item_doc = self._log_and_get("get_item", item_query)
         return item_doc.to_dict() if item_doc.exists else None
@@ -264,34 +574,117 @@ class FirestoreDB:
         data["updated_at"] = now
         item_id = data["id"]  # Use the provided ID
         self.db.collection("items").document(item_id).set(data)  # Save the item with the provided ID
+        item_index.upsert(item_id, data)
+        invalidate_item_caches(item_id, data.get("ownerId"))
+        bus.publish("item_updated", {"item_id": item_id, "owner_id": data.get("ownerId"), "data": data, "merge": False})
         return item_id
 
     def update_item(self, item_id: str, data: dict):
         data["updated_at"] = datetime.utcnow().isoformat() + "Z"
         self.db.collection("items").document(item_id).set(data, merge=True)
+        item_index.upsert(item_id, data, merge=True)
+        owner_id = (item_index.get(item_id) or {}).get("ownerId")
+        invalidate_item_caches(item_id, owner_id)
+        bus.publish("item_updated", {"item_id": item_id, "owner_id": owner_id, "data": data, "merge": True})
 
     def delete_item(self, item_id: str):
+        owner_id = (item_index.get(item_id) or {}).get("ownerId")
         self.db.collection("items").document(item_id).delete()
+        item_index.remove(item_id)
+        invalidate_item_caches(item_id, owner_id)
+        bus.publish("item_updated", {"item_id": item_id, "owner_id": owner_id, "deleted": True})
+
+    def list_all_items(self) -> List[dict]:
+        """
+        Stream the whole items collection (used to (re)build the in-memory item index).
+        """
+        query = self.db.collection("items")
+        return [self._doc_with_id(doc) for doc in self._log_and_stream("list_all_items", query)]
+
+    def list_items_with_status(self, status: str) -> List[dict]:
+        """
+        Items in a given moderation status (e.g. 'pending_review', to re-enqueue lost jobs).
+        """
+        query = self.db.collection("items").where("status", "==", status)
+        return [self._doc_with_id(doc) for doc in self._log_and_stream("list_items_with_status", query)]
 
     def list_user_items(self, user_id: str) -> List[dict]:
+        return user_items_cache.get_or_load(user_id, lambda: self._load_user_items(user_id))
+
+    def _load_user_items(self, user_id: str) -> List[dict]:
         query = self.db.collection("items").where("ownerId", "==", user_id)
         docs = [self._doc_with_id(doc) for doc in self._log_and_stream("list_user_items", query)]
         return docs
 
     # --- User Actions ---
+    def _action_ref(self, user_id: str, item_id: str):
+        return self.db.collection("actions").document(get_action_id(user_id, item_id))
+
     def delete_user_action(self, user_id: str, item_id: str):
-        actions_query = self.db.collection("actions").where("user_id", "==", user_id).where("item_id", "==", item_id)
-        for doc in self._log_and_stream("delete_user_action", actions_query):
-            doc.reference.delete()
+        self._action_ref(user_id, item_id).delete()
+        like_index.remove_like(user_id, item_id)
+        bus.publish("action_deleted", {"user_id": user_id, "item_id": item_id})
+
+    def save_user_actions_batch(self, user_id: str, actions: List[dict]) -> int:
+        """
+        Upsert the user's action on each item ({"item_id", "action", "timestamp"},
+        at most one per item) through batched commits of up to BATCH_SIZE writes.
+        Stops at the first failed commit; returns how many leading actions were saved.
+        """
+        saved = 0
+        for start in range(0, len(actions), BATCH_SIZE):
+            chunk = actions[start:start + BATCH_SIZE]
+            batch = self.db.batch()
+            for a in chunk:
+                batch.set(self._action_ref(user_id, a["item_id"]), {
+                    "user_id": user_id,
+                    "item_id": a["item_id"],
+                    "action": a["action"],
+                    "timestamp": a["timestamp"]
+                })
+            try:
+                batch.commit()
+            except Exception:
+                logging.exception(f"Saving actions {start}-{start + len(chunk)} of {len(actions)} for {user_id} failed")
+                break
+            for a in chunk:
+                self._index_action(user_id, a["item_id"], a["action"], a["timestamp"])
+            saved += len(chunk)
+        return saved
+
+    def remove_like(self, user_id: str, item_id: str):
+        """
+        Delete the user's 'like' action on an item (used to undo a match).
+        """
+        like_index.ensure_loaded(self.stream_like_actions)
+        action_ref = self._action_ref(user_id, item_id)
+        action_doc = self._log_and_get("remove_like", action_ref)
+        if action_doc.exists and action_doc.get("action") == "like":
+            action_ref.delete()
+        owner_id = like_index.owner_of(item_id)
+        like_index.remove_like(user_id, item_id)
+        bus.publish("action_deleted", {"user_id": user_id, "item_id": item_id})
+        if owner_id:
+            self.refresh_match_record(user_id, owner_id)
 
     def save_user_action(self, user_id: str, item_id: str, action_type: str, timestamp):
-        actions_ref = self.db.collection("actions")
-        actions_ref.add({
+        """
+        Upsert the user's action on an item: one document per (user, item), so a
+        new swipe overwrites the previous one in a single write.
+        """
+        self._action_ref(user_id, item_id).set({
             "user_id": user_id,
             "item_id": item_id,
             "action": action_type,
             "timestamp": timestamp
         })
+        self._index_action(user_id, item_id, action_type, timestamp)
+
+    def _index_action(self, user_id: str, item_id: str, action_type: str, timestamp):
+        like_index.remove_like(user_id, item_id)
+        if action_type == "like":
+            like_index.add_like(user_id, item_id)
+        bus.publish("action_saved", {"user_id": user_id, "item_id": item_id, "action": action_type, "timestamp": timestamp})
 
     def get_user_actions(self, user_id: str) -> list:
         """
@@ -309,7 +702,7 @@ class FirestoreDB:
             self.db.collection("actions")
             .where("user_id", "==", user_id)
             .order_by("item_id")
-            .order_by("timestamp", direction=firestore.Query.DESCENDING)
+            .order_by("timestamp", direction=DESCENDING)
         )
 
         latest = {}
@@ -324,11 +717,17 @@ class FirestoreDB:
     def _get_conversation_id(self, user1: str, user2: str) -> str:
         return "_".join(sorted([user1, user2]))
 
-    def _ensure_chat_doc(self, user1: str, user2: str):
+    def _inbox_ref(self, user_id: str, conv_id: str):
+        return self.db.collection("users").document(user_id).collection("inbox").document(conv_id)
+
+    def _ensure_chat_doc(self, user1: str, user2: str, now: Optional[str] = None):
+        """
+        Create the chat (at `now`, e.g. the first message's timestamp) if missing.
+        """
         conv_id = self._get_conversation_id(user1, user2)
         chat_query = self.db.collection("chats").document(conv_id)
         chat_doc = self._log_and_get("_ensure_chat_doc", chat_query)
-        now = datetime.utcnow().isoformat() + "Z"
+        now = now or datetime.utcnow().isoformat() + "Z"
         # Prepare all mandatory fields
         mandatory_fields = {
             "id": conv_id,
@@ -338,7 +737,20 @@ class FirestoreDB:
             "last_access": {user1: now, user2: now}
         }
         if not chat_doc.exists:
-            chat_query.set(mandatory_fields)
+            # The chat and both participants' inbox entries are created together
+            users = self.get_users_many([user1, user2])
+            batch = self.db.batch()
+            batch.set(chat_query, mandatory_fields)
+            for user_id, other_id in ((user1, user2), (user2, user1)):
+                batch.set(self._inbox_ref(user_id, conv_id), {
+                    **build_inbox_entry(conv_id, user_id, other_id),
+                    "other_user": get_user_snippet(users.get(other_id)),
+                    "last_message": None,
+                    "unread_count": 0,
+                    "last_access": now,
+                    "updated_at": now,
+                }, merge=True)
+            batch.commit()
         else:
             # Update any missing mandatory fields
             update_fields = {}
@@ -349,50 +761,119 @@ class FirestoreDB:
             if update_fields:
                 chat_query.set(update_fields, merge=True)
 
+    def _update_inbox_snippets(self, user_id: str):
+        """
+        Copy the user's current snippet into the inbox entry every chat partner
+        holds for their chat.
+        """
+        snippet = get_user_snippet(self._load_user(user_id))
+        chats_query = self.db.collection("chats").where("participants", "array_contains", user_id)
+        chat_docs = list(self._log_and_stream("_update_inbox_snippets", chats_query))
+        for start in range(0, len(chat_docs), BATCH_SIZE):
+            batch = self.db.batch()
+            for chat_doc in chat_docs[start:start + BATCH_SIZE]:
+                for other_id in (chat_doc.to_dict() or {}).get("participants", []):
+                    if other_id != user_id:
+                        batch.set(self._inbox_ref(other_id, chat_doc.id), {"other_user": snippet}, merge=True)
+            batch.commit()
+
     def add_chat_message(self, sender: str, receiver: str, content: str, timestamp: str):
-        conv_id = self._get_conversation_id(sender, receiver)
-        self._ensure_chat_doc(sender, receiver)
-        msg_ref = self.db.collection("chats").document(conv_id).collection("messages")
-        msg_ref.add({
+        self._ensure_chat_doc(sender, receiver, timestamp)
+        self.add_chat_messages(self._get_conversation_id(sender, receiver), [{
+            "id": new_message_id(timestamp),
             "sender": sender,
             "receiver": receiver,
             "content": content,
             "timestamp": timestamp
-        })
-        # Always update last_message after sending
-        self._ensure_last_message_cached(conv_id)
+        }])
 
-    def get_chat_messages(self, user1: str, user2: str, limit: int = 50, start_after: Optional[str] = None) -> list:
+    def add_chat_messages(self, conv_id: str, messages: List[dict]):
+        """
+        Write messages ({"id", "sender", "receiver", "content", "timestamp"}) of one
+        chat and set its last_message from the newest of them, in batched commits.
+        The same commits update both participants' inbox entries: the preview,
+        and the unread count (incremented, or reset by the participant's reply).
+        Messages are stored under their id, so re-writing a batch is idempotent
+        (unread counts excepted). The chat document must exist (see _ensure_chat_doc).
+        """
+        chat_ref = self.db.collection("chats").document(conv_id)
+        messages = sorted(messages, key=lambda m: m["timestamp"])
+        participants = sorted({messages[0]["sender"], messages[0]["receiver"]}) if messages else []
+        # Each commit also writes the chat document and two inbox entries
+        chunk_size = BATCH_SIZE - 1 - len(participants)
+        for start in range(0, len(messages), chunk_size):
+            chunk = messages[start:start + chunk_size]
+            batch = self.db.batch()
+            for message in chunk:
+                batch.set(chat_ref.collection("messages").document(message["id"]), {k: v for k, v in message.items() if k != "id"})
+            last_message = {k: v for k, v in chunk[-1].items() if k != "id"}
+            chat_update = {"last_message": last_message}
+            preview = get_message_preview(last_message)
+            for user_id in participants:
+                other_id = next((p for p in participants if p != user_id), user_id)
+                sent = [i for i, m in enumerate(chunk) if m["sender"] == user_id]
+                unread = sum(1 for m in chunk[(sent[-1] + 1 if sent else 0):] if m["receiver"] == user_id)
+                entry = {**build_inbox_entry(conv_id, user_id, other_id), "last_message": preview, "updated_at": last_message["timestamp"]}
+                if sent:
+                    # Replying means the participant has read the chat
+                    sent_at = chunk[sent[-1]]["timestamp"]
+                    chat_update.setdefault("last_access", {})[user_id] = sent_at
+                    entry.update({"unread_count": unread, "last_access": sent_at})
+                elif unread:
+                    entry["unread_count"] = increment(unread)
+                batch.set(self._inbox_ref(user_id, conv_id), entry, merge=True)
+            batch.set(chat_ref, chat_update, merge=True)
+            batch.commit()
+
+    def get_message_cursor(self, user1: str, user2: str, message_id: str) -> Optional[Tuple[str, str]]:
         """
-        Fetch chat messages between two users with pagination support.
+        (timestamp, message id) of a message used as a history cursor: the
+        timestamp is taken from the id when it embeds one (no read), else read
+        from the message. None if unknown.
         """
+        timestamp = get_message_timestamp(message_id)
+        if timestamp:
+            return timestamp, message_id
         conv_id = self._get_conversation_id(user1, user2)
-        msg_query = self.db.collection("chats").document(conv_id).collection("messages").order_by("timestamp", direction=firestore.Query.DESCENDING).limit(limit)
-
-        # Apply pagination if start_after is provided
-        if start_after:
-            start_after_doc = self.db.collection("chats").document(conv_id).collection("messages").document(start_after).get()
-            if start_after_doc.exists:
-                msg_query = msg_query.start_after(start_after_doc)
+        msg_ref = self.db.collection("chats").document(conv_id).collection("messages").document(message_id)
+        msg_doc = self._log_and_get("get_message_cursor", msg_ref)
+        timestamp = (msg_doc.to_dict() or {}).get("timestamp") if msg_doc.exists else None
+        return (timestamp, message_id) if timestamp else None
 
-        msgs = self._log_and_stream("get_chat_messages", msg_query)
-        result = [doc.to_dict() for doc in msgs]
-        return list(reversed(result))
-
-    def _ensure_last_message_cached(self, conv_id: str):
+    def get_chat_messages(self, user1: str, user2: str, limit: int = 50, before: Optional[Tuple[str, Optional[str]]] = None,
+                          after: Optional[Tuple[str, Optional[str]]] = None) -> dict:
         """
-        Ensure the last message is cached in the parent chat document.
+        One page of chat messages between two users, oldest first, in
+        (timestamp, id) order so messages sharing a timestamp are never skipped
+        or repeated across pages. before/after are cursors from
+        get_message_cursor; an after cursor without id (e.g. last_seen) means
+        "newer than this timestamp". With after, the oldest `limit` messages past
+        it; otherwise the newest `limit` messages (before it, if given).
+        has_more tells whether the page was cut at `limit`.
         """
-        chat_ref = self.db.collection("chats").document(conv_id)
-        last_msg_query = (
-            chat_ref.collection("messages")
-            .order_by("timestamp", direction=firestore.Query.DESCENDING)
-            .limit(1)
-        )
-        last_msg_docs = list(last_msg_query.stream())
-        if last_msg_docs:
-            last_message = last_msg_docs[0].to_dict()
-            chat_ref.set({"last_message": last_message}, merge=True)
+        conv_id = self._get_conversation_id(user1, user2)
+        messages_ref = self.db.collection("chats").document(conv_id).collection("messages")
+
+        def cursor_fields(cursor):
+            timestamp, message_id = cursor
+            fields = {"timestamp": timestamp}
+            if message_id:
+                fields["__name__"] = messages_ref.document(message_id)
+            return fields
+
+        if after:
+            msg_query = messages_ref.order_by("timestamp").order_by("__name__").start_after(cursor_fields(after))
+        else:
+            msg_query = messages_ref.order_by("timestamp", direction=DESCENDING).order_by("__name__", direction=DESCENDING)
+            if before:
+                msg_query = msg_query.start_after(cursor_fields(before))
+        msgs = self._log_and_stream("get_chat_messages", msg_query.limit(limit + 1))
+        result = [self._doc_with_id(doc) for doc in msgs]
+        has_more = len(result) > limit
+        result = result[:limit]
+        if not after:
+            result.reverse()
+        return {"messages": result, "has_more": has_more}
 
 
 # # --- Custom Admin Logic ---
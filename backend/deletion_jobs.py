@@ -0,0 +1,140 @@
+# deletion_jobs.py
+# Resumable background cascade deletes of user accounts.
+#
+# Each job is a document in 'deletion_jobs' holding its current step and
+# per-collection delete counts, updated after every committed page. Every step
+# deletes by query until nothing matches, so a job interrupted at any point
+# (worker restart, crash) is resumed by re-running its current step.
+import os
+import logging
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from db import FirestoreDB
+from matching_service import seen_store
+
+
+DELETION_JOB_WORKERS = int(os.getenv("DELETION_JOB_WORKERS", 2))
+# A running job whose heartbeat is older than this is considered abandoned and resumed
+DELETION_JOB_LEASE_SECONDS = int(os.getenv("DELETION_JOB_LEASE_SECONDS", 120))
+
+USER_DELETION_STEPS = ["items", "actions", "matches", "chats", "user"]
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat() + "Z"
+
+
+def get_user_deletion_job_id(user_id: str) -> str:
+    return f"user__{user_id}"
+
+
+class DeletionJobs:
+    """
+    Runs user deletion jobs on a small thread pool, off the request path.
+    """
+
+    def __init__(self, db: Optional[FirestoreDB] = None, max_workers: int = DELETION_JOB_WORKERS):
+        self.db = db or FirestoreDB()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="deletion-job")
+        self._running = set()
+        self._lock = threading.Lock()
+
+    def _job_ref(self, job_id: str):
+        return self.db.db.collection("deletion_jobs").document(job_id)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        doc = self._job_ref(job_id).get()
+        return doc.to_dict() if doc.exists else None
+
+    def start_user_deletion(self, user_id: str) -> dict:
+        """
+        Create (or pick up) the deletion job of a user and run it in the background.
+        Calling it again while the job is alive returns the same job.
+        """
+        job_id = get_user_deletion_job_id(user_id)
+        job = self.get(job_id)
+        if job is None or job["status"] in ("done", "failed"):
+            job = {
+                "id": job_id,
+                "kind": "user",
+                "target_id": user_id,
+                "status": "pending",
+                "step": USER_DELETION_STEPS[0],
+                "deleted": {},
+                "error": None,
+                "created_at": _now(),
+                "heartbeat_at": _now(),
+                "finished_at": None,
+            }
+            self._job_ref(job_id).set(job)
+        elif not self._is_abandoned(job):
+            return job
+        self._submit(job_id)
+        return job
+
+    def resume_pending(self) -> int:
+        """
+        Resume the jobs left pending or abandoned mid-run (e.g. by a restarted worker).
+        """
+        resumed = 0
+        query = self.db.db.collection("deletion_jobs").where("status", "in", ["pending", "running"])
+        for doc in query.stream():
+            if self._is_abandoned(doc.to_dict()):
+                self._submit(doc.id)
+                resumed += 1
+        return resumed
+
+    def shutdown(self, wait: bool = False):
+        self._executor.shutdown(wait=wait)
+
+    def _is_abandoned(self, job: dict) -> bool:
+        heartbeat = datetime.fromisoformat(job["heartbeat_at"].rstrip("Z"))
+        return job["status"] == "pending" or datetime.utcnow() - heartbeat > timedelta(seconds=DELETION_JOB_LEASE_SECONDS)
+
+    def _submit(self, job_id: str):
+        with self._lock:
+            if job_id in self._running:
+                return
+            self._running.add(job_id)
+        self._executor.submit(self._run, job_id)
+
+    def _run(self, job_id: str):
+        job_ref = self._job_ref(job_id)
+        job = self.get(job_id)
+        try:
+            job_ref.set({"status": "running", "heartbeat_at": _now()}, merge=True)
+            deleted = dict(job.get("deleted") or {})
+
+            def on_page(collection: str, count: int):
+                deleted[collection] = deleted.get(collection, 0) + count
+                job_ref.set({"deleted": deleted, "heartbeat_at": _now()}, merge=True)
+
+            user_id = job["target_id"]
+            for step in USER_DELETION_STEPS[USER_DELETION_STEPS.index(job["step"]):]:
+                job_ref.set({"step": step, "heartbeat_at": _now()}, merge=True)
+                self._run_user_step(step, user_id, on_page)
+            job_ref.set({"status": "done", "finished_at": _now(), "heartbeat_at": _now()}, merge=True)
+            logging.info(f"[DELETION] job {job_id} done: {deleted}")
+        except Exception as e:
+            logging.error(f"[DELETION] job {job_id} failed: {e}")
+            job_ref.set({"status": "failed", "error": str(e), "heartbeat_at": _now()}, merge=True)
+        finally:
+            with self._lock:
+                self._running.discard(job_id)
+
+    def _run_user_step(self, step: str, user_id: str, on_page):
+        if step == "items":
+            self.db.delete_user_items(user_id, on_page)
+        elif step == "actions":
+            self.db.delete_user_actions(user_id, lambda n: on_page("actions", n))
+            seen_store.invalidate(user_id)
+        elif step == "matches":
+            self.db.delete_user_matches(user_id, lambda n: on_page("matches", n))
+        elif step == "chats":
+            self.db.delete_user_chats(user_id, on_page)
+        elif step == "user":
+            self.db.delete_user(user_id)
+            on_page("users", 1)
@@ -0,0 +1,68 @@
+# derivatives_backfill.py
+# Render photo derivatives (thumbnails, blur placeholders) for listed items that
+# have none, or whose derivatives are outdated (photos or settings changed).
+# Items pending or rejected by moderation get none.
+#
+# Usage (from backend/):
+#   python derivatives_backfill.py rebuild   # render what is missing or outdated
+#   python derivatives_backfill.py check     # report items to render, exit 1 if any
+import sys
+import asyncio
+import argparse
+
+from async_db import AsyncFirestoreDB
+from db import FirestoreDB
+from image_checks import ImageCheckPipeline
+from image_derivatives import ImageDerivatives, IMAGE_DERIVATIVES_ENABLED
+from item_index import is_listed
+
+
+def find_outdated(db: FirestoreDB, derivatives: ImageDerivatives) -> list:
+    return [
+        item for item in db.list_all_items()
+        if item.get("photoURLs") and is_listed(item) and not derivatives.is_current(item)
+    ]
+
+
+async def rebuild(db: FirestoreDB):
+    pipeline = ImageCheckPipeline()
+    pipeline.start()
+    derivatives = ImageDerivatives(AsyncFirestoreDB(db), pipeline)
+    items = find_outdated(db, derivatives)
+    try:
+        # generate_item bounds the concurrency itself
+        tasks = [derivatives.generate_item(item["id"], item["photoURLs"]) for item in items]
+        for done, task in enumerate(asyncio.as_completed(tasks), 1):
+            await task
+            if done % 50 == 0 or done == len(items):
+                print(f"[rebuild] {done}/{len(items)} items")
+    finally:
+        await pipeline.stop()
+    print(f"[rebuild] {len(items)} items, photos: {dict(derivatives.stats)}")
+
+
+def check(db: FirestoreDB) -> bool:
+    items = find_outdated(db, ImageDerivatives(AsyncFirestoreDB(db)))
+    print(f"[check] items with missing or outdated derivatives: {len(items)}")
+    for item in items[:20]:
+        print(f"  {item['id']}")
+    return not items
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render missing or outdated item photo derivatives")
+    parser.add_argument("command", choices=["rebuild", "check"])
+    args = parser.parse_args()
+
+    if not IMAGE_DERIVATIVES_ENABLED:
+        print("[derivatives] disabled: set IMAGE_DERIVATIVES_BUCKET, or IMAGE_DERIVATIVES_DIR with an absolute IMAGE_DERIVATIVES_BASE_URL")
+        sys.exit(1)
+    db = FirestoreDB()
+    if args.command == "rebuild":
+        asyncio.run(rebuild(db))
+    elif not check(db):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# doc_cache.py
+# Process-local read-through caches for user and item documents.
+import os
+import copy
+import time
+import threading
+from collections import OrderedDict, Counter
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional
+
+from metrics import registry
+
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", 60))
+ITEM_CACHE_SIZE = int(os.getenv("ITEM_CACHE_SIZE", 50000))
+ITEM_CACHE_TTL_SECONDS = int(os.getenv("ITEM_CACHE_TTL_SECONDS", 60))
+USER_ITEMS_CACHE_SIZE = int(os.getenv("USER_ITEMS_CACHE_SIZE", 10000))
+USER_ITEMS_CACHE_TTL_SECONDS = int(os.getenv("USER_ITEMS_CACHE_TTL_SECONDS", 60))
+
+
+class TTLCache:
+    """
+    Bounded LRU cache whose entries also expire after ttl seconds. Values are
+    deep-copied in and out, since callers mutate the dicts they get back.
+    A cached None (missing document) counts as a hit.
+
+    A load that races with an invalidation is returned but not cached, so a
+    write is never hidden by a read that started before it.
+    """
+
+    def __init__(self, name: str, max_entries: int, ttl: float):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._generation = 0  # bumped by every invalidation
+        self.stats: Counter = Counter()  # hits, misses, evictions, expirations, invalidations
+
+    def get_or_load(self, key: Hashable, load: Callable[[], Any]) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return copy.deepcopy(entry[1])
+                del self._entries[key]
+                self.stats["expirations"] += 1
+            self.stats["misses"] += 1
+            generation = self._generation
+        value = load()
+        self.put(key, value, generation)
+        return value
+
+    def get_many_or_load(self, keys: Iterable[Hashable], load_many: Callable[[List[Hashable]], Dict[Hashable, Any]]) -> Dict[Hashable, Any]:
+        """
+        {key: value} for the distinct keys; the misses are loaded with a single
+        load_many(missing_keys) call. Keys load_many does not return are cached as None.
+        """
+        now = time.monotonic()
+        found, missing = {}, []
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    found[key] = copy.deepcopy(entry[1])
+                    continue
+                if entry is not None:
+                    del self._entries[key]
+                    self.stats["expirations"] += 1
+                self.stats["misses"] += 1
+                missing.append(key)
+            generation = self._generation
+        if missing:
+            loaded = load_many(missing)
+            for key in missing:
+                found[key] = loaded.get(key)
+                self.put(key, found[key], generation)
+        return found
+
+    def put(self, key: Hashable, value: Any, generation: Optional[int] = None):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._generation += 1
+            if self._entries.pop(key, None) is not None:
+                self.stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self.stats["invalidations"] += len(self._entries)
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+user_cache = TTLCache("user", USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS)
+item_cache = TTLCache("item", ITEM_CACHE_SIZE, ITEM_CACHE_TTL_SECONDS)
+user_items_cache = TTLCache("user_items", USER_ITEMS_CACHE_SIZE, USER_ITEMS_CACHE_TTL_SECONDS)
+CACHES = (user_cache, item_cache, user_items_cache)
+
+
+def collect_cache_metrics():
+    counters = ("hits", "misses", "evictions", "expirations", "invalidations")
+    for counter in counters:
+        yield (f"circloth_cache_{counter}_total", "counter", f"Document cache {counter}",
+               [({"cache": c.name}, c.stats[counter]) for c in CACHES])
+    yield ("circloth_cache_entries", "gauge", "Document cache entries",
+           [({"cache": c.name}, len(c)) for c in CACHES])
+
+
+registry.register(collect_cache_metrics)
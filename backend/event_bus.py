@@ -0,0 +1,169 @@
+# event_bus.py
+# Broadcasts change events between the worker processes of one deployment, so
+# each worker can keep its process-local caches and indexes coherent.
+#
+# CIRCLOTH_BUS=unix (default where Unix sockets exist) sends each event as one
+# datagram to every sibling worker's socket in a shared directory; no outside
+# service is needed. CIRCLOTH_BUS=local keeps events in-process (single worker).
+import os
+import json
+import glob
+import socket
+import logging
+import tempfile
+import threading
+from collections import defaultdict, Counter
+from typing import Callable, Dict, List, Optional
+
+from metrics import registry
+
+
+CIRCLOTH_BUS = os.getenv("CIRCLOTH_BUS", "unix" if hasattr(socket, "AF_UNIX") else "local")
+# Defaults to a directory per parent process, i.e. shared by the workers of one gunicorn master
+CIRCLOTH_BUS_DIR = os.getenv("CIRCLOTH_BUS_DIR")
+MAX_DATAGRAM_BYTES = 64 * 1024
+SEND_TIMEOUT_SECONDS = 0.1
+
+
+class EventBus:
+    """
+    In-process bus. publish() is called after the publishing worker has already
+    applied the change to its own state, so events are only delivered to the
+    other workers; with a single worker there is nothing to deliver.
+    """
+
+    def __init__(self):
+        self._handlers: Dict[str, List[Callable[[dict], None]]] = defaultdict(list)
+        self.stats: Counter = Counter()  # published, delivered, received, dropped, handler_errors
+
+    def subscribe(self, event_type: str, handler: Callable[[dict], None]):
+        self._handlers[event_type].append(handler)
+
+    def publish(self, event_type: str, payload: dict):
+        self.stats["published"] += 1
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def _dispatch(self, event_type: str, payload: dict):
+        self.stats["received"] += 1
+        for handler in self._handlers.get(event_type, ()):
+            try:
+                handler(payload)
+            except Exception as e:
+                self.stats["handler_errors"] += 1
+                logging.error(f"[BUS] {event_type} handler failed: {e}")
+
+
+class UnixSocketBus(EventBus):
+    """
+    Each worker binds a datagram socket <directory>/<pid>.sock and a receiver
+    thread dispatches incoming events to the subscribed handlers. publish()
+    sends the event to every other socket in the directory and removes sockets
+    of workers that are gone. Delivery is best effort: a dropped event is
+    bounded by the cache TTLs and the periodic index resyncs.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        super().__init__()
+        self._directory = directory
+        self._path: Optional[str] = None
+        self._recv_sock: Optional[socket.socket] = None
+        self._send_sock: Optional[socket.socket] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """
+        Bind this worker's socket. Called from the worker itself (app startup),
+        so the per-master directory and pid are the worker's even with --preload.
+        """
+        if self._recv_sock is not None:
+            return
+        directory = self._directory or os.path.join(tempfile.gettempdir(), f"circloth-bus-{os.getppid()}")
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self._directory = directory
+        self._path = os.path.join(directory, f"{os.getpid()}.sock")
+        if os.path.exists(self._path):
+            os.unlink(self._path)
+        self._recv_sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._recv_sock.bind(self._path)
+        self._send_sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._send_sock.settimeout(SEND_TIMEOUT_SECONDS)
+        self._thread = threading.Thread(target=self._receive_loop, name="event-bus", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        sock, self._recv_sock = self._recv_sock, None
+        if sock is None:
+            return
+        # Wake the receiver thread (a blocked recv() is not interrupted by close())
+        try:
+            self._send_sock.sendto(b"", self._path)
+        except OSError:
+            pass
+        self._thread.join(timeout=1)
+        sock.close()
+        self._send_sock.close()
+        if os.path.exists(self._path):
+            os.unlink(self._path)
+
+    def publish(self, event_type: str, payload: dict):
+        super().publish(event_type, payload)
+        if self._recv_sock is None:
+            return
+        message = json.dumps({"type": event_type, "payload": payload}, default=str).encode()
+        if len(message) > MAX_DATAGRAM_BYTES:
+            self.stats["dropped"] += 1
+            logging.warning(f"[BUS] {event_type} event too large to send ({len(message)} bytes)")
+            return
+        for path in glob.glob(os.path.join(self._directory, "*.sock")):
+            if path == self._path:
+                continue
+            try:
+                self._send_sock.sendto(message, path)
+                self.stats["delivered"] += 1
+            except (ConnectionRefusedError, FileNotFoundError):
+                # The worker behind this socket exited without cleaning up
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            except OSError as e:
+                self.stats["dropped"] += 1
+                logging.warning(f"[BUS] could not deliver {event_type} to {path}: {e}")
+
+    def _receive_loop(self):
+        sock = self._recv_sock
+        while self._recv_sock is not None:
+            try:
+                data = sock.recv(MAX_DATAGRAM_BYTES)
+            except OSError:
+                return
+            try:
+                message = json.loads(data)
+            except ValueError:
+                continue  # includes the empty wake-up datagram from stop()
+            self._dispatch(message.get("type"), message.get("payload") or {})
+
+
+def create_bus(backend: str = CIRCLOTH_BUS) -> EventBus:
+    if backend == "unix":
+        return UnixSocketBus(CIRCLOTH_BUS_DIR)
+    if backend == "local":
+        return EventBus()
+    raise ValueError(f"Unknown CIRCLOTH_BUS backend: {backend}")
+
+
+bus = create_bus()
+
+
+def collect_bus_metrics():
+    for counter in ("published", "delivered", "received", "dropped", "handler_errors"):
+        yield (f"circloth_bus_{counter}_total", "counter", f"Event bus messages {counter}",
+               [({}, bus.stats[counter])])
+
+
+registry.register(collect_bus_metrics)
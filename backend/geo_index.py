@@ -0,0 +1,140 @@
+# geo_index.py
+# Uniform lat/lng grid used to answer nearest-first item queries.
+import os
+import math
+import heapq
+import threading
+from collections import defaultdict
+from typing import Dict, Iterator, Optional, Set, Tuple
+
+
+GEO_CELL_DEG = float(os.getenv("GEO_CELL_DEG", 0.1))  # ~11 km cells
+EARTH_RADIUS_KM = 6371
+
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lng2 - lng1)
+    a = math.sin(dlat/2)**2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon/2)**2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+    return EARTH_RADIUS_KM * c
+
+
+def get_lat_lng(location: Optional[dict]) -> Optional[Tuple[float, float]]:
+    if location and "lat" in location and "lng" in location:
+        try:
+            return float(location["lat"]), float(location["lng"])
+        except (TypeError, ValueError):
+            return None
+    return None
+
+
+class GeoGrid:
+    """
+    Buckets ids into fixed-size lat/lng cells. nearest() expands rings of cells
+    around the query cell and yields ids in increasing distance, touching only
+    the cells needed to prove the order.
+    """
+
+    def __init__(self, cell_deg: float = GEO_CELL_DEG):
+        self.cell_deg = cell_deg
+        self.n_cols = int(round(360 / cell_deg))
+        self.max_row = int(math.floor(90 / cell_deg))
+        self._lock = threading.RLock()
+        self._cells: Dict[Tuple[int, int], Set[str]] = defaultdict(set)
+        self._points: Dict[str, Tuple[float, float]] = {}
+
+    def __len__(self):
+        return len(self._points)
+
+    def _cell(self, lat: float, lng: float) -> Tuple[int, int]:
+        return int(math.floor(lat / self.cell_deg)), int(math.floor(lng / self.cell_deg)) % self.n_cols
+
+    def add(self, key: str, lat: float, lng: float):
+        with self._lock:
+            self.remove(key)
+            self._points[key] = (lat, lng)
+            self._cells[self._cell(lat, lng)].add(key)
+
+    def remove(self, key: str):
+        with self._lock:
+            point = self._points.pop(key, None)
+            if point is None:
+                return
+            cell = self._cell(*point)
+            keys = self._cells.get(cell)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._cells[cell]
+
+    def clear(self):
+        with self._lock:
+            self._cells = defaultdict(set)
+            self._points = {}
+
+    def _ring(self, row: int, col: int, r: int):
+        if r == 0:
+            yield row, col
+            return
+        for di in range(-r, r + 1):
+            i = row + di
+            if abs(i) > self.max_row:
+                continue
+            if abs(di) == r:
+                for dj in range(-r, r + 1):
+                    yield i, (col + dj) % self.n_cols
+            else:
+                yield i, (col - r) % self.n_cols
+                yield i, (col + r) % self.n_cols
+
+    def _lower_bound_km(self, lat: float, r: int) -> float:
+        """
+        Minimum distance from the query point to any point outside rings 0..r.
+        """
+        delta = math.radians(r * self.cell_deg)
+        lat_bound = EARTH_RADIUS_KM * delta
+        # Distance from a point to a meridian delta away: sin(d) = cos(lat) * sin(delta)
+        lng_bound = EARTH_RADIUS_KM * math.asin(min(1.0, math.cos(math.radians(lat)) * math.sin(min(delta, math.pi / 2))))
+        return min(lat_bound, lng_bound)
+
+    def nearest(self, lat: float, lng: float, max_km: Optional[float] = None) -> Iterator[Tuple[float, str]]:
+        """
+        Yield (distance_km, id) pairs nearest-first, optionally limited to max_km.
+        The lock is only held while a cell is being read, so the generator can be
+        kept as a cursor across requests.
+        """
+        row, col = self._cell(lat, lng)
+        heap = []
+        visited = set()
+        r = 0
+        while True:
+            with self._lock:
+                total_cells = len(self._cells)
+                if 8 * r > total_cells:
+                    # Rings are now wider than the populated grid: scan what is left directly
+                    ring = [c for c in self._cells if c not in visited]
+                    exhausted = True
+                else:
+                    ring = list(self._ring(row, col, r))
+                    exhausted = False
+                for cell in ring:
+                    if cell in visited:
+                        continue
+                    visited.add(cell)
+                    for key in self._cells.get(cell, ()):
+                        point = self._points[key]
+                        d = haversine_km(lat, lng, point[0], point[1])
+                        if max_km is None or d <= max_km:
+                            heapq.heappush(heap, (d, key))
+            if exhausted:
+                bound = float("inf")
+            else:
+                bound = self._lower_bound_km(lat, r)
+            while heap and heap[0][0] <= bound:
+                yield heapq.heappop(heap)
+            if exhausted or (max_km is not None and bound >= max_km):
+                while heap:
+                    yield heapq.heappop(heap)
+                return
+            r += 1
@@ -1,18 +1,474 @@
 # image_checks.py
+# Validation pipeline for item photos.
+#
+# check_images() fetches every photo of an item concurrently over one pooled
+# HTTP client, then decodes each image once and runs the configured checks on
+# it in a process pool (decoding and inference are CPU-bound). The first failing
+# photo short-circuits the rest, and every photo has its own timeout.
+#
+# Checks are plain functions DecodedImage -> None (pass) or an error code,
+# selected by IMAGE_CHECKS: built-in names ("size", "blank", "face") or
+# "module:function" for checks defined elsewhere (resolved in every worker).
+#
+# Only https photos on IMAGE_URL_HOSTS (Firebase Storage) are fetched, never
+# from a private, loopback or link-local address, and never following
+# redirects. IMAGE_ALLOW_LOCAL_URLS (tests and benchmarks only, off by default)
+# also allows file:// URLs, plain http and local addresses.
+#
+# Verdicts are cached across workers and restarts (verdict_cache.py) by photo
+# URL, content hash and perceptual hash, so re-uploaded or re-validated photos
+# skip the download, the decode or at least the checks.
+import os
+import io
+import json
+import time
+import socket
+import hashlib
+import sqlite3
+import asyncio
+import logging
+import importlib
+import ipaddress
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, List, Optional, Union
+from urllib.parse import urlparse
+from urllib.request import url2pathname
 
+import httpx
+import numpy as np
+from PIL import Image, UnidentifiedImageError
 
-def check_image(image_url: str):
+try:
+    import cv2
+except ImportError:  # Face check disabled without OpenCV
+    cv2 = None
+
+from metrics import Histogram, registry
+from verdict_cache import get_verdict_cache
+
+
+IMAGE_CHECKS = [name.strip() for name in os.getenv("IMAGE_CHECKS", "size,blank,face").split(",") if name.strip()]
+IMAGE_CHECK_WORKERS = int(os.getenv("IMAGE_CHECK_WORKERS", min(4, os.cpu_count() or 1)))
+IMAGE_CHECK_TIMEOUT_SECONDS = float(os.getenv("IMAGE_CHECK_TIMEOUT_SECONDS", 10))
+IMAGE_FETCH_MAX_CONNECTIONS = int(os.getenv("IMAGE_FETCH_MAX_CONNECTIONS", 20))
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", 15 * 1024 * 1024))
+IMAGE_URL_HOSTS = [h.strip().lower() for h in os.getenv("IMAGE_URL_HOSTS", "firebasestorage.googleapis.com,storage.googleapis.com").split(",") if h.strip()]
+# When set, photos must also be in this bucket (e.g. "<project>.firebasestorage.app")
+IMAGE_URL_BUCKET = os.getenv("IMAGE_URL_BUCKET", "")
+IMAGE_ALLOW_LOCAL_URLS = os.getenv("IMAGE_ALLOW_LOCAL_URLS", "0") == "1"
+# Checks run on a copy downscaled to at most this many pixels per side
+IMAGE_ANALYSIS_MAX_SIDE = int(os.getenv("IMAGE_ANALYSIS_MAX_SIDE", 512))
+IMAGE_MIN_SIDE = int(os.getenv("IMAGE_MIN_SIDE", 200))
+IMAGE_MAX_ASPECT_RATIO = float(os.getenv("IMAGE_MAX_ASPECT_RATIO", 3.0))
+IMAGE_BLANK_STDDEV = float(os.getenv("IMAGE_BLANK_STDDEV", 6.0))
+
+
+class DecodedImage:
+    """
+    One decoded photo as the checks see it: original size plus an RGB and a
+    grayscale array of the downscaled analysis copy.
+    """
+
+    def __init__(self, width: int, height: int, rgb: np.ndarray):
+        self.width = width
+        self.height = height
+        self.rgb = rgb
+        self.gray = (rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)).astype(np.uint8)
+
+    def dhash(self) -> Optional[str]:
+        """
+        64-bit difference hash: survives re-encoding and resizing. None for
+        near-uniform images, whose hashes would collide across unrelated photos.
+        """
+        small = np.asarray(Image.fromarray(self.gray).resize((9, 8), Image.BILINEAR), dtype=np.int16)
+        bits = (small[:, 1:] > small[:, :-1]).flatten()
+        if not 8 <= int(bits.sum()) <= 56:
+            return None
+        return np.packbits(bits).tobytes().hex()
+
+
+def decode_image(data: bytes) -> DecodedImage:
+    with Image.open(io.BytesIO(data)) as image:
+        width, height = image.size
+        # draft() lets JPEG decode straight at a reduced scale
+        image.draft("RGB", (IMAGE_ANALYSIS_MAX_SIDE, IMAGE_ANALYSIS_MAX_SIDE))
+        image = image.convert("RGB")
+        image.thumbnail((IMAGE_ANALYSIS_MAX_SIDE, IMAGE_ANALYSIS_MAX_SIDE))
+        return DecodedImage(width, height, np.asarray(image, dtype=np.float32))
+
+
+# --- Checks ---
+def check_size(image: DecodedImage) -> Optional[str]:
+    if min(image.width, image.height) < IMAGE_MIN_SIDE:
+        return "IMAGE_TOO_SMALL"
+    if max(image.width, image.height) / min(image.width, image.height) > IMAGE_MAX_ASPECT_RATIO:
+        return "IMAGE_BAD_ASPECT_RATIO"
+    return None
+
+
+def check_blank(image: DecodedImage) -> Optional[str]:
+    # Uniform photos (lens cap, blank wall, solid fill) have almost no contrast
+    if float(image.gray.std()) < IMAGE_BLANK_STDDEV:
+        return "IMAGE_BLANK"
+    return None
+
+
+_face_cascade = None
+
+
+def check_face(image: DecodedImage) -> Optional[str]:
     """
-    Placeholder for image validation logic. Return True if image passes all checks.
-    If a check fails, return a string error code or message.
-    Example future logic:
-    - if face_detected(image_url): return "FACE_DETECTED"
-    - if is_blank(image_url): return "IMAGE_BLANK"
+    Haar cascade face detector (the classic CV baseline of tests/face_detection.ipynb).
     """
-    # TODO: Implement actual checks
+    global _face_cascade
+    if cv2 is None:
+        return None
+    if _face_cascade is None:
+        _face_cascade = cv2.CascadeClassifier(os.path.join(cv2.data.haarcascades, "haarcascade_frontalface_default.xml"))
+    faces = _face_cascade.detectMultiScale(image.gray, scaleFactor=1.1, minNeighbors=5, minSize=(40, 40))
+    return "FACE_DETECTED" if len(faces) else None
+
+
+BUILTIN_CHECKS: Dict[str, Callable[[DecodedImage], Optional[str]]] = {
+    "size": check_size,
+    "blank": check_blank,
+    "face": check_face,
+}
+
+
+def resolve_check(name: str) -> Callable[[DecodedImage], Optional[str]]:
+    if name in BUILTIN_CHECKS:
+        return BUILTIN_CHECKS[name]
+    module_name, _, function_name = name.partition(":")
+    if not function_name:
+        raise ValueError(f"Unknown image check: {name}")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def _run_checks_on(image: DecodedImage, check_names: List[str]) -> Union[bool, str]:
+    for name in check_names:
+        result = resolve_check(name)(image)
+        if result:
+            return result
     return True
 
-# For future extensibility, you can:
-# - Add more parameters (e.g., user info, metadata)
-# - Use a list of check functions and iterate over them
-# - Raise exceptions or return error messages for failed checks
+
+def run_checks(data: bytes, check_names: List[str] = IMAGE_CHECKS) -> Union[bool, str]:
+    """
+    Decode once and run the checks in order; True, or the first error code.
+    """
+    try:
+        image = decode_image(data)
+    except (UnidentifiedImageError, OSError, ValueError, Image.DecompressionBombError):
+        return "IMAGE_UNREADABLE"
+    return _run_checks_on(image, check_names)
+
+
+def get_checks_fingerprint(check_names: List[str]) -> str:
+    """
+    Identifies the check configuration in verdict cache keys.
+    """
+    config = {
+        "checks": check_names,
+        "face": cv2 is not None and "face" in check_names,
+        "analysis_max_side": IMAGE_ANALYSIS_MAX_SIDE,
+        "min_side": IMAGE_MIN_SIDE,
+        "max_aspect_ratio": IMAGE_MAX_ASPECT_RATIO,
+        "blank_stddev": IMAGE_BLANK_STDDEV,
+    }
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def analyze(data: bytes, check_names: List[str], fingerprint: str):
+    """
+    Process pool task: decode, then reuse the verdict of a perceptually identical
+    photo or run the checks. Returns (verdict, dhash, from_cache).
+    """
+    try:
+        image = decode_image(data)
+    except (UnidentifiedImageError, OSError, ValueError, Image.DecompressionBombError):
+        return "IMAGE_UNREADABLE", None, False
+    phash = image.dhash()
+    cache = get_verdict_cache()
+    if phash and cache:
+        try:
+            verdict = cache.get(f"{fingerprint}:phash:{phash}")
+        except sqlite3.Error:
+            verdict = None
+        if verdict:
+            return _from_verdict(verdict), phash, True
+    return _run_checks_on(image, check_names), phash, False
+
+
+def _to_verdict(result: Union[bool, str]) -> str:
+    return "ok" if result is True else result
+
+
+def _from_verdict(verdict: str) -> Union[bool, str]:
+    return True if verdict == "ok" else verdict
+
+
+# --- Photo URLs ---
+def is_allowed_url(url: str, allowed_hosts: List[str] = IMAGE_URL_HOSTS, allow_local: bool = IMAGE_ALLOW_LOCAL_URLS) -> bool:
+    """
+    Whether a photo URL may be fetched at all (its address is checked on fetch).
+    """
+    try:
+        parsed = urlparse(url)
+        port = parsed.port
+    except ValueError:
+        return False
+    if parsed.scheme == "file":
+        return allow_local
+    if parsed.scheme != "https" and not (allow_local and parsed.scheme == "http"):
+        return False
+    if (parsed.hostname or "").lower() not in allowed_hosts or parsed.username or parsed.password:
+        return False
+    if port is not None and not allow_local:
+        return False
+    bucket = IMAGE_URL_BUCKET
+    return not bucket or parsed.path.startswith((f"/v0/b/{bucket}/", f"/{bucket}/"))
+
+
+def _is_public_address(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%")[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+async def resolve_public_address(host: str, port: int) -> str:
+    """
+    An address of host to connect to; every address it resolves to must be
+    public (no private, loopback, link-local or metadata endpoints).
+    """
+    infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    addresses = sorted({info[4][0] for info in infos})
+    if not addresses or not all(_is_public_address(address) for address in addresses):
+        raise ValueError("IMAGE_URL_INVALID")
+    return addresses[0]
+
+
+# --- Pipeline ---
+class ImageCheckPipeline:
+    def __init__(self, check_names: List[str] = IMAGE_CHECKS, max_workers: int = IMAGE_CHECK_WORKERS,
+                 timeout: float = IMAGE_CHECK_TIMEOUT_SECONDS, allowed_hosts: List[str] = IMAGE_URL_HOSTS,
+                 allow_local: bool = IMAGE_ALLOW_LOCAL_URLS):
+        for name in check_names:
+            resolve_check(name)  # fail fast on a misconfigured IMAGE_CHECKS
+        self.check_names = list(check_names)
+        self.fingerprint = get_checks_fingerprint(self.check_names)
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.allowed_hosts = [host.lower() for host in allowed_hosts]
+        self.allow_local = allow_local
+        self._client: Optional[httpx.AsyncClient] = None
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self.stats: Counter = Counter()  # verdict -> photos
+        self.cache_stats: Counter = Counter()  # url_hit, sha_hit, phash_hit, miss, error
+        self.latency = Histogram("circloth_image_check_seconds", "Time to validate all photos of an item")
+
+    def start(self):
+        if self._client is None:
+            limits = httpx.Limits(max_connections=IMAGE_FETCH_MAX_CONNECTIONS, max_keepalive_connections=IMAGE_FETCH_MAX_CONNECTIONS)
+            self._client = httpx.AsyncClient(limits=limits, timeout=self.timeout)
+        if self._pool is None and self.max_workers > 0:
+            self._pool = self._new_pool()
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        # spawn: the app process runs Firestore, bus and writer threads, which fork would not copy safely
+        pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+        # Start the workers now, so the first photos do not pay for it within their timeout
+        for _ in range(self.max_workers):
+            pool.submit(_warm_up)
+        return pool
+
+    async def stop(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def is_allowed(self, url: str) -> bool:
+        return is_allowed_url(url, self.allowed_hosts, self.allow_local)
+
+    async def fetch(self, url: str) -> bytes:
+        """
+        Photo bytes, at most IMAGE_MAX_BYTES. Raises ValueError(error code) for
+        URLs that may not be fetched or are too large, httpx.HTTPError or
+        OSError when the download fails.
+        """
+        if not self.is_allowed(url):
+            raise ValueError("IMAGE_URL_INVALID")
+        parsed = urlparse(url)
+        if parsed.scheme == "file":
+            return await asyncio.to_thread(_read_file, url2pathname(parsed.path), IMAGE_MAX_BYTES)
+        request_url, headers, extensions = url, {}, {}
+        if not self.allow_local:
+            # Connect to the address that was checked, so a second lookup cannot
+            # point the request somewhere else (the certificate is still checked
+            # against the host name)
+            address = await resolve_public_address(parsed.hostname, parsed.port or 443)
+            netloc = f"[{address}]" if ":" in address else address
+            request_url = parsed._replace(netloc=netloc).geturl()
+            headers["Host"] = parsed.netloc
+            extensions["sni_hostname"] = parsed.hostname
+        self.start()
+        async with self._client.stream("GET", request_url, headers=headers, extensions=extensions) as response:
+            # Redirects are not followed (raise_for_status rejects them)
+            response.raise_for_status()
+            if int(response.headers.get("content-length") or 0) > IMAGE_MAX_BYTES:
+                raise ValueError("IMAGE_TOO_LARGE")
+            chunks, size = [], 0
+            async for chunk in response.aiter_bytes():
+                size += len(chunk)
+                if size > IMAGE_MAX_BYTES:
+                    raise ValueError("IMAGE_TOO_LARGE")
+                chunks.append(chunk)
+        return b"".join(chunks)
+
+    async def run_in_pool(self, fn: Callable, *args):
+        """
+        Run a CPU-bound, picklable function on the process pool (inline when
+        IMAGE_CHECK_WORKERS is 0). Also used for photo derivatives.
+        """
+        if self._pool is None:
+            return fn(*args)
+        loop = asyncio.get_running_loop()
+        pool = self._pool
+        try:
+            return await loop.run_in_executor(pool, fn, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory): replace the pool once and retry
+            logging.error("[IMAGE] check worker died, restarting the process pool")
+            if self._pool is pool:
+                pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = self._new_pool()
+            return await loop.run_in_executor(self._pool, fn, *args)
+
+    async def _analyze(self, data: bytes):
+        return await self.run_in_pool(analyze, data, self.check_names, self.fingerprint)
+
+    def _cache_lookup(self, key: str) -> Optional[str]:
+        cache = get_verdict_cache()
+        if cache is None:
+            return None
+        try:
+            return cache.get(key)
+        except sqlite3.Error as e:
+            self.cache_stats["error"] += 1
+            logging.warning(f"[IMAGE] verdict cache read failed: {e}")
+            return None
+
+    def _cache_store(self, entries: Dict[str, str]):
+        cache = get_verdict_cache()
+        if cache is None:
+            return
+        try:
+            cache.put_many(entries)
+        except sqlite3.Error as e:
+            self.cache_stats["error"] += 1
+            logging.warning(f"[IMAGE] verdict cache write failed: {e}")
+
+    def _hash_and_lookup(self, data: bytes):
+        sha_key = f"{self.fingerprint}:sha:{hashlib.sha256(data).hexdigest()}"
+        return sha_key, self._cache_lookup(sha_key)
+
+    async def check_data(self, data: bytes, url_key: Optional[str] = None) -> Union[bool, str]:
+        """
+        Verdict for downloaded photo bytes, from the cache when the same bytes
+        or a perceptually identical photo were checked before.
+        """
+        sha_key, verdict = await asyncio.to_thread(self._hash_and_lookup, data)
+        entries = {}
+        if verdict:
+            self.cache_stats["sha_hit"] += 1
+        else:
+            result, phash, from_cache = await self._analyze(data)
+            verdict = _to_verdict(result)
+            self.cache_stats["phash_hit" if from_cache else "miss"] += 1
+            entries[sha_key] = verdict
+            if phash and not from_cache:
+                entries[f"{self.fingerprint}:phash:{phash}"] = verdict
+        if url_key:
+            entries[url_key] = verdict
+        if entries:
+            await asyncio.to_thread(self._cache_store, entries)
+        return _from_verdict(verdict)
+
+    async def check_url(self, url: str) -> Union[bool, str]:
+        if not self.is_allowed(url):
+            return "IMAGE_URL_INVALID"
+        # Local files may change in place; only remote photos are cached by URL
+        url_key = f"{self.fingerprint}:url:{url}" if url.startswith(("http://", "https://")) else None
+        if url_key:
+            verdict = await asyncio.to_thread(self._cache_lookup, url_key)
+            if verdict:
+                self.cache_stats["url_hit"] += 1
+                return _from_verdict(verdict)
+        try:
+            data = await self.fetch(url)
+        except ValueError as e:
+            return str(e)
+        except (httpx.HTTPError, OSError) as e:
+            logging.info(f"[IMAGE] download of {url} failed: {e!r}")
+            return "IMAGE_DOWNLOAD_FAILED"
+        return await self.check_data(data, url_key)
+
+    async def _check_url_with_timeout(self, url: str) -> Union[bool, str]:
+        try:
+            return await asyncio.wait_for(self.check_url(url), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            return "IMAGE_CHECK_TIMEOUT"
+
+    async def check_images(self, urls: List[str]) -> Union[bool, str]:
+        """
+        Validate all photos concurrently: True, or the error code of the first
+        photo that fails (the others are cancelled).
+        """
+        start = time.perf_counter()
+        tasks = [asyncio.ensure_future(self._check_url_with_timeout(url)) for url in urls]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                self.stats["ok" if result is True else result] += 1
+                if result is not True:
+                    return result
+            return True
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.latency.observe(time.perf_counter() - start)
+
+    def collect(self):
+        yield ("circloth_image_checks_total", "counter", "Photos validated, by verdict",
+               [({"verdict": verdict}, count) for verdict, count in self.stats.items()])
+        yield ("circloth_image_verdict_cache_total", "counter", "Photo verdict cache lookups, by result",
+               [({"result": result}, count) for result, count in self.cache_stats.items()])
+        yield from self.latency.collect()
+
+
+def _warm_up():
+    return None
+
+
+def _read_file(path: str, max_bytes: int) -> bytes:
+    # Read at most one byte past the limit: the size on disk is not trusted (/dev/zero)
+    with open(path, "rb") as f:
+        data = f.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise ValueError("IMAGE_TOO_LARGE")
+    return data
+
+
+pipeline = ImageCheckPipeline()
+registry.register(pipeline.collect)
+
+
+async def check_images(urls: List[str]) -> Union[bool, str]:
+    return await pipeline.check_images(urls)
@@ -0,0 +1,286 @@
+# image_derivatives.py
+# Card-sized thumbnails and blur placeholders for item photos.
+#
+# After an item is listed (created, its photos changed, or passed moderation),
+# every photo is downloaded once
+# (over the image_checks HTTP client) and rendered on the image_checks process
+# pool into fixed-width thumbnails (IMAGE_THUMBNAIL_WIDTHS x IMAGE_THUMBNAIL_FORMATS,
+# never upscaled) and a tiny blurred placeholder, inlined as a data URI. Files
+# are stored under <settings fingerprint>/<sha256 of the photo>/, with a
+# manifest written last, so the same bytes are never rendered twice and
+# changing the settings renders everything afresh. The result is written to the
+# item as 'photoDerivatives', one entry per photo:
+#   {"url": <photo URL>, "width": ..., "height": ..., "placeholder": "data:image/webp;base64,...",
+#    "sources": {"320": {"webp": <url>, "jpeg": <url>}, ...}, "version": <settings fingerprint>}
+#
+# Files go to the IMAGE_DERIVATIVES_BUCKET Firebase Storage bucket or to
+# IMAGE_DERIVATIVES_DIR (served by main.py under /derivatives). Their URLs are
+# stored on items, so a directory must be persistent and shared by every
+# instance, and published at an absolute IMAGE_DERIVATIVES_BASE_URL; with
+# neither set, derivatives are disabled (clients use photoURLs). Only remote
+# photos the checks may fetch are rendered (never file:// URLs, even with
+# IMAGE_ALLOW_LOCAL_URLS), so nothing from the server's disk ends up published.
+import os
+import io
+import json
+import time
+import math
+import uuid
+import base64
+import asyncio
+import hashlib
+import logging
+from collections import Counter
+from typing import Dict, List, Optional
+from urllib.parse import quote, urlparse
+
+from PIL import Image, ImageFilter, ImageOps
+
+from async_db import AsyncFirestoreDB
+from image_checks import ImageCheckPipeline, pipeline as image_check_pipeline
+from metrics import Histogram
+
+
+IMAGE_THUMBNAIL_WIDTHS = [int(w) for w in os.getenv("IMAGE_THUMBNAIL_WIDTHS", "320,640,1080").split(",") if w.strip()]
+IMAGE_THUMBNAIL_FORMATS = [f.strip() for f in os.getenv("IMAGE_THUMBNAIL_FORMATS", "webp,jpeg").split(",") if f.strip()]
+IMAGE_THUMBNAIL_QUALITY = int(os.getenv("IMAGE_THUMBNAIL_QUALITY", 80))
+IMAGE_PLACEHOLDER_WIDTH = int(os.getenv("IMAGE_PLACEHOLDER_WIDTH", 16))
+IMAGE_DERIVATIVES_BUCKET = os.getenv("IMAGE_DERIVATIVES_BUCKET", "")
+# A persistent directory shared by all instances (not a per-host temp dir)
+IMAGE_DERIVATIVES_DIR = os.getenv("IMAGE_DERIVATIVES_DIR", "")
+# Absolute public URL prefix of IMAGE_DERIVATIVES_DIR (main.py mounts it at /derivatives)
+IMAGE_DERIVATIVES_BASE_URL = os.getenv("IMAGE_DERIVATIVES_BASE_URL", "")
+IMAGE_DERIVATIVES_ENABLED = bool(IMAGE_DERIVATIVES_BUCKET) or bool(
+    IMAGE_DERIVATIVES_DIR and IMAGE_DERIVATIVES_BASE_URL.startswith(("http://", "https://"))
+)
+# Items rendered at the same time by one worker (their photos run concurrently)
+IMAGE_DERIVATIVE_CONCURRENCY = int(os.getenv("IMAGE_DERIVATIVE_CONCURRENCY", 4))
+IMAGE_DERIVATIVE_TIMEOUT_SECONDS = float(os.getenv("IMAGE_DERIVATIVE_TIMEOUT_SECONDS", 60))
+
+CONTENT_TYPES = {"webp": "image/webp", "jpeg": "image/jpeg"}
+_EXIF_ORIENTATION = 0x0112
+# Bump when the rendering changes, to regenerate existing derivatives
+_RENDER_VERSION = 1
+
+
+def get_derivatives_fingerprint() -> str:
+    settings = [_RENDER_VERSION, IMAGE_THUMBNAIL_WIDTHS, IMAGE_THUMBNAIL_FORMATS, IMAGE_THUMBNAIL_QUALITY, IMAGE_PLACEHOLDER_WIDTH]
+    return hashlib.sha256(json.dumps(settings).encode()).hexdigest()[:12]
+
+
+# --- Rendering (runs in the process pool) ---
+def _encode(image: Image.Image, fmt: str, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    if fmt == "jpeg":
+        image.save(buffer, format="JPEG", quality=quality, optimize=True, progressive=True)
+    else:
+        image.save(buffer, format=fmt.upper(), quality=quality)
+    return buffer.getvalue()
+
+
+def render_derivatives(data: bytes, widths: List[int], formats: List[str], quality: int, placeholder_width: int) -> dict:
+    """
+    Photo bytes -> {"width", "height", "placeholder", "files": {(width, format): bytes}}.
+    Widths at or above the photo's own width are skipped.
+    """
+    image = Image.open(io.BytesIO(data))
+    original_width, original_height = image.size
+    if image.getexif().get(_EXIF_ORIENTATION) in (5, 6, 7, 8):  # stored rotated by 90 degrees
+        original_width, original_height = original_height, original_width
+    scale = max(widths or [placeholder_width]) / original_width
+    if scale < 1:
+        # JPEG: decode at the smallest scale that still covers the largest thumbnail
+        image.draft("RGB", (math.ceil(image.width * scale), math.ceil(image.height * scale)))
+    image = ImageOps.exif_transpose(image).convert("RGB")
+    width, height = image.size
+
+    files = {}
+    current = image
+    for target in sorted((w for w in widths if w < original_width), reverse=True):
+        # Each size is resized from the previous (larger) one
+        current = current.resize((target, max(1, round(height * target / width))), Image.LANCZOS)
+        for fmt in formats:
+            files[(target, fmt)] = _encode(current, fmt, quality)
+
+    tiny = current.resize((placeholder_width, max(1, round(height * placeholder_width / width))), Image.BILINEAR)
+    tiny = tiny.filter(ImageFilter.GaussianBlur(1))
+    placeholder = "data:image/webp;base64," + base64.b64encode(_encode(tiny, "webp", 50)).decode()
+    return {"width": original_width, "height": original_height, "placeholder": placeholder, "files": files}
+
+
+# --- Stores ---
+class LocalDerivativeStore:
+    def __init__(self, directory: str = IMAGE_DERIVATIVES_DIR, base_url: str = IMAGE_DERIVATIVES_BASE_URL):
+        self.directory = directory
+        self.base_url = base_url.rstrip("/")
+
+    def read(self, path: str) -> Optional[bytes]:
+        try:
+            with open(os.path.join(self.directory, path), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def write(self, path: str, data: bytes, content_type: str) -> str:
+        full_path = os.path.join(self.directory, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        # Write then rename, so a reader never sees a partial file
+        tmp_path = f"{full_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, full_path)
+        return f"{self.base_url}/{path}"
+
+
+class FirebaseDerivativeStore:
+    def __init__(self, bucket_name: str = IMAGE_DERIVATIVES_BUCKET, prefix: str = "derivatives"):
+        from firebase_admin import storage as firebase_storage
+        from storage import init_firebase
+
+        init_firebase()
+        self.bucket = firebase_storage.bucket(bucket_name)
+        self.prefix = prefix
+
+    def read(self, path: str) -> Optional[bytes]:
+        blob = self.bucket.blob(f"{self.prefix}/{path}")
+        return blob.download_as_bytes() if blob.exists() else None
+
+    def write(self, path: str, data: bytes, content_type: str) -> str:
+        # Same URL shape as the client SDK's getDownloadURL
+        token = uuid.uuid4().hex
+        path = f"{self.prefix}/{path}"
+        blob = self.bucket.blob(path)
+        blob.metadata = {"firebaseStorageDownloadTokens": token}
+        blob.cache_control = "public, max-age=31536000, immutable"
+        blob.upload_from_string(data, content_type=content_type)
+        return f"https://firebasestorage.googleapis.com/v0/b/{self.bucket.name}/o/{quote(path, safe='')}?alt=media&token={token}"
+
+
+def get_derivative_store():
+    if IMAGE_DERIVATIVES_BUCKET:
+        return FirebaseDerivativeStore()
+    return LocalDerivativeStore()
+
+
+# --- Generator ---
+class ImageDerivatives:
+    """
+    Renders the derivatives of item photos in the background and writes them
+    to the item. Requests only schedule the work (submit).
+    """
+
+    def __init__(self, adb: AsyncFirestoreDB, pipeline: ImageCheckPipeline = image_check_pipeline, store=None,
+                 concurrency: int = IMAGE_DERIVATIVE_CONCURRENCY, enabled: bool = IMAGE_DERIVATIVES_ENABLED):
+        self.adb = adb
+        self.enabled = enabled
+        self.pipeline = pipeline
+        self._store = store
+        self.fingerprint = get_derivatives_fingerprint()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks = set()
+        self.stats: Counter = Counter()  # photos: hit, rendered, failed; items: superseded
+        self.latency = Histogram("circloth_image_derivatives_seconds", "Time to render the derivatives of one item's photos",
+                                 (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = get_derivative_store()
+        return self._store
+
+    def submit(self, item_id: str, photo_urls: List[str]):
+        """
+        Schedule the derivatives of an item's photos (call from the event loop).
+        Does nothing when derivatives are disabled.
+        """
+        if not self.enabled:
+            return
+        task = asyncio.create_task(self.generate_item(item_id, photo_urls))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def stop(self):
+        # Unfinished items keep their old (or no) derivatives; derivatives_backfill.py catches up
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def is_current(self, item: dict) -> bool:
+        """
+        Whether the item's photoDerivatives match its photos and the current settings.
+        """
+        entries = item.get("photoDerivatives") or []
+        return [e.get("url") for e in entries] == (item.get("photoURLs") or []) and all(
+            e.get("version") == self.fingerprint for e in entries
+        )
+
+    async def generate_item(self, item_id: str, photo_urls: List[str]):
+        async with self._semaphore:
+            start = time.perf_counter()
+            try:
+                results = await asyncio.gather(*(self._derive_with_timeout(url) for url in photo_urls))
+                # A photo that failed gets no entry; the client falls back to photoURLs
+                entries = [entry for entry in results if entry is not None]
+                if entries:
+                    await self.adb.run(self._save, item_id, photo_urls, entries)
+            except Exception as e:
+                logging.error(f"[IMAGE] derivatives of item {item_id} failed: {e}")
+            finally:
+                self.latency.observe(time.perf_counter() - start)
+
+    async def _derive_with_timeout(self, url: str) -> Optional[dict]:
+        try:
+            return await asyncio.wait_for(self.derive_photo(url), timeout=IMAGE_DERIVATIVE_TIMEOUT_SECONDS)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.stats["failed"] += 1
+            logging.warning(f"[IMAGE] derivatives of {url} failed: {e!r}")
+            return None
+
+    def is_renderable(self, url: str) -> bool:
+        return urlparse(url).scheme in ("http", "https") and self.pipeline.is_allowed(url)
+
+    async def derive_photo(self, url: str) -> dict:
+        if not self.is_renderable(url):
+            raise ValueError("IMAGE_URL_INVALID")
+        data = await self.pipeline.fetch(url)
+        prefix = f"{self.fingerprint}/{await asyncio.to_thread(_sha256, data)}"
+        manifest = await asyncio.to_thread(self.store.read, f"{prefix}/manifest.json")
+        if manifest:
+            self.stats["hit"] += 1
+            return {"url": url, **json.loads(manifest)}
+
+        rendered = await self.pipeline.run_in_pool(
+            render_derivatives, data, IMAGE_THUMBNAIL_WIDTHS, IMAGE_THUMBNAIL_FORMATS, IMAGE_THUMBNAIL_QUALITY, IMAGE_PLACEHOLDER_WIDTH
+        )
+        files = rendered.pop("files")
+        uploads = [
+            asyncio.to_thread(self.store.write, f"{prefix}/{width}.{fmt}", content, CONTENT_TYPES.get(fmt, f"image/{fmt}"))
+            for (width, fmt), content in files.items()
+        ]
+        sources: Dict[str, Dict[str, str]] = {}
+        for ((width, fmt), _), file_url in zip(files.items(), await asyncio.gather(*uploads)):
+            sources.setdefault(str(width), {})[fmt] = file_url
+        manifest = {**rendered, "sources": sources, "version": self.fingerprint}
+        # Written last: a manifest means every file is in place
+        await asyncio.to_thread(self.store.write, f"{prefix}/manifest.json", json.dumps(manifest).encode(), "application/json")
+        self.stats["rendered"] += 1
+        return {"url": url, **manifest}
+
+    def _save(self, item_id: str, photo_urls: List[str], entries: List[dict]):
+        item = self.adb.sync.get_item(item_id)
+        if not item or item.get("photoURLs") != photo_urls:
+            # Deleted, or its photos changed again (that change scheduled its own run)
+            self.stats["superseded"] += 1
+            return
+        self.adb.sync.update_item(item_id, {"photoDerivatives": entries})
+
+    def collect(self):
+        yield ("circloth_image_derivatives_total", "counter", "Photo derivative runs, by result",
+               [({"result": result}, count) for result, count in self.stats.items()])
+        yield from self.latency.collect()
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
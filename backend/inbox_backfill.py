@@ -0,0 +1,104 @@
+# inbox_backfill.py
+# Rebuild or check the per-user chat inbox (users/{uid}/inbox/{chat_id}) from
+# the 'chats' collection and its messages.
+#
+# Usage (from backend/):
+#   python inbox_backfill.py rebuild   # rewrite every inbox entry
+#   python inbox_backfill.py check     # report differences, exit 1 if any
+import sys
+import argparse
+
+from db import FirestoreDB, BATCH_SIZE, build_inbox_entry, get_message_preview, get_user_snippet
+
+
+def compute_expected_entries(db: FirestoreDB) -> dict:
+    """
+    One pass over the chats and their messages -> {(user_id, chat_id): entry}.
+    """
+    chats = [doc.to_dict() or {} for doc in db.db.collection("chats").stream()]
+    chats = [chat for chat in chats if chat.get("id") and len(set(chat.get("participants") or [])) == 2]
+    users = db.get_users_many(list({p for chat in chats for p in chat["participants"]}))
+
+    expected = {}
+    for chat in chats:
+        messages_ref = db.db.collection("chats").document(chat["id"]).collection("messages")
+        messages = [doc.to_dict() or {} for doc in messages_ref.order_by("timestamp").stream()]
+        last_message = messages[-1] if messages else chat.get("last_message")
+        for user_id in chat["participants"]:
+            other_id = next(p for p in chat["participants"] if p != user_id)
+            last_access = (chat.get("last_access") or {}).get(user_id)
+            unread = sum(1 for m in messages if m.get("receiver") == user_id and last_access and m["timestamp"] >= last_access)
+            expected[(user_id, chat["id"])] = {
+                **build_inbox_entry(chat["id"], user_id, other_id),
+                "other_user": get_user_snippet(users.get(other_id)),
+                "last_message": get_message_preview(last_message) if last_message else None,
+                "unread_count": unread,
+                "last_access": last_access,
+                "updated_at": last_message["timestamp"] if last_message else chat.get("created_at"),
+            }
+    return expected
+
+
+def load_existing_entries(db: FirestoreDB, user_ids) -> dict:
+    existing = {}
+    for user_id in user_ids:
+        for doc in db.db.collection("users").document(user_id).collection("inbox").stream():
+            existing[(user_id, doc.id)] = doc.to_dict()
+    return existing
+
+
+def diff_entries(expected: dict, existing: dict) -> dict:
+    missing = sorted(set(expected) - set(existing))
+    stale = sorted(set(existing) - set(expected))
+    mismatched = sorted(
+        key for key in set(expected) & set(existing)
+        if any(expected[key][field] != existing[key].get(field) for field in ("unread_count", "updated_at", "other_user"))
+    )
+    return {"missing": missing, "stale": stale, "mismatched": mismatched}
+
+
+def rebuild(db: FirestoreDB):
+    expected = compute_expected_entries(db)
+    existing = load_existing_entries(db, {user_id for user_id, _ in expected})
+    stale = diff_entries(expected, existing)["stale"]
+
+    def inbox_ref(user_id, chat_id):
+        return db.db.collection("users").document(user_id).collection("inbox").document(chat_id)
+
+    ops = [("set", key) for key in expected] + [("delete", key) for key in stale]
+    for start in range(0, len(ops), BATCH_SIZE):
+        batch = db.db.batch()
+        for op, key in ops[start:start + BATCH_SIZE]:
+            if op == "set":
+                batch.set(inbox_ref(*key), expected[key])
+            else:
+                batch.delete(inbox_ref(*key))
+        batch.commit()
+        print(f"[rebuild] committed {min(start + BATCH_SIZE, len(ops))}/{len(ops)} writes")
+    print(f"[rebuild] {len(expected)} inbox entries written, {len(stale)} stale entries deleted")
+
+
+def check(db: FirestoreDB) -> bool:
+    expected = compute_expected_entries(db)
+    diff = diff_entries(expected, load_existing_entries(db, {user_id for user_id, _ in expected}))
+    for kind, keys in diff.items():
+        print(f"[check] {kind}: {len(keys)}")
+        for user_id, chat_id in keys[:20]:
+            print(f"  {user_id}/{chat_id}")
+    return not any(diff.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild or check the per-user chat inbox")
+    parser.add_argument("command", choices=["rebuild", "check"])
+    args = parser.parse_args()
+
+    db = FirestoreDB()
+    if args.command == "rebuild":
+        rebuild(db)
+    elif not check(db):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+# item_index.py
+# Process-resident index of the items collection used by the matcher.
+import os
+import threading
+import time
+import logging
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+
+from geo_index import GeoGrid, get_lat_lng
+from ranking_kernel import CandidateColumns, candidate_mask, rank_nearest, sample_rows
+
+
+ITEM_INDEX_RESYNC_SECONDS = int(os.getenv("ITEM_INDEX_RESYNC_SECONDS", 300))
+
+# Moderation states (see moderation.py); items without a status are visible
+ITEM_STATUS_PENDING_REVIEW = "pending_review"
+ITEM_STATUS_VISIBLE = "visible"
+ITEM_STATUS_REJECTED = "rejected"
+HIDDEN_ITEM_STATUSES = (ITEM_STATUS_PENDING_REVIEW, ITEM_STATUS_REJECTED)
+
+
+def is_listed(item: dict) -> bool:
+    """
+    Whether the item may be shown to other users (not waiting for or failed moderation).
+    """
+    return item.get("status") not in HIDDEN_ITEM_STATUSES
+
+
+class ItemIndex:
+    """
+    In-memory copy of the items collection with per-owner and nearest-first
+    (geo grid) lookups, plus a columnar copy (one stable row per item) that the
+    batched ranking kernel filters by category, size and exclusions. Kept current
+    by the FirestoreDB item write paths and by a periodic full resync.
+
+    Items waiting for or rejected by moderation are kept for lookups by id and
+    owner, but get no row or geo entry, so the matcher
+    never sees them.
+
+    Every item id is also interned to an ordinal that is never reused, not even
+    across resyncs, so per-user state (see seen_state.py) can store compact ints
+    instead of id strings.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._items: Dict[str, dict] = {}
+        self._by_owner: Dict[str, Set[str]] = defaultdict(set)
+        self._geo = GeoGrid()
+        self._unlocated: Set[str] = set()
+        self._hidden: Set[str] = set()
+        self._cols = CandidateColumns()
+        self._rows: Dict[str, int] = {}
+        self._ordinals: Dict[str, int] = {}
+        self._row_by_ordinal = np.full(1024, -1, dtype=np.int64)
+        self.loaded_at: Optional[float] = None
+        self._resync_thread: Optional[threading.Thread] = None
+        # One log of upserts/removes per reload in progress, replayed onto the
+        # items it read so writes made during the read are not lost
+        self._change_logs: List[list] = []
+
+    # --- Loading ---
+    def load(self, items: Iterable[dict]):
+        """
+        Replace the whole index with the given items.
+        """
+        with self._lock:
+            self._items = {}
+            self._by_owner = defaultdict(set)
+            self._geo.clear()
+            self._unlocated = set()
+            self._hidden = set()
+            self._cols = CandidateColumns()
+            self._rows = {}
+            self._row_by_ordinal = np.full(max(1024, len(self._ordinals)), -1, dtype=np.int64)
+            for item in items:
+                if item.get("id"):
+                    self._add(item)
+            self.loaded_at = time.monotonic()
+
+    def ensure_loaded(self, load_items: Callable[[], Iterable[dict]]):
+        """
+        Load the index on first use (e.g. before the resync thread has run).
+        """
+        if self.loaded_at is None:
+            with self._lock:
+                if self.loaded_at is None:
+                    self.load(load_items())
+
+    def reload(self, load_items: Callable[[], Iterable[dict]]):
+        """
+        Rebuild the index from a fresh read of the items, without holding the
+        lock during the read. Writes applied meanwhile are replayed onto it.
+        """
+        log = []
+        with self._lock:
+            self._change_logs.append(log)
+        try:
+            items = list(load_items())
+        except Exception:
+            with self._lock:
+                self._change_logs.remove(log)
+            raise
+        with self._lock:
+            self._change_logs.remove(log)
+            self.load(items)
+            for op, item_id, *args in log:
+                if op == "upsert":
+                    self.upsert(item_id, *args)
+                else:
+                    self.remove(item_id)
+
+    def _log(self, *op):
+        for log in self._change_logs:
+            log.append(op)
+
+    def start_resync(self, load_items: Callable[[], Iterable[dict]], interval: int = ITEM_INDEX_RESYNC_SECONDS):
+        """
+        Start a daemon thread that reloads the full index every `interval` seconds,
+        so changes made outside this process are eventually picked up.
+        """
+        if self._resync_thread and self._resync_thread.is_alive():
+            return
+
+        def _run():
+            while True:
+                try:
+                    self.reload(load_items)
+                except Exception as e:
+                    logging.error(f"Item index resync failed: {e}")
+                time.sleep(interval)
+
+        self._resync_thread = threading.Thread(target=_run, name="item-index-resync", daemon=True)
+        self._resync_thread.start()
+
+    # --- Write paths ---
+    def upsert(self, item_id: str, data: dict, merge: bool = False):
+        """
+        Insert or replace an item. With merge=True the fields are merged into
+        the existing entry, mirroring a Firestore set(..., merge=True); a patch
+        of an item not in the index is skipped (it is not a full item), and the
+        next resync picks the item up.
+        """
+        with self._lock:
+            self._log("upsert", item_id, dict(data), merge)
+            existing = self._items.get(item_id)
+            if merge and not existing:
+                return
+            if existing:
+                self._remove(item_id)
+            item = {**existing, **data} if merge else dict(data)
+            item["id"] = item_id
+            self._add(item)
+
+    def remove(self, item_id: str):
+        with self._lock:
+            self._log("remove", item_id)
+            if item_id in self._items:
+                self._remove(item_id)
+
+    def _add(self, item: dict):
+        item_id = item["id"]
+        self._items[item_id] = item
+        self._by_owner[item.get("ownerId")].add(item_id)
+        if not is_listed(item):
+            self._hidden.add(item_id)
+            return
+        row = self._cols.allocate_row()
+        self._cols.set_row(row, item)
+        self._rows[item_id] = row
+        ordinal = self.ordinal(item_id)
+        if ordinal >= len(self._row_by_ordinal):
+            grown = np.full(2 * ordinal + 1, -1, dtype=np.int64)
+            grown[:len(self._row_by_ordinal)] = self._row_by_ordinal
+            self._row_by_ordinal = grown
+        self._row_by_ordinal[ordinal] = row
+        point = get_lat_lng(item.get("location"))
+        if point:
+            self._geo.add(item_id, *point)
+        else:
+            self._unlocated.add(item_id)
+
+    def _remove(self, item_id: str):
+        item = self._items.pop(item_id)
+        if item_id in self._hidden:
+            self._hidden.discard(item_id)
+        else:
+            self._geo.remove(item_id)
+            self._unlocated.discard(item_id)
+            self._cols.free_row(self._rows.pop(item_id))
+            self._row_by_ordinal[self._ordinals[item_id]] = -1
+        ids = self._by_owner.get(item.get("ownerId"))
+        if ids is not None:
+            ids.discard(item_id)
+            if not ids:
+                del self._by_owner[item.get("ownerId")]
+
+    def ordinal(self, item_id: str) -> int:
+        """
+        Interned ordinal of an item id (assigned on first use, never reused).
+        """
+        ordinal = self._ordinals.get(item_id)
+        if ordinal is None:
+            with self._lock:
+                ordinal = self._ordinals.setdefault(item_id, len(self._ordinals))
+        return ordinal
+
+    # --- Lookups ---
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, item_id: str) -> Optional[dict]:
+        return self._items.get(item_id)
+
+    def ids_by_owner(self, owner_id: str) -> Set[str]:
+        with self._lock:
+            return set(self._by_owner.get(owner_id, ()))
+
+    def ids_without_location(self) -> Set[str]:
+        with self._lock:
+            return set(self._unlocated)
+
+    def nearest(self, lat: float, lng: float, max_km: Optional[float] = None) -> Iterator[Tuple[float, str]]:
+        """
+        Yield (distance_km, item_id) for located items, nearest first.
+        """
+        return self._geo.nearest(lat, lng, max_km)
+
+    def select(self, user_id: str, excluded_ordinals: Optional[np.ndarray] = None, size_prefs: Optional[dict] = None, location: Optional[dict] = None, k: Optional[int] = None, max_km: Optional[float] = None) -> List[dict]:
+        """
+        Candidate items for a user computed by the batched ranking kernel:
+        nearest first when a location is given, random order otherwise.
+        """
+        with self._lock:
+            excluded_rows = ()
+            if excluded_ordinals is not None and len(excluded_ordinals):
+                excluded_ordinals = excluded_ordinals[excluded_ordinals < len(self._row_by_ordinal)]
+                excluded_rows = self._row_by_ordinal[excluded_ordinals]
+                excluded_rows = excluded_rows[excluded_rows >= 0]
+            mask = candidate_mask(self._cols, user_id, excluded_rows, size_prefs)
+            point = get_lat_lng(location)
+            if point:
+                rows = rank_nearest(self._cols, mask, point[0], point[1], k=k, max_km=max_km)
+            else:
+                rows = sample_rows(mask, k)
+            return [self._items[self._cols.ids[row]] for row in rows]
+
+    def items(self, item_ids: Iterable[str]) -> List[dict]:
+        return [self._items[i] for i in item_ids if i in self._items]
+
+
+item_index = ItemIndex()
@@ -4,40 +4,47 @@
 import os
 import logging
 from datetime import datetime
-from collections import defaultdict
 import asyncio
 
 from fastapi import FastAPI, HTTPException, Body, WebSocket, WebSocketDisconnect, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, JSONResponse
+from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from typing import List, Optional
-import firebase_admin
-from firebase_admin import credentials
-import google.auth
 
-
-from db import FirestoreDB
-from matching_service import get_available_items_for_user, handle_user_action
-from image_checks import check_image
+from db import FirestoreDB, register_event_handlers as register_db_event_handlers
+from async_db import AsyncFirestoreDB
+from matching_service import get_available_items_for_user, get_match_deck, handle_user_action, handle_user_actions_batch, remove_like
+from matching_service import register_event_handlers as register_matching_event_handlers
+from image_checks import check_images, pipeline as image_check_pipeline
+from image_derivatives import ImageDerivatives, IMAGE_DERIVATIVES_BUCKET, IMAGE_DERIVATIVES_DIR, IMAGE_DERIVATIVES_ENABLED
+from item_index import item_index, is_listed, ITEM_STATUS_PENDING_REVIEW
+from match_engine import like_index
+from metrics import registry as metrics_registry
+from event_bus import bus
+from chat_hub import chat_hub
+from chat_writer import ChatWriter
+from deletion_jobs import DeletionJobs, get_user_deletion_job_id
+from moderation import ModerationWorker
 
 # =========================
-# Firebase Initialization
+# Store Initialization
 # =========================
-if not firebase_admin._apps:
-    cred = None
-    local_path = "serviceAccountKey.json"
-    if os.path.exists(local_path):
-        cred = credentials.Certificate(local_path)
-    else:
-        try:
-            _, project_id = google.auth.default()
-            cred = credentials.ApplicationDefault()
-        except Exception as e:
-            logging.error(f"Firebase init failed: {e}")
-            raise
-    firebase_admin.initialize_app(cred)
-
+# Firestore by default; CIRCLOTH_STORE=memory boots against the in-memory store
 db = FirestoreDB()
+adb = AsyncFirestoreDB(db)
+deletion_jobs = DeletionJobs(db)
+# Websocket chat messages are persisted write-behind, after delivery
+chat_writer = ChatWriter(db)
+metrics_registry.register(chat_writer.collect)
+# Thumbnails and blur placeholders of item photos, rendered in the background
+derivatives = ImageDerivatives(adb)
+metrics_registry.register(derivatives.collect)
+# With ITEM_MODERATION=async, item photos are checked off the request path;
+# their derivatives are only rendered once the checks pass
+moderation = ModerationWorker(adb, on_visible=derivatives.submit)
+metrics_registry.register(moderation.collect)
 
 # =========================
 # FastAPI App & CORS
@@ -56,6 +63,69 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if IMAGE_DERIVATIVES_ENABLED and not IMAGE_DERIVATIVES_BUCKET:
+    # Photo thumbnails rendered to a shared directory (see image_derivatives.py)
+    os.makedirs(IMAGE_DERIVATIVES_DIR, exist_ok=True)
+    app.mount("/derivatives", StaticFiles(directory=IMAGE_DERIVATIVES_DIR), name="derivatives")
+
+@app.on_event("startup")
+def start_indexes():
+    # Keep the in-memory item and like indexes used by /match and /matches in sync with Firestore
+    item_index.start_resync(db.list_all_items)
+    like_index.start_resync(db.stream_like_actions)
+
+@app.on_event("startup")
+async def start_event_bus():
+    # Apply cache/index changes and chat messages published by the other workers
+    loop = asyncio.get_running_loop()
+    register_db_event_handlers(bus)
+    register_matching_event_handlers(bus)
+    bus.subscribe("chat_message", lambda p: loop.call_soon_threadsafe(chat_hub.broadcast, p["room_id"], p["message"]))
+    bus.start()
+    await chat_hub.start()
+
+@app.on_event("startup")
+async def resume_deletion_jobs():
+    await adb.run(deletion_jobs.resume_pending)
+
+@app.on_event("startup")
+async def start_chat_writer():
+    # Also replays messages journaled by a worker that died before persisting them
+    await adb.run(chat_writer.start)
+
+@app.on_event("startup")
+def start_image_checks():
+    # HTTP connection pool for photo downloads and the process pool for the checks
+    image_check_pipeline.start()
+
+@app.on_event("startup")
+async def start_moderation():
+    # Also re-enqueues items left pending without a queued job
+    await moderation.start()
+
+@app.on_event("shutdown")
+async def stop_chat_hub():
+    await chat_hub.stop()
+
+@app.on_event("shutdown")
+async def stop_moderation():
+    await moderation.stop()
+
+@app.on_event("shutdown")
+async def stop_derivatives():
+    await derivatives.stop()
+
+@app.on_event("shutdown")
+async def stop_image_checks():
+    await image_check_pipeline.stop()
+
+@app.on_event("shutdown")
+def stop_data_layer():
+    deletion_jobs.shutdown(wait=False)
+    chat_writer.stop()
+    bus.stop()
+    adb.shutdown(wait=True)
+
 # =========================
 # Models
 # =========================
@@ -71,6 +141,7 @@ class ItemModel(BaseModel):
     material: Optional[str] = None
     additionalInfo: Optional[str] = None
     sizeDetails: Optional[str] = None
+    location: Optional[dict] = None  # {"lat": ..., "lng": ...}
     created_at: Optional[str] = None
     updated_at: Optional[str] = None
 
@@ -90,6 +161,8 @@ class UserModel(BaseModel):
 class MatchRequest(BaseModel):
     user_id: str
     filter_by_size: bool = False
+    location: Optional[dict] = None  # {"lat": ..., "lng": ...}
+    max_distance_km: Optional[float] = None
 
 class ActionRequest(BaseModel):
     user_id: str
@@ -99,6 +172,16 @@ class ActionRequest(BaseModel):
     device_info: Optional[dict] = None
     location: Optional[dict] = None
 
+class BatchAction(BaseModel):
+    item_id: str
+    action: str  # "like" or "pass"
+    timestamp: Optional[str] = None  # client ISO timestamp, used to keep the latest action per item
+
+class BatchActionRequest(BaseModel):
+    user_id: str
+    actions: List[BatchAction]
+    last_like: Optional[int] = None  # ms timestamp
+
 class MessageSendRequest(BaseModel):
     sender: str
     receiver: str
@@ -108,6 +191,9 @@ class MessageListRequest(BaseModel):
     user1: str
     user2: str
     limit: Optional[int] = 50
+    before: Optional[str] = None  # message id: older messages (scrolling back)
+    after: Optional[str] = None  # message id: newer messages (catching up)
+    since_last_seen: bool = False  # messages after user1's previous visit, for reconnecting clients
 
 class ChatAccessUpdateRequest(BaseModel):
     user1: str
@@ -120,16 +206,13 @@ class ChatAccessUpdateRequest(BaseModel):
 def get_room_id(user1, user2):
     return "__".join(sorted([user1, user2]))
 
-# =========================
-# WebSocket Chat State
-# =========================
-chat_connections = defaultdict(set)
-
 # =========================
 # Variables
 # =========================
 
 MIN_PHOTOS = 1
+MAX_BATCH_ACTIONS = 500
+MAX_CHAT_PAGE = 200
 
 # =========================
 # Endpoints
@@ -137,126 +220,169 @@ MIN_PHOTOS = 1
 
 # --- Health Check ---
 @app.get("/")
-def health():
+async def health():
     return {"ok": True}
 
+# --- Metrics (Prometheus text format, per worker process) ---
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
 # --- User Endpoints ---
 @app.get("/user/{user_id}")
-def get_user_profile(user_id: str):
-    user = db.get_user(user_id)
+async def get_user_profile(user_id: str):
+    user = await adb.get_user(user_id)
     if not user:
         raise HTTPException(status_code=404, detail="USER_NOT_FOUND")
     return user
 
 @app.put("/user/{user_id}")
-def update_user_profile(user_id: str, user: UserModel):
-    db.update_user(user_id, user.dict(exclude_unset=True))
+async def update_user_profile(user_id: str, user: UserModel):
+    await adb.update_user(user_id, user.dict(exclude_unset=True))
     return {"message_key": "USER_UPDATED"}
 
 from fastapi import Request
 
 @app.patch("/user/{user_id}")
 async def edit_user_fields(user_id: str, request: Request):
-    user = db.get_user(user_id)
+    user = await adb.get_user(user_id)
     if not user:
         raise HTTPException(status_code=404, detail="USER_NOT_FOUND")
     update_fields = await request.json()
     if not isinstance(update_fields, dict) or not update_fields:
         raise HTTPException(status_code=400, detail="NO_FIELDS_TO_UPDATE")
-    db.update_user(user_id, update_fields)
+    await adb.update_user(user_id, update_fields)
     return {"message_key": "USER_UPDATED", "updated": list(update_fields.keys())}
 
 @app.delete("/user/{user_id}")
-def delete_user(user_id: str):
-    user = db.get_user(user_id)
+async def delete_user(user_id: str):
+    user = await adb.get_user(user_id)
     if not user:
         raise HTTPException(status_code=404, detail="USER_NOT_FOUND")
-    items = db.list_user_items(user_id)
-    for item in items:
-        db.delete_item(item["id"])
-    db.delete_user_actions(user_id)
-    db.delete_user_chats(user_id)
-    db.delete_user_matches(user_id)
-    db.delete_user(user_id)
-    return {"message_key": "USER_DELETED"}
+    # Items, actions, matches and chats are deleted by a background job; poll it for progress
+    job = await adb.run(deletion_jobs.start_user_deletion, user_id)
+    return JSONResponse(status_code=202, content={"message_key": "USER_DELETION_STARTED", "job": job})
+
+@app.get("/user/{user_id}/deletion")
+async def get_user_deletion(user_id: str):
+    job = await adb.run(deletion_jobs.get, get_user_deletion_job_id(user_id))
+    if not job:
+        raise HTTPException(status_code=404, detail="DELETION_JOB_NOT_FOUND")
+    return {"job": job}
 
 @app.get("/user/{user_id}/actions")
-def get_user_actions(user_id: str):
-    actions = db.get_user_actions(user_id)
+async def get_user_actions(user_id: str):
+    actions = await adb.get_user_actions(user_id)
     return {"actions": actions}
 
 @app.get("/user/{user_id}/size_preferences")
-def get_size_preferences(user_id: str):
-    user = db.get_user(user_id)
+async def get_size_preferences(user_id: str):
+    user = await adb.get_user(user_id)
     if not user:
         raise HTTPException(status_code=404, detail="USER_NOT_FOUND")
     return user.get("size_preferences", {})
 
 @app.patch("/user/{user_id}/size_preferences")
-def update_size_preferences(user_id: str, size_preferences: dict = Body(...)):
-    user = db.get_user(user_id)
+async def update_size_preferences(user_id: str, size_preferences: dict = Body(...)):
+    user = await adb.get_user(user_id)
     if not user:
         raise HTTPException(status_code=404, detail="USER_NOT_FOUND")
-    db.update_user(user_id, {"size_preferences": size_preferences})
+    await adb.update_user(user_id, {"size_preferences": size_preferences})
     return {"message_key": "SIZE_PREFERENCES_UPDATED"}
 
 # --- Item Endpoints ---
 @app.get("/items/{user_id}")
-def get_user_items(user_id: str):
-    return {"items": db.list_user_items(user_id)}
+async def get_user_items(user_id: str):
+    return {"items": await adb.list_user_items(user_id)}
 
 @app.get("/item/{item_id}")
-def get_item(item_id: str):
-    item = db.get_item(item_id)
+async def get_item(item_id: str):
+    item = await adb.get_item(item_id)
     if not item:
         raise HTTPException(status_code=404, detail="ITEM_NOT_FOUND")
     return item
 
 @app.post("/item")
-def create_item(item: ItemModel):
+async def create_item(item: ItemModel):
     if not item.category or not item.size or not item.itemStory:
         raise HTTPException(status_code=400, detail="MISSING_REQUIRED_FIELDS")
     if not item.photoURLs or len(item.photoURLs) < MIN_PHOTOS:
         raise HTTPException(status_code=400, detail="NOT_ENOUGH_PHOTOS")
-    for url in item.photoURLs:
-        result = check_image(url)
-        if result is not True:
-            raise HTTPException(status_code=400, detail=str(result))
     item_dict = item.dict(exclude_unset=True)
-    item_id = db.create_item(item_dict)
+    if moderation.enabled:
+        # Hidden from matching until the queued photo checks pass
+        item_dict["status"] = ITEM_STATUS_PENDING_REVIEW
+        item_id = await adb.create_item(item_dict)
+        await moderation.submit(item_id, item.photoURLs)
+        return {"id": item_id, "status": ITEM_STATUS_PENDING_REVIEW}
+    # All photos are fetched and checked concurrently; the first failure wins
+    result = await check_images(item.photoURLs)
+    if result is not True:
+        raise HTTPException(status_code=400, detail=str(result))
+    item_id = await adb.create_item(item_dict)
+    derivatives.submit(item_id, item.photoURLs)
     return {"id": item_id}
 
-@app.patch("/item/{item_id}")
-def edit_item(item_id: str, item: ItemModel):
-    db.update_item(item_id, item.dict(exclude_unset=True))
+async def moderate_item_photos(item_id: str, updates: dict) -> bool:
+    """
+    Check the photos of an item update: inline (400 on failure), or in async
+    moderation mode by marking the item pending when its photos changed.
+    Returns True when the caller must queue a moderation job after the write.
+    """
+    if moderation.enabled:
+        current = await adb.get_item(item_id)
+        if current and current.get("photoURLs") == updates["photoURLs"]:
+            return False
+        updates["status"] = ITEM_STATUS_PENDING_REVIEW
+        return True
+    # Unchanged photos are answered by the verdict cache
+    result = await check_images(updates["photoURLs"])
+    if result is not True:
+        raise HTTPException(status_code=400, detail=str(result))
+    return False
+
+async def save_item_update(item_id: str, updates: dict) -> dict:
+    queue_review = bool(updates.get("photoURLs")) and await moderate_item_photos(item_id, updates)
+    await adb.update_item(item_id, updates)
+    if updates.get("photoURLs") and not queue_review:
+        # Photos under review get theirs when the moderation worker lists the item
+        item = await adb.get_item(item_id)
+        if item and is_listed(item) and not derivatives.is_current(item):
+            derivatives.submit(item_id, item["photoURLs"])
+    if queue_review:
+        await moderation.submit(item_id, updates["photoURLs"])
+        return {"message_key": "ITEM_UPDATED", "status": ITEM_STATUS_PENDING_REVIEW}
     return {"message_key": "ITEM_UPDATED"}
 
+@app.patch("/item/{item_id}")
+async def edit_item(item_id: str, item: ItemModel):
+    return await save_item_update(item_id, item.dict(exclude_unset=True))
+
 @app.put("/item/{item_id}")
-def update_item(item_id: str, item: ItemModel):
+async def update_item(item_id: str, item: ItemModel):
     if not item.category or not item.size or not item.itemStory:
         raise HTTPException(status_code=400, detail="MISSING_REQUIRED_FIELDS")
     if not item.photoURLs or len(item.photoURLs) < 2:
         raise HTTPException(status_code=400, detail="NOT_ENOUGH_PHOTOS")
-    db.update_item(item_id, item.dict(exclude_unset=True))
-    return {"message_key": "ITEM_UPDATED"}
+    return await save_item_update(item_id, item.dict(exclude_unset=True))
 
 @app.delete("/item/{item_id}")
-def delete_item(item_id: str):
-    db.delete_item_actions(item_id)
-    db.delete_item_matches(item_id)
-    db.delete_item(item_id)
+async def delete_item(item_id: str):
+    await adb.delete_item_cascade(item_id)
     return {"message_key": "ITEM_DELETED"}
 
 # --- Match Endpoints ---
 @app.post("/match")
-def match_items(req: MatchRequest):
-    user = db.get_user(req.user_id)
+async def match_items(req: MatchRequest):
+    user = await adb.get_user(req.user_id)
     if not user:
         raise HTTPException(status_code=404, detail="USER_NOT_FOUND")
     location = getattr(req, "location", None)
     if location:
-        db.update_user(req.user_id, {"location": {**location, "updated_at": datetime.utcnow().isoformat() + "Z"}})
-    available_items = get_available_items_for_user(req.user_id, location, filter_by_size=req.filter_by_size)
+        await adb.update_user(req.user_id, {"location": {**location, "updated_at": datetime.utcnow().isoformat() + "Z"}})
+    available_items = await adb.run(
+        get_available_items_for_user, req.user_id, location, filter_by_size=req.filter_by_size, limit=1, max_distance_km=req.max_distance_km
+    )
     logging.warning(
         f"[MATCH DEBUG] user_id={req.user_id} available_items={len(available_items)} filter_by_size={req.filter_by_size}"
     )
@@ -264,26 +390,52 @@ def match_items(req: MatchRequest):
         return {"message_key": "NO_MATCHES", "item": None}
     return {"item": available_items[0]}
 
+@app.post("/match/deck")
+async def match_deck(req: MatchRequest, k: int = Query(20, ge=1, le=100), reset: bool = False):
+    user = await adb.get_user(req.user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="USER_NOT_FOUND")
+    location = getattr(req, "location", None)
+    items = await adb.run(
+        get_match_deck, req.user_id, location, filter_by_size=req.filter_by_size, k=k, reset=reset, max_distance_km=req.max_distance_km
+    )
+    if not items:
+        return {"message_key": "NO_MATCHES", "items": []}
+    return {"items": items}
+
 @app.post("/action")
-def handle_action(req: ActionRequest):
+async def handle_action(req: ActionRequest):
     # Pass last_like to handler if present
-    handle_user_action(req.user_id, req.item_id, req.action, last_like=req.last_like)
+    await adb.run(handle_user_action, req.user_id, req.item_id, req.action, last_like=req.last_like)
     return {"message_key": "ACTION_HANDLED"}
 
+@app.post("/actions/batch")
+async def handle_actions_batch(req: BatchActionRequest):
+    if len(req.actions) > MAX_BATCH_ACTIONS:
+        raise HTTPException(status_code=400, detail="TOO_MANY_ACTIONS")
+    actions = [a.dict() for a in req.actions]
+    result = await adb.run(handle_user_actions_batch, req.user_id, actions, last_like=req.last_like)
+    if result["failed"] and not result["applied"]:
+        raise HTTPException(status_code=503, detail="ACTIONS_NOT_SAVED")
+    if result["failed"]:
+        # The client keeps the failed actions buffered and sends them again
+        return {"message_key": "ACTIONS_PARTIALLY_HANDLED", **result}
+    return {"message_key": "ACTIONS_HANDLED", **result}
+
 @app.delete("/match/{user_id}/{other_user_id}/{item_id}/{your_item_id}")
-def delete_match(user_id: str, other_user_id: str, item_id: str, your_item_id: str):
-    db.remove_like(user_id, item_id)
-    db.remove_like(other_user_id, your_item_id)
+async def delete_match(user_id: str, other_user_id: str, item_id: str, your_item_id: str):
+    await adb.run(remove_like, user_id, item_id)
+    await adb.run(remove_like, other_user_id, your_item_id)
     return {"message_key": "MATCH_DELETED"}
 
 @app.get("/matches/{user_id}")
-def get_matches(user_id: str):
-    matches = db.get_all_matches_for_user(user_id)
+async def get_matches(user_id: str):
+    matches = await adb.get_all_matches_for_user(user_id)
     return {"matches": matches}
 
 @app.get("/user/{visitor_id}/liked_items/{profile_id}")
-def get_liked_items(profile_id: str, visitor_id: str):
-    items = db.get_liked_items_of_profile_by_visitor(profile_id, visitor_id)
+async def get_liked_items(profile_id: str, visitor_id: str):
+    items = await adb.get_liked_items_of_profile_by_visitor(profile_id, visitor_id)
     return {"liked_items": items}
 
 # --- Chat Endpoints ---
@@ -291,63 +443,79 @@ def get_liked_items(profile_id: str, visitor_id: str):
 async def chat_ws(websocket: WebSocket, user1: str, user2: str):
     room_id = get_room_id(user1, user2)
     await websocket.accept()
-    chat_connections[room_id].add(websocket)
+    conn = chat_hub.connect(websocket, room_id)
     try:
         while True:
             data = await websocket.receive_json()
+            conn.received()
+            if data.get("type") in ("ping", "pong"):
+                continue
             sender = data.get("sender")
             receiver = data.get("receiver")
             content = data.get("content")
             if sender and receiver and content:
-                db.add_chat_message(sender, receiver, content, datetime.utcnow().isoformat() + "Z")
-                for conn in chat_connections[room_id]:
-                    try:
-                        await conn.send_json({"sender": sender, "receiver": receiver, "content": content})
-                    except Exception:
-                        pass
+                # Deliver first; persistence is batched per room by the chat writer
+                message = {"sender": sender, "receiver": receiver, "content": content}
+                chat_hub.broadcast(room_id, message)
+                # The other participant may be connected to another worker
+                bus.publish("chat_message", {"room_id": room_id, "message": message})
+                chat_writer.enqueue(sender, receiver, content, datetime.utcnow().isoformat() + "Z")
             else:
-                await websocket.send_json({"error": "Invalid message format"})
+                conn.enqueue({"error": "Invalid message format"})
     except WebSocketDisconnect:
-        chat_connections[room_id].remove(websocket)
-    except Exception:
-        chat_connections[room_id].remove(websocket)
-        await websocket.close()
+        pass
+    except Exception as e:
+        logging.info(f"[CHAT] websocket error in room {room_id}: {e!r}")
+    finally:
+        await chat_hub.disconnect(conn)
 
 @app.post("/chat/send")
-def send_message(req: MessageSendRequest):
+async def send_message(req: MessageSendRequest):
     if not req.sender or not req.receiver or not req.content:
         raise HTTPException(status_code=400, detail="MISSING_SENDER_RECEIVER_OR_CONTENT")
-    db.add_chat_message(req.sender, req.receiver, req.content, datetime.utcnow().isoformat() + "Z")
+    await adb.add_chat_message(req.sender, req.receiver, req.content, datetime.utcnow().isoformat() + "Z")
     return {"message_key": "MESSAGE_SENT"}
 
 @app.post("/chat/list")
-def list_messages(req: MessageListRequest):
+async def list_messages(req: MessageListRequest):
+    if req.before and req.after:
+        raise HTTPException(status_code=400, detail="BEFORE_AND_AFTER_EXCLUSIVE")
+    limit = min(max(req.limit or 50, 1), MAX_CHAT_PAGE)
     try:
-        db.update_chat_last_access(req.user1, req.user2, req.user1)
-        db.update_user(req.user1, {})
-        messages = db.get_chat_messages(req.user1, req.user2, req.limit)
-        if not messages:
-            return {"messages": []}
-        return {"messages": messages}
+        before = after = None
+        if req.before or req.after:
+            cursor = await adb.get_message_cursor(req.user1, req.user2, req.before or req.after)
+            if cursor is None:
+                raise HTTPException(status_code=400, detail="INVALID_CURSOR")
+            before, after = (cursor, None) if req.before else (None, cursor)
+        last_seen = await adb.update_chat_last_access(req.user1, req.user2, req.user1)
+        if req.since_last_seen and not (before or after) and last_seen:
+            after = (last_seen, None)
+        page = await adb.get_chat_messages(req.user1, req.user2, limit, before=before, after=after)
+        page = chat_writer.merge_pending(req.user1, req.user2, page, limit, before=before, after=after)
+        return {"messages": page["messages"], "has_more": page["has_more"], "last_seen": last_seen}
+    except HTTPException:
+        raise
     except Exception as e:
         logging.exception(f"Error fetching chat messages for {req.user1} <-> {req.user2}")
         raise HTTPException(status_code=500, detail="FAILED_TO_FETCH_MESSAGES")
 
 @app.get("/chat/list_chats/{user_id}")
-def list_user_chats(user_id: str):
-    chats = db.list_user_chats(user_id)
-    return {"chats": chats}
+async def list_user_chats(user_id: str, limit: int = Query(50, ge=1, le=MAX_CHAT_PAGE), start_after: Optional[str] = None):
+    # One read of the user's inbox index, most recent chat first; page with start_after=<last chat id>
+    return await adb.list_user_chats(user_id, limit, start_after)
 
 @app.post("/chat/update_access")
-def update_chat_access(req: ChatAccessUpdateRequest):
-    db.update_chat_last_access(req.user1, req.user2, req.user_id)
+async def update_chat_access(req: ChatAccessUpdateRequest):
+    # Explicit "mark read" (e.g. when leaving a chat) is never coalesced
+    await adb.update_chat_last_access(req.user1, req.user2, req.user_id, force=True)
     return {"message_key": "LAST_ACCESS_UPDATED"}
 
 @app.post("/item/{item_id}/lock")
-def lock_item(item_id: str, payload: dict = Body(...)):
+async def lock_item(item_id: str, payload: dict = Body(...)):
     user_id = payload.get("user_id")
     print("Locking item", item_id, "for user", user_id)
-    db.set_item_locked_for(item_id, user_id)
+    await adb.set_item_locked_for(item_id, user_id)
     return {"message_key": "ITEM_LOCK_UPDATED"}
 
 
@@ -0,0 +1,87 @@
+# match_backfill.py
+# Rebuild or check the materialized 'matches' collection from the 'actions' collection.
+#
+# Usage (from backend/):
+#   python match_backfill.py rebuild   # rewrite every match, delete stale ones
+#   python match_backfill.py check     # report differences, exit 1 if any
+import sys
+import argparse
+from datetime import datetime
+
+from db import FirestoreDB
+from match_engine import LikeIndex, build_match_record
+
+
+BATCH_SIZE = 500  # Firestore max writes per batch
+
+
+def compute_expected_matches(db: FirestoreDB) -> dict:
+    """
+    One streaming pass over the 'like' actions -> {pair_id: pair_likes}.
+    """
+    likes = LikeIndex()
+    likes.load(db.stream_like_actions())
+    now = datetime.utcnow().isoformat() + "Z"
+    expected = {}
+    for pair_likes in likes.mutual_pairs():
+        record = build_match_record(pair_likes, now)
+        expected[record["id"]] = record
+    return expected
+
+
+def load_existing_matches(db: FirestoreDB) -> dict:
+    return {doc.id: doc.to_dict() for doc in db.db.collection("matches").stream()}
+
+
+def diff_matches(expected: dict, existing: dict) -> dict:
+    missing = sorted(set(expected) - set(existing))
+    stale = sorted(set(existing) - set(expected))
+    mismatched = sorted(
+        match_id for match_id in set(expected) & set(existing)
+        if expected[match_id]["likes"] != existing[match_id].get("likes")
+    )
+    return {"missing": missing, "stale": stale, "mismatched": mismatched}
+
+
+def rebuild(db: FirestoreDB):
+    expected = compute_expected_matches(db)
+    existing = load_existing_matches(db)
+    diff = diff_matches(expected, existing)
+    matches_ref = db.db.collection("matches")
+
+    ops = [("set", match_id) for match_id in expected] + [("delete", match_id) for match_id in diff["stale"]]
+    for start in range(0, len(ops), BATCH_SIZE):
+        batch = db.db.batch()
+        for op, match_id in ops[start:start + BATCH_SIZE]:
+            if op == "set":
+                batch.set(matches_ref.document(match_id), expected[match_id])
+            else:
+                batch.delete(matches_ref.document(match_id))
+        batch.commit()
+        print(f"[rebuild] committed {min(start + BATCH_SIZE, len(ops))}/{len(ops)} writes")
+    print(f"[rebuild] {len(expected)} matches written, {len(diff['stale'])} stale matches deleted")
+
+
+def check(db: FirestoreDB) -> bool:
+    diff = diff_matches(compute_expected_matches(db), load_existing_matches(db))
+    for kind, match_ids in diff.items():
+        print(f"[check] {kind}: {len(match_ids)}")
+        for match_id in match_ids[:20]:
+            print(f"  {match_id}")
+    return not any(diff.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild or check the materialized matches collection")
+    parser.add_argument("command", choices=["rebuild", "check"])
+    args = parser.parse_args()
+
+    db = FirestoreDB()
+    if args.command == "rebuild":
+        rebuild(db)
+    elif not check(db):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+# match_engine.py
+# Inverted like indexes used to compute reciprocal-like matches.
+import os
+import threading
+import time
+import logging
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from item_index import item_index
+
+
+LIKE_INDEX_RESYNC_SECONDS = int(os.getenv("LIKE_INDEX_RESYNC_SECONDS", 300))
+
+
+def get_pair_id(user1: str, user2: str) -> str:
+    return "__".join(sorted([user1, user2]))
+
+
+def build_match_record(pair_likes: Dict[str, List[str]], updated_at: str) -> dict:
+    """
+    Denormalized 'matches' document for two users who liked each other's items.
+    pair_likes maps each user to the other user's items they liked.
+    """
+    users = sorted(pair_likes)
+    return {
+        "id": get_pair_id(*users),
+        "users": users,
+        "likes": pair_likes,
+        "updated_at": updated_at,
+    }
+
+
+class LikeIndex:
+    """
+    Two inverted indexes over 'like' actions:
+    - likes_by_liker: liker_id -> {item_id}
+    - likes_received: owner_id -> {liker_id -> {item_id of owner}}
+    so one user's matches are a set intersection over their own likes.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._likes_by_liker: Dict[str, Set[str]] = defaultdict(set)
+        self._likes_received: Dict[str, Dict[str, Set[str]]] = defaultdict(lambda: defaultdict(set))
+        self._owner_of: Dict[str, str] = {}  # item_id -> owner at the time of the like
+        self.loaded_at: Optional[float] = None
+        self._resync_thread: Optional[threading.Thread] = None
+        # One log of like changes per reload in progress (see ItemIndex.reload)
+        self._change_logs: List[list] = []
+
+    # --- Loading ---
+    def load(self, like_actions: Iterable[dict]):
+        """
+        Replace the indexes with the given 'like' actions ({user_id, item_id}).
+        """
+        with self._lock:
+            self._likes_by_liker = defaultdict(set)
+            self._likes_received = defaultdict(lambda: defaultdict(set))
+            self._owner_of = {}
+            for action in like_actions:
+                self._add(action["user_id"], action["item_id"])
+            self.loaded_at = time.monotonic()
+
+    def ensure_loaded(self, load_like_actions: Callable[[], Iterable[dict]]):
+        if self.loaded_at is None:
+            with self._lock:
+                if self.loaded_at is None:
+                    self.reload(load_like_actions)
+
+    def reload(self, load_like_actions: Callable[[], Iterable[dict]]):
+        """
+        Rebuild the indexes from a fresh read of the likes, without holding the
+        lock during the read. Changes applied meanwhile are replayed onto it.
+        """
+        log = []
+        with self._lock:
+            self._change_logs.append(log)
+        try:
+            like_actions = list(load_like_actions())
+        except Exception:
+            with self._lock:
+                self._change_logs.remove(log)
+            raise
+        with self._lock:
+            self._change_logs.remove(log)
+            self.load(like_actions)
+            for op, *args in log:
+                getattr(self, op)(*args)
+
+    def _log(self, *op):
+        for log in self._change_logs:
+            log.append(op)
+
+    def start_resync(self, load_like_actions: Callable[[], Iterable[dict]], interval: int = LIKE_INDEX_RESYNC_SECONDS):
+        """
+        Start a daemon thread that rebuilds the indexes every `interval` seconds.
+        """
+        if self._resync_thread and self._resync_thread.is_alive():
+            return
+
+        def _run():
+            while True:
+                try:
+                    self.load(load_like_actions())
+                except Exception as e:
+                    logging.error(f"Like index resync failed: {e}")
+                time.sleep(interval)
+
+        self._resync_thread = threading.Thread(target=_run, name="like-index-resync", daemon=True)
+        self._resync_thread.start()
+
+    # --- Write paths ---
+    def add_like(self, user_id: str, item_id: str):
+        with self._lock:
+            self._log("add_like", user_id, item_id)
+            self._add(user_id, item_id)
+
+    def remove_like(self, user_id: str, item_id: str):
+        with self._lock:
+            self._log("remove_like", user_id, item_id)
+            self._likes_by_liker.get(user_id, set()).discard(item_id)
+            owner_id = self._owner_of.get(item_id)
+            received = self._likes_received.get(owner_id, {}).get(user_id)
+            if received is not None:
+                received.discard(item_id)
+
+    def remove_item(self, item_id: str) -> Tuple[Optional[str], Set[str]]:
+        """
+        Drop every like of an item (e.g. when the item is deleted).
+        Returns the item owner and the users whose like was removed.
+        """
+        likers = set()
+        with self._lock:
+            self._log("remove_item", item_id)
+            owner_id = self._owner_of.pop(item_id, None)
+            for liker_id, items in self._likes_received.get(owner_id, {}).items():
+                if item_id in items:
+                    items.discard(item_id)
+                    self._likes_by_liker.get(liker_id, set()).discard(item_id)
+                    likers.add(liker_id)
+        return owner_id, likers
+
+    def remove_user_likes(self, user_id: str) -> Set[str]:
+        """
+        Drop every like made by a user (e.g. when the user is deleted).
+        Returns the owners of the items the user had liked.
+        """
+        owners = set()
+        with self._lock:
+            self._log("remove_user_likes", user_id)
+            for item_id in self._likes_by_liker.pop(user_id, set()):
+                owner_id = self._owner_of.get(item_id)
+                if owner_id:
+                    owners.add(owner_id)
+                    self._likes_received.get(owner_id, {}).pop(user_id, None)
+        return owners
+
+    def _add(self, user_id: str, item_id: str):
+        self._likes_by_liker[user_id].add(item_id)
+        item = item_index.get(item_id)
+        owner_id = item.get("ownerId") if item else None
+        if owner_id:
+            self._owner_of[item_id] = owner_id
+            self._likes_received[owner_id][user_id].add(item_id)
+
+    # --- Queries ---
+    def liked_items(self, user_id: str) -> Set[str]:
+        with self._lock:
+            return set(self._likes_by_liker.get(user_id, ()))
+
+    def items_liked_by(self, owner_id: str, liker_id: str) -> Set[str]:
+        """
+        Items of owner_id liked by liker_id.
+        """
+        with self._lock:
+            return set(self._likes_received.get(owner_id, {}).get(liker_id, ()))
+
+    def owner_of(self, item_id: str) -> Optional[str]:
+        with self._lock:
+            return self._owner_of.get(item_id)
+
+    def pair_likes(self, user_a: str, user_b: str) -> Optional[Dict[str, List[str]]]:
+        """
+        {user_a: [items of user_b liked by user_a], user_b: [...]} if the two
+        users liked each other's items, otherwise None.
+        """
+        with self._lock:
+            a_likes = self._likes_received.get(user_b, {}).get(user_a)
+            b_likes = self._likes_received.get(user_a, {}).get(user_b)
+            if user_a != user_b and a_likes and b_likes:
+                return {user_a: sorted(a_likes), user_b: sorted(b_likes)}
+        return None
+
+    def mutual_pairs(self) -> Iterable[Dict[str, List[str]]]:
+        """
+        pair_likes() of every pair of users with reciprocal likes, each pair once.
+        """
+        with self._lock:
+            pairs = [
+                (liker_id, owner_id)
+                for owner_id, likers in self._likes_received.items()
+                for liker_id, items in likers.items()
+                if items and liker_id < owner_id
+            ]
+        for liker_id, owner_id in pairs:
+            likes = self.pair_likes(liker_id, owner_id)
+            if likes:
+                yield likes
+
+
+like_index = LikeIndex()
@@ -1,87 +1,160 @@
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from typing import List, Dict, Iterator, Optional
+from itertools import islice
 from db import FirestoreDB
+from item_index import item_index, is_listed
+from geo_index import get_lat_lng
+from seen_state import SeenStore
+from match_engine import like_index
+from event_bus import EventBus
 import os
-import random
-import math
+import threading
+import time
 
 
 PASS_EXPIRY_SECONDS = int(os.getenv("PASS_EXPIRY_SECONDS", 120))  # default 60 seconds for testing
+DECK_CURSOR_TTL_SECONDS = int(os.getenv("DECK_CURSOR_TTL_SECONDS", 60))
+MAX_DECK_SIZE = 100
 
-def get_available_items_for_user(user_id: str, location: dict = None, filter_by_size: bool = False) -> List[dict]:
+# Liked / recently passed items per user, kept current by handle_user_action
+seen_store = SeenStore(PASS_EXPIRY_SECONDS)
+
+
+def _get_candidate_items(db: FirestoreDB, user: dict, user_id: str, filter_by_size: bool, location: dict = None, limit: Optional[int] = None, max_distance_km: Optional[float] = None) -> List[dict]:
+    """
+    Items available for matching for the user, selected by the batched ranking
+    kernel: nearest first if location is provided, random order otherwise.
+    """
+    item_index.ensure_loaded(db.list_all_items)
+    excluded_ordinals = seen_store.get(user_id, db.get_user_actions).excluded_ordinals()
+    # size_preferences is a dict of lists: {category: [sizes]}
+    size_prefs = user.get("size_preferences") if filter_by_size else None
+    return item_index.select(user_id, excluded_ordinals, size_prefs, location, k=limit, max_km=max_distance_km)
+
+
+def _iter_nearest_candidates(db: FirestoreDB, user: dict, user_id: str, filter_by_size: bool, location: dict, max_distance_km: Optional[float] = None) -> Iterator[dict]:
+    """
+    Lazily yields items available for matching, nearest first, by expanding rings
+    of the item index geo grid around the user's location. Items without a
+    location come last (unless max_distance_km is set).
+    """
+    seen = seen_store.get(user_id, db.get_user_actions)
+    size_prefs = user.get("size_preferences") if filter_by_size else None
+
+    def is_candidate(item):
+        if item.get("ownerId") == user_id or seen.is_excluded(item_index.ordinal(item["id"])):
+            return False
+        if size_prefs:
+            # size_preferences is a dict of lists: {category: [sizes]}
+            allowed_sizes = size_prefs.get(item.get("category"))
+            return isinstance(allowed_sizes, list) and item.get("size") in allowed_sizes
+        return True
+
+    item_index.ensure_loaded(db.list_all_items)
+    lat, lng = get_lat_lng(location)
+
+    # The seen-state is loaded eagerly above; only the ring expansion is lazy
+    def iter_items():
+        for _, item_id in item_index.nearest(lat, lng, max_distance_km):
+            item = item_index.get(item_id)
+            if item and is_candidate(item):
+                yield item
+        if max_distance_km is None:
+            for item in item_index.items(item_index.ids_without_location()):
+                if is_candidate(item):
+                    yield item
+
+    return iter_items()
+
+
+def get_available_items_for_user(user_id: str, location: dict = None, filter_by_size: bool = False, limit: Optional[int] = None, max_distance_km: Optional[float] = None) -> List[dict]:
     """
     Returns items available for matching for the user, considering pass expiry.
-    If location is provided, items are ordered by proximity. Otherwise, order is randomized.
+    If location is provided, items are ordered by proximity (optionally within
+    max_distance_km). Otherwise, order is randomized.
     If filter_by_size is True, only return items matching user's size_preferences.
+    If limit is given, only the first `limit` items are selected (no full sort).
+    Items pending or rejected by photo moderation are never returned.
     """
     db = FirestoreDB()
     user = db.get_user(user_id)
     if not user:
         return []
 
-    actions = db.get_user_actions(user_id)
-    now = datetime.utcnow()
-    excluded_item_ids = set()
-    passed_items_to_reconsider = set()
-    latest_action_per_item: Dict[str, dict] = {}
-
-    # Find the latest action for each item
-    for action in actions:
-        item_id = action["item_id"]
-        prev = latest_action_per_item.get(item_id)
-        if not prev or action["timestamp"] > prev["timestamp"]:
-            latest_action_per_item[item_id] = action
-
-    for item_id, action in latest_action_per_item.items():
-        if action["action"] == "like":
-            excluded_item_ids.add(item_id)
-        elif action["action"] == "pass":
-            # Check if pass is expired
-            ts = action["timestamp"]
-            if isinstance(ts, str):
-                ts = datetime.fromisoformat(ts.replace("Z", ""))
-            if (now - ts).total_seconds() < PASS_EXPIRY_SECONDS:
-                excluded_item_ids.add(item_id)
-            else:
-                passed_items_to_reconsider.add(item_id)
-
-    all_items = db.list_items()
-    available_items = [
-        item for item in all_items
-        if item.get("ownerId") != user_id and item.get("id") not in excluded_item_ids
-    ]
-
-    # Filter by size preferences if requested
-    if filter_by_size and user.get("size_preferences"):
-        size_prefs = user["size_preferences"]
-        def matches_size(item):
-            item_size = item.get("size")
-            item_category = item.get("category")
-            if not item_size or not item_category:
-                return False
-            # size_prefs is a dict of lists: {category: [sizes]}
-            allowed_sizes = size_prefs.get(item_category)
-            if allowed_sizes and isinstance(allowed_sizes, list):
-                return item_size in allowed_sizes
-            return False
-        available_items = [item for item in available_items if matches_size(item)]
-
-    if location and "lat" in location and "lng" in location:
-        def distance(item):
-            loc = item.get("location")
-            if loc and "lat" in loc and "lng" in loc:
-                # Haversine formula for distance in km
-                R = 6371
-                dlat = math.radians(loc["lat"] - location["lat"])
-                dlon = math.radians(loc["lng"] - location["lng"])
-                a = math.sin(dlat/2)**2 + math.cos(math.radians(location["lat"])) * math.cos(math.radians(loc["lat"])) * math.sin(dlon/2)**2
-                c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-                return R * c
-            return float('inf')
-        available_items.sort(key=distance)
-    else:
-        random.shuffle(available_items)
-    return available_items
+    if get_lat_lng(location) and limit is not None:
+        # A few nearest items: expanding geo grid rings only touches nearby cells
+        nearest = _iter_nearest_candidates(db, user, user_id, filter_by_size, location, max_distance_km)
+        return list(islice(nearest, limit))
+    return _get_candidate_items(db, user, user_id, filter_by_size, location, limit, max_distance_km)
+
+
+# --- Deck mode ---
+class _DeckCursor:
+    """
+    Remaining ranked candidates of a user's deck. With a location this is the
+    nearest-first geo grid iterator, so each page only expands as many rings as
+    it needs; otherwise it iterates over a pre-shuffled candidate list.
+    """
+
+    def __init__(self, key: tuple, candidates: Iterator[dict]):
+        self.key = key
+        self.candidates = candidates
+        # Serializes pages of one user's deck; generators cannot be advanced concurrently
+        self.lock = threading.Lock()
+        self.touch()
+
+    def touch(self):
+        self.expires_at = time.monotonic() + DECK_CURSOR_TTL_SECONDS
+
+    def expired(self) -> bool:
+        return time.monotonic() > self.expires_at
+
+
+_deck_cursors: Dict[str, _DeckCursor] = {}
+# Guards _deck_cursors only; iterating a cursor holds that cursor's own lock
+_deck_lock = threading.Lock()
+
+
+def get_match_deck(user_id: str, location: dict = None, filter_by_size: bool = False, k: int = 20, reset: bool = False, max_distance_km: Optional[float] = None) -> List[dict]:
+    """
+    Returns the next `k` candidates for the user. The ranked candidates are kept
+    in a short-lived per-user cursor, so later pages continue where the last one
+    stopped instead of recomputing from scratch. The cursor is rebuilt when it
+    expires, when the request parameters change or when reset is True.
+    """
+    k = max(1, min(k, MAX_DECK_SIZE))
+    key = (get_lat_lng(location), filter_by_size, max_distance_km)
+
+    with _deck_lock:
+        for uid in [uid for uid, c in _deck_cursors.items() if c.expired()]:
+            del _deck_cursors[uid]
+        cursor = _deck_cursors.get(user_id)
+
+    if reset or cursor is None or cursor.key != key:
+        db = FirestoreDB()
+        user = db.get_user(user_id)
+        if not user:
+            return []
+        if get_lat_lng(location):
+            candidates = _iter_nearest_candidates(db, user, user_id, filter_by_size, location, max_distance_km)
+        else:
+            candidates = iter(_get_candidate_items(db, user, user_id, filter_by_size))
+        cursor = _DeckCursor(key, candidates)
+        with _deck_lock:
+            _deck_cursors[user_id] = cursor
+
+    deck = []
+    with cursor.lock:
+        for item in cursor.candidates:
+            # Skip items deleted, re-assigned or sent back to moderation since the cursor was built
+            current = item_index.get(item["id"])
+            if current and current.get("ownerId") != user_id and is_listed(current):
+                deck.append(current)
+                if len(deck) >= k:
+                    break
+        cursor.touch()
+    return deck
+
 
 def handle_user_action(user_id: str, item_id: str, action: str, last_like: int = None):
     """
@@ -89,9 +162,78 @@ def handle_user_action(user_id: str, item_id: str, action: str, last_like: int =
     """
     db = FirestoreDB()
     now = datetime.utcnow().isoformat() + "Z"
-    # Remove previous actions for this item (if any)
-    db.delete_user_action(user_id, item_id)
+    item_index.ensure_loaded(db.list_all_items)
+    like_index.ensure_loaded(db.stream_like_actions)
+    item = item_index.get(item_id)
+    owner_id = item.get("ownerId") if item else None
+    matched_before = bool(owner_id) and like_index.pair_likes(user_id, owner_id) is not None
+    # Overwrites the previous action on this item (if any)
     db.save_user_action(user_id, item_id, action, now)
+    seen_store.record(user_id, item_id, action, now)
+    # Materialize (or tear down) the match when this action may change reciprocity.
+    # A like is always checked against the store; otherwise the like index only
+    # tells whether there was a match to tear down.
+    if owner_id and owner_id != user_id:
+        if action == "like" or matched_before:
+            db.refresh_match_record(user_id, owner_id)
     # Optionally update last_like field on user if action is like
     if action == "like" and last_like is not None:
         db.update_user(user_id, {"last_like": last_like})
+
+
+def handle_user_actions_batch(user_id: str, actions: List[dict], last_like: int = None) -> dict:
+    """
+    Apply a buffered list of swipes ({"item_id", "action", "timestamp"?}).
+    Actions on the same item are coalesced to the latest one (by client
+    timestamp, then list order), written through batched commits, and
+    last_like is updated once. Returns {"applied": count, "failed": item_ids};
+    a failed commit leaves the actions it held (and every later one) unsaved,
+    for the client to send again.
+    """
+    latest = {}
+    for position, a in enumerate(actions):
+        key = (a.get("timestamp") or "", position)
+        if a["item_id"] not in latest or key >= latest[a["item_id"]][0]:
+            latest[a["item_id"]] = (key, a["action"])
+    if not latest:
+        return {"applied": 0, "failed": []}
+
+    db = FirestoreDB()
+    now = datetime.utcnow().isoformat() + "Z"
+    item_index.ensure_loaded(db.list_all_items)
+    like_index.ensure_loaded(db.stream_like_actions)
+    owners = {(item_index.get(item_id) or {}).get("ownerId") for item_id in latest} - {None, user_id}
+    matched_before = {owner_id for owner_id in owners if like_index.pair_likes(user_id, owner_id) is not None}
+
+    coalesced = [{"item_id": item_id, "action": action, "timestamp": now} for item_id, (_, action) in latest.items()]
+    saved = db.save_user_actions_batch(user_id, coalesced)
+    failed = [a["item_id"] for a in coalesced[saved:]]
+    coalesced = coalesced[:saved]
+    for a in coalesced:
+        seen_store.record(user_id, a["item_id"], a["action"], now)
+    # Materialize (or tear down) the matches whose reciprocity may have changed
+    liked_owners = {(item_index.get(a["item_id"]) or {}).get("ownerId") for a in coalesced if a["action"] == "like"}
+    for owner_id in owners:
+        if owner_id in liked_owners or owner_id in matched_before:
+            db.refresh_match_record(user_id, owner_id)
+    if last_like is not None and any(a["action"] == "like" for a in coalesced):
+        db.update_user(user_id, {"last_like": last_like})
+    return {"applied": len(coalesced), "failed": failed}
+
+
+def register_event_handlers(event_bus: EventBus):
+    """
+    Keep this worker's seen-state in step with actions saved by other workers.
+    """
+    event_bus.subscribe("action_saved", lambda p: seen_store.record(p["user_id"], p["item_id"], p["action"], p["timestamp"]))
+    event_bus.subscribe("action_deleted", lambda p: seen_store.remove_like(p["user_id"], p["item_id"]))
+    event_bus.subscribe("user_actions_deleted", lambda p: seen_store.invalidate(p["user_id"]))
+
+
+def remove_like(user_id: str, item_id: str):
+    """
+    Undo a user's like on an item (e.g. when a match is deleted).
+    """
+    db = FirestoreDB()
+    db.remove_like(user_id, item_id)
+    seen_store.remove_like(user_id, item_id)
@@ -0,0 +1,400 @@
+# memory_store.py
+# In-memory stand-in for the google-cloud-firestore client, for local runs,
+# load tests and benchmarks. It implements the subset of the client API that
+# FirestoreDB uses: collections/documents/subcollections, get/set(merge)/update/
+# delete/add, where (==, !=, <, <=, >, >=, in, not-in, array_contains,
+# array_contains_any), order_by, limit, start_after, stream, batches and the
+# Increment field transform.
+import copy
+import random
+import string
+import threading
+from collections import Counter
+from datetime import datetime
+from functools import cmp_to_key
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+
+DESCENDING = "DESCENDING"
+ASCENDING = "ASCENDING"
+_MISSING = object()
+
+
+def _auto_id() -> str:
+    return "".join(random.choices(string.ascii_letters + string.digits, k=20))
+
+
+def _get_field(data: dict, field: str):
+    value = data
+    for part in field.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _order_value(doc_id: str, data: dict, field: str):
+    # "__name__" orders by document id, as in Firestore
+    return doc_id if field == "__name__" else _get_field(data, field)
+
+
+def _set_field(data: dict, field: str, value):
+    parts = field.split(".")
+    for part in parts[:-1]:
+        data = data.setdefault(part, {})
+    data[parts[-1]] = value
+
+
+class Increment:
+    """
+    Stand-in for google.cloud.firestore.Increment: adds to the stored number
+    (a missing or non-numeric field counts as 0).
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+
+def _resolve(old, value):
+    if isinstance(value, Increment):
+        base = old if isinstance(old, (int, float)) and not isinstance(old, bool) else 0
+        return base + value.value
+    if isinstance(value, dict):
+        return {k: _resolve(_MISSING, v) for k, v in value.items()}
+    return copy.deepcopy(value)
+
+
+def _deep_merge(target: dict, updates: dict):
+    for key, value in updates.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _deep_merge(target[key], value)
+        else:
+            target[key] = _resolve(target.get(key, _MISSING), value)
+
+
+def _type_rank(value) -> int:
+    # Firestore's cross-type order: null, booleans, numbers, timestamps, strings,
+    # bytes, references, arrays, maps
+    if value is None:
+        return 0
+    if isinstance(value, bool):
+        return 1
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, datetime):
+        return 3
+    if isinstance(value, str):
+        return 4
+    if isinstance(value, bytes):
+        return 5
+    if isinstance(value, DocumentReference):
+        return 6
+    if isinstance(value, (list, tuple)):
+        return 8
+    if isinstance(value, dict):
+        return 9
+    return 10
+
+
+def _compare(a, b) -> int:
+    rank_a, rank_b = _type_rank(a), _type_rank(b)
+    if rank_a != rank_b:
+        return (rank_a > rank_b) - (rank_a < rank_b)
+    if rank_a == 0:
+        return 0
+    if rank_a == 6:
+        a, b = a.path, b.path
+    elif rank_a in (8, 9):
+        # Element by element (maps by sorted key, then value), then by length
+        if rank_a == 9:
+            a = [x for key in sorted(a) for x in (key, a[key])]
+            b = [x for key in sorted(b) for x in (key, b[key])]
+        for x, y in zip(a, b):
+            result = _compare(x, y)
+            if result:
+                return result
+        a, b = len(a), len(b)
+    elif rank_a == 10:
+        a, b = repr(a), repr(b)
+    return (a > b) - (a < b)
+
+
+def _matches(value, op: str, expected) -> bool:
+    if op == "==":
+        return value is not _MISSING and value == expected
+    if op == "!=":
+        return value is not _MISSING and value is not None and value != expected
+    if op == "in":
+        return value is not _MISSING and value in expected
+    if op == "not-in":
+        return value is not _MISSING and value is not None and value not in expected
+    if op == "array_contains":
+        return isinstance(value, list) and expected in value
+    if op == "array_contains_any":
+        return isinstance(value, list) and any(v in value for v in expected)
+    if value is _MISSING or value is None:
+        return False
+    try:
+        if op == "<":
+            return value < expected
+        if op == "<=":
+            return value <= expected
+        if op == ">":
+            return value > expected
+        if op == ">=":
+            return value >= expected
+    except TypeError:
+        return False
+    raise ValueError(f"Unsupported operator: {op}")
+
+
+class DocumentSnapshot:
+    def __init__(self, reference: "DocumentReference", data: Optional[dict]):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self) -> bool:
+        return self._data is not None
+
+    def to_dict(self) -> Optional[dict]:
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field: str):
+        value = _get_field(self._data or {}, field)
+        return None if value is _MISSING else value
+
+
+class DocumentReference:
+    def __init__(self, client: "MemoryClient", collection_path: str, doc_id: str):
+        self._client = client
+        self._collection_path = collection_path
+        self.id = doc_id
+        self.path = f"{collection_path}/{doc_id}"
+
+    def collection(self, name: str) -> "CollectionReference":
+        return CollectionReference(self._client, f"{self.path}/{name}")
+
+    def get(self) -> DocumentSnapshot:
+        with self._client._lock:
+            data = self._client._collection(self._collection_path).get(self.id)
+            self._client.ops["reads"] += 1
+            return DocumentSnapshot(self, copy.deepcopy(data))
+
+    def set(self, data: dict, merge: bool = False):
+        with self._client._lock:
+            docs = self._client._collection(self._collection_path)
+            if merge and self.id in docs:
+                _deep_merge(docs[self.id], data)
+            else:
+                docs[self.id] = _resolve(_MISSING, data)
+            self._client.ops["writes"] += 1
+
+    def update(self, updates: dict):
+        with self._client._lock:
+            docs = self._client._collection(self._collection_path)
+            if self.id not in docs:
+                raise KeyError(f"No document to update: {self.path}")
+            for field, value in updates.items():
+                old = _get_field(docs[self.id], field)
+                _set_field(docs[self.id], field, _resolve(old, value))
+            self._client.ops["writes"] += 1
+
+    def delete(self):
+        with self._client._lock:
+            self._client._collection(self._collection_path).pop(self.id, None)
+            self._client.ops["deletes"] += 1
+
+
+class Query:
+    def __init__(self, client: "MemoryClient", collection_path: str):
+        self._client = client
+        self._collection_path = collection_path
+        self._filters: List[Tuple[str, str, Any]] = []
+        self._orders: List[Tuple[str, str]] = []
+        self._limit: Optional[int] = None
+        self._start_after: Optional[Any] = None
+
+    def _copy(self) -> "Query":
+        query = Query(self._client, self._collection_path)
+        query._filters = list(self._filters)
+        query._orders = list(self._orders)
+        query._limit = self._limit
+        query._start_after = self._start_after
+        return query
+
+    def where(self, field: str, op: str, value) -> "Query":
+        query = self._copy()
+        query._filters.append((field, op, value))
+        return query
+
+    def order_by(self, field: str, direction: str = ASCENDING) -> "Query":
+        query = self._copy()
+        query._orders.append((field, direction))
+        return query
+
+    def limit(self, count: int) -> "Query":
+        query = self._copy()
+        query._limit = count
+        return query
+
+    def start_after(self, document_or_fields) -> "Query":
+        query = self._copy()
+        query._start_after = document_or_fields
+        return query
+
+    def _sort_key_cmp(self, a: Tuple[str, dict], b: Tuple[str, dict]) -> int:
+        for field, direction in self._orders:
+            result = _compare(_order_value(*a, field), _order_value(*b, field))
+            if result:
+                return -result if direction == DESCENDING else result
+        # Ties break on the document id, in the direction of the last ordering
+        result = _compare(a[0], b[0])
+        return -result if self._orders and self._orders[-1][1] == DESCENDING else result
+
+    def _after_cursor(self, doc_id: str, data: dict) -> bool:
+        cursor = self._start_after
+        if isinstance(cursor, DocumentSnapshot):
+            fields = list(self._orders)
+            if all(field != "__name__" for field, _ in fields):
+                fields.append(("__name__", fields[-1][1] if fields else ASCENDING))
+            cursor_values = {field: _order_value(cursor.id, cursor._data or {}, field) for field, _ in fields}
+        else:
+            # Field values for a prefix of the orderings; "__name__" takes a DocumentReference or id
+            fields = []
+            for field, direction in self._orders:
+                if field not in cursor:
+                    break
+                fields.append((field, direction))
+            cursor_values = {field: value.id if isinstance(value, DocumentReference) else value for field, value in cursor.items()}
+        for field, direction in fields:
+            result = _compare(_order_value(doc_id, data, field), cursor_values[field])
+            if result:
+                return (result < 0) if direction == DESCENDING else (result > 0)
+        return False
+
+    def stream(self) -> Iterator[DocumentSnapshot]:
+        with self._client._lock:
+            docs = self._client._collection(self._collection_path)
+            rows = [
+                (doc_id, data) for doc_id, data in docs.items()
+                if all(_matches(_get_field(data, f), op, v) for f, op, v in self._filters)
+            ]
+            # Ordering by a field only returns documents that have it
+            rows = [r for r in rows if all(_order_value(*r, f) is not _MISSING for f, _ in self._orders)]
+            rows.sort(key=cmp_to_key(self._sort_key_cmp))
+            if self._start_after is not None:
+                rows = [r for r in rows if self._after_cursor(*r)]
+            if self._limit is not None:
+                rows = rows[:self._limit]
+            self._client.ops["queries"] += 1
+            self._client.ops["reads"] += max(1, len(rows))
+            snapshots = [
+                DocumentSnapshot(DocumentReference(self._client, self._collection_path, doc_id), copy.deepcopy(data))
+                for doc_id, data in rows
+            ]
+        return iter(snapshots)
+
+    def get(self) -> List[DocumentSnapshot]:
+        return list(self.stream())
+
+
+class CollectionReference(Query):
+    def __init__(self, client: "MemoryClient", path: str):
+        super().__init__(client, path)
+        self.id = path.rsplit("/", 1)[-1]
+
+    def document(self, doc_id: Optional[str] = None) -> DocumentReference:
+        return DocumentReference(self._client, self._collection_path, doc_id or _auto_id())
+
+    def add(self, data: dict, document_id: Optional[str] = None):
+        ref = self.document(document_id)
+        ref.set(data)
+        return None, ref
+
+
+class WriteBatch:
+    MAX_OPS = 500
+
+    def __init__(self, client: "MemoryClient"):
+        self._client = client
+        self._ops = []
+
+    def _append(self, op):
+        if len(self._ops) >= self.MAX_OPS:
+            raise ValueError("Maximum 500 writes allowed per batch")
+        self._ops.append(op)
+
+    def set(self, ref: DocumentReference, data: dict, merge: bool = False):
+        self._append(lambda: ref.set(data, merge=merge))
+
+    def update(self, ref: DocumentReference, updates: dict):
+        self._append(lambda: ref.update(updates))
+
+    def delete(self, ref: DocumentReference):
+        self._append(ref.delete)
+
+    def commit(self):
+        with self._client._lock:
+            for op in self._ops:
+                op()
+            self._client.ops["commits"] += 1
+        self._ops = []
+
+
+class Transaction(WriteBatch):
+    """
+    Reads see committed data and writes are applied on commit. Run through
+    MemoryClient.run_transaction, which holds the store lock for the whole
+    function, so transactions are serializable.
+    """
+
+    def get(self, ref_or_query):
+        if isinstance(ref_or_query, DocumentReference):
+            return ref_or_query.get()
+        return ref_or_query.stream()
+
+    def get_all(self, references: List[DocumentReference]) -> Iterator[DocumentSnapshot]:
+        return self._client.get_all(references)
+
+
+class MemoryClient:
+    """
+    Process-local document store with the google-cloud-firestore client API
+    subset used by FirestoreDB. `ops` counts document reads, writes, deletes,
+    queries and batch commits, so benchmarks can report store operations.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._collections: Dict[str, Dict[str, dict]] = {}
+        self.ops: Counter = Counter()
+
+    def _collection(self, path: str) -> Dict[str, dict]:
+        return self._collections.setdefault(path, {})
+
+    def collection(self, name: str) -> CollectionReference:
+        return CollectionReference(self, name)
+
+    def document(self, path: str) -> DocumentReference:
+        collection_path, doc_id = path.rsplit("/", 1)
+        return DocumentReference(self, collection_path, doc_id)
+
+    def batch(self) -> WriteBatch:
+        return WriteBatch(self)
+
+    def get_all(self, references: List[DocumentReference]) -> Iterator[DocumentSnapshot]:
+        return iter([ref.get() for ref in references])
+
+    def run_transaction(self, fn: Callable, *args, **kwargs):
+        with self._lock:
+            transaction = Transaction(self)
+            result = fn(transaction, *args, **kwargs)
+            transaction.commit()
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._collections = {}
+            self.ops = Counter()
@@ -0,0 +1,150 @@
+# metrics.py
+# In-process metrics for store calls, exposed in Prometheus text format on /metrics.
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Tuple
+
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# (name, type, help, [(labels, value)])
+MetricFamily = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+class _MethodStats:
+    __slots__ = ("calls", "documents", "latency_sum", "buckets")
+
+    def __init__(self):
+        self.calls = 0
+        self.documents = 0
+        self.latency_sum = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+
+class StoreMetrics:
+    """
+    Per-method call count, documents returned and latency histogram for
+    FirestoreDB store calls. Each thread writes to its own stats (no lock on the
+    hot path); collect() sums them when /metrics is scraped.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._all_threads: List[Dict[str, _MethodStats]] = []
+        self._register_lock = threading.Lock()
+
+    def _thread_stats(self) -> Dict[str, _MethodStats]:
+        stats = getattr(self._local, "stats", None)
+        if stats is None:
+            stats = self._local.stats = defaultdict(_MethodStats)
+            with self._register_lock:
+                self._all_threads.append(stats)
+        return stats
+
+    def observe(self, method: str, documents: int, seconds: float):
+        stats = self._thread_stats()[method]
+        stats.calls += 1
+        stats.documents += documents
+        stats.latency_sum += seconds
+        stats.buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def totals(self) -> Dict[str, _MethodStats]:
+        totals: Dict[str, _MethodStats] = defaultdict(_MethodStats)
+        with self._register_lock:
+            threads = list(self._all_threads)
+        for stats in threads:
+            for method, s in list(stats.items()):
+                t = totals[method]
+                t.calls += s.calls
+                t.documents += s.documents
+                t.latency_sum += s.latency_sum
+                t.buckets = [a + b for a, b in zip(t.buckets, s.buckets)]
+        return totals
+
+    def collect(self) -> Iterable[MetricFamily]:
+        totals = self.totals()
+        yield ("circloth_store_calls_total", "counter", "Store calls per FirestoreDB method",
+               [({"method": m}, s.calls) for m, s in totals.items()])
+        yield ("circloth_store_documents_total", "counter", "Documents returned per FirestoreDB method",
+               [({"method": m}, s.documents) for m, s in totals.items()])
+        samples = []
+        for m, s in totals.items():
+            cumulative = 0
+            for le, count in zip(LATENCY_BUCKETS + (float("inf"),), s.buckets):
+                cumulative += count
+                samples.append(({"method": m, "le": _format_value(le), "__suffix": "_bucket"}, cumulative))
+            samples.append(({"method": m, "__suffix": "_sum"}, s.latency_sum))
+            samples.append(({"method": m, "__suffix": "_count"}, s.calls))
+        yield ("circloth_store_latency_seconds", "histogram", "Store call latency per FirestoreDB method", samples)
+
+
+class Histogram:
+    """
+    Unlabelled latency histogram for code running on one thread (e.g. the event loop).
+    """
+
+    def __init__(self, name: str, help_text: str, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+
+    def observe(self, seconds: float):
+        self._counts[bisect_left(self.buckets, seconds)] += 1
+        self._sum += seconds
+        self._count += 1
+
+    def collect(self) -> Iterable[MetricFamily]:
+        samples = []
+        cumulative = 0
+        for le, count in zip(self.buckets + (float("inf"),), self._counts):
+            cumulative += count
+            samples.append(({"le": _format_value(le), "__suffix": "_bucket"}, cumulative))
+        samples.append(({"__suffix": "_sum"}, self._sum))
+        samples.append(({"__suffix": "_count"}, self._count))
+        yield (self.name, "histogram", self.help_text, samples)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(value)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class MetricsRegistry:
+    """
+    Collects metric families from registered collectors and renders them in the
+    Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self._collectors: List[Callable[[], Iterable[MetricFamily]]] = []
+
+    def register(self, collector: Callable[[], Iterable[MetricFamily]]):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for collector in self._collectors:
+            for name, kind, help_text, samples in collector():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    labels = dict(labels)
+                    suffix = labels.pop("__suffix", "")
+                    label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+                    label_text = "{" + label_text + "}" if label_text else ""
+                    lines.append(f"{name}{suffix}{label_text} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+store_metrics = StoreMetrics()
+registry = MetricsRegistry()
+registry.register(store_metrics.collect)
@@ -0,0 +1,263 @@
+# moderation.py
+# Asynchronous photo moderation of items (opt-in with ITEM_MODERATION=async).
+#
+# POST /item stores the item as 'pending_review' and enqueues a job in a SQLite
+# queue shared by the workers on a host, so queued jobs survive restarts. Every
+# worker runs ITEM_MODERATION_CONCURRENCY consumers on its event loop: a consumer
+# claims a job with a lease, runs the photo checks (image_checks, on its process
+# pool) and flips the item to 'visible' or 'rejected'. The job of a worker that
+# died mid-check is claimed again when its lease expires. Download failures and
+# timeouts are retried with exponential backoff up to ITEM_MODERATION_MAX_ATTEMPTS,
+# then the item is rejected. on_visible is called once an item is marked
+# visible (main.py renders its photo derivatives from there).
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import logging
+import tempfile
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, List, Optional, Union
+
+from async_db import AsyncFirestoreDB
+from image_checks import check_images
+from item_index import ITEM_STATUS_PENDING_REVIEW, ITEM_STATUS_REJECTED, ITEM_STATUS_VISIBLE
+from metrics import Histogram
+
+
+# 'inline' checks photos in the request (and rejects with 400); 'async' queues them
+ITEM_MODERATION = os.getenv("ITEM_MODERATION", "inline")
+ITEM_MODERATION_QUEUE_PATH = os.getenv("ITEM_MODERATION_QUEUE_PATH", os.path.join(tempfile.gettempdir(), "circloth-moderation-queue.sqlite"))
+ITEM_MODERATION_CONCURRENCY = int(os.getenv("ITEM_MODERATION_CONCURRENCY", 2))
+# A claimed job not finished within this long is handed to another consumer
+ITEM_MODERATION_LEASE_SECONDS = int(os.getenv("ITEM_MODERATION_LEASE_SECONDS", 120))
+ITEM_MODERATION_MAX_ATTEMPTS = int(os.getenv("ITEM_MODERATION_MAX_ATTEMPTS", 5))
+# First retry delay, doubled on every further attempt
+ITEM_MODERATION_RETRY_SECONDS = float(os.getenv("ITEM_MODERATION_RETRY_SECONDS", 5))
+ITEM_MODERATION_POLL_SECONDS = float(os.getenv("ITEM_MODERATION_POLL_SECONDS", 1))
+
+# Verdicts that say nothing about the photos themselves
+TRANSIENT_VERDICTS = ("IMAGE_DOWNLOAD_FAILED", "IMAGE_CHECK_TIMEOUT", "MODERATION_ERROR")
+JOB_LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 900.0)
+
+
+@dataclass
+class ModerationJob:
+    item_id: str
+    photo_urls: List[str]
+    enqueued_at: float
+    attempts: int  # including this one
+    lease_token: str
+
+
+class ModerationQueue:
+    """
+    One row per item awaiting moderation. A claim moves the row's available_at
+    past the lease and stamps a lease token; finishing (or retrying) a job only
+    succeeds while the token still matches, so a job re-enqueued with new photos
+    (or reclaimed after its lease expired) is never settled by the old run.
+    """
+
+    def __init__(self, path: str = ITEM_MODERATION_QUEUE_PATH, lease_seconds: int = ITEM_MODERATION_LEASE_SECONDS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (item_id TEXT PRIMARY KEY, photo_urls TEXT NOT NULL, enqueued_at REAL NOT NULL, "
+            "attempts INTEGER NOT NULL, available_at REAL NOT NULL, lease_token TEXT, last_error TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_available_at ON jobs (available_at)")
+
+    def enqueue(self, item_id: str, photo_urls: List[str], replace: bool = True):
+        """
+        Queue the item's photos. replace=False keeps an already queued job as is.
+        """
+        verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                f"{verb} INTO jobs (item_id, photo_urls, enqueued_at, attempts, available_at) VALUES (?, ?, ?, 0, ?)",
+                (item_id, json.dumps(photo_urls), now, now),
+            )
+
+    def claim(self) -> Optional[ModerationJob]:
+        now = time.time()
+        token = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT item_id, photo_urls, enqueued_at, attempts FROM jobs WHERE available_at <= ? ORDER BY available_at LIMIT 1",
+                    (now,),
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET available_at = ?, attempts = attempts + 1, lease_token = ? WHERE item_id = ?",
+                        (now + self.lease_seconds, token, row[0]),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return ModerationJob(row[0], json.loads(row[1]), row[2], row[3] + 1, token)
+
+    def owns(self, job: ModerationJob) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM jobs WHERE item_id = ? AND lease_token = ?", (job.item_id, job.lease_token)).fetchone()
+        return row is not None
+
+    def complete(self, job: ModerationJob) -> bool:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM jobs WHERE item_id = ? AND lease_token = ?", (job.item_id, job.lease_token))
+        return cursor.rowcount > 0
+
+    def retry(self, job: ModerationJob, error: str, delay: float) -> bool:
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET available_at = ?, lease_token = NULL, last_error = ? WHERE item_id = ? AND lease_token = ?",
+                (time.time() + delay, error, job.item_id, job.lease_token),
+            )
+        return cursor.rowcount > 0
+
+    def depth(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ModerationWorker:
+    """
+    Enqueues items for moderation and runs this worker's queue consumers.
+    Does nothing unless ITEM_MODERATION=async.
+    """
+
+    def __init__(self, adb: AsyncFirestoreDB, mode: str = ITEM_MODERATION, concurrency: int = ITEM_MODERATION_CONCURRENCY,
+                 on_visible: Optional[Callable[[str, List[str]], None]] = None):
+        self.adb = adb
+        self.on_visible = on_visible  # (item_id, photo_urls), called on the event loop
+        self.enabled = mode == "async"
+        self.concurrency = concurrency
+        self.queue: Optional[ModerationQueue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._wake: Optional[asyncio.Event] = None
+        self.stats: Counter = Counter()  # outcome
+        self.retries: Counter = Counter()  # reason
+        self.latency = Histogram("circloth_moderation_job_seconds", "Time from enqueue to moderation verdict", JOB_LATENCY_BUCKETS)
+
+    async def start(self):
+        if not self.enabled or self._tasks:
+            return
+        self.queue = ModerationQueue()
+        self._wake = asyncio.Event()
+        # Items left pending with no job (e.g. queue file lost with the host)
+        pending = await self.adb.list_items_with_status(ITEM_STATUS_PENDING_REVIEW)
+        for item in pending:
+            await asyncio.to_thread(self.queue.enqueue, item["id"], item.get("photoURLs") or [], False)
+        self._tasks = [asyncio.create_task(self._consume()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        # A job cancelled mid-check is claimed again once its lease expires
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.queue:
+            self.queue.close()
+            self.queue = None
+
+    async def submit(self, item_id: str, photo_urls: List[str]):
+        """
+        Queue (or re-queue, superseding a queued job) the item's photos.
+        """
+        await asyncio.to_thread(self.queue.enqueue, item_id, photo_urls)
+        self._wake.set()
+
+    async def _consume(self):
+        while True:
+            try:
+                job = await asyncio.to_thread(self.queue.claim)
+            except sqlite3.Error as e:
+                logging.error(f"[MODERATION] claim failed: {e}")
+                job = None
+            if job is None:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), ITEM_MODERATION_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Left leased: retried when the lease expires
+                logging.error(f"[MODERATION] job for item {job.item_id} failed: {e}")
+
+    async def _run(self, job: ModerationJob):
+        try:
+            verdict = await check_images(job.photo_urls)
+        except Exception as e:
+            logging.error(f"[MODERATION] checks for item {job.item_id} raised: {e}")
+            verdict = "MODERATION_ERROR"
+
+        if verdict in TRANSIENT_VERDICTS and job.attempts < ITEM_MODERATION_MAX_ATTEMPTS:
+            delay = ITEM_MODERATION_RETRY_SECONDS * 2 ** (job.attempts - 1)
+            if await asyncio.to_thread(self.queue.retry, job, verdict, delay):
+                self.retries[verdict] += 1
+            return
+
+        outcome = await self.adb.run(self._settle, job, verdict)
+        self.stats[outcome] += 1
+        if outcome in (ITEM_STATUS_VISIBLE, ITEM_STATUS_REJECTED):
+            self.latency.observe(time.time() - job.enqueued_at)
+        if outcome == ITEM_STATUS_VISIBLE and self.on_visible:
+            self.on_visible(job.item_id, job.photo_urls)
+
+    def _settle(self, job: ModerationJob, verdict: Union[bool, str]) -> str:
+        """
+        Write the verdict to the item (runs on the data layer pool).
+        """
+        if not self.queue.owns(job):
+            return "superseded"
+        item = self.adb.sync.get_item(job.item_id)
+        if not item:
+            self.queue.complete(job)
+            return "item_deleted"
+        if item.get("photoURLs") != job.photo_urls:
+            # Photos changed without a new job (e.g. written by another path)
+            self.queue.complete(job)
+            return "superseded"
+        status = ITEM_STATUS_VISIBLE if verdict is True else ITEM_STATUS_REJECTED
+        self.adb.sync.update_item(job.item_id, {
+            "status": status,
+            "moderation": {
+                "verdict": "ok" if verdict is True else verdict,
+                "attempts": job.attempts,
+                "reviewed_at": datetime.utcnow().isoformat() + "Z",
+            },
+        })
+        self.queue.complete(job)
+        return status
+
+    def collect(self):
+        if not self.enabled or self.queue is None:
+            return
+        yield ("circloth_moderation_queue_depth", "gauge", "Items queued for photo moderation on this host", [({}, self.queue.depth())])
+        yield ("circloth_moderation_jobs_total", "counter", "Moderation jobs finished, by outcome",
+               [({"outcome": outcome}, count) for outcome, count in self.stats.items()])
+        yield ("circloth_moderation_retries_total", "counter", "Moderation jobs retried, by reason",
+               [({"reason": reason}, count) for reason, count in self.retries.items()])
+        yield from self.latency.collect()
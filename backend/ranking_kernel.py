@@ -0,0 +1,146 @@
+# ranking_kernel.py
+# Columnar (NumPy) candidate representation and batched filter/rank kernel.
+import math
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from geo_index import EARTH_RADIUS_KM, get_lat_lng
+
+
+MISSING_CODE = -1
+
+
+class CandidateColumns:
+    """
+    One row per indexed item: lat, lng, owner code, category code and
+    (category, size) code. String values are interned to int codes so the
+    filters run as array comparisons. Rows of removed items are marked dead
+    and reused for later inserts, so row ordinals stay stable while an item
+    is indexed.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self.ids: List[Optional[str]] = [None] * capacity
+        self.lat = np.full(capacity, np.nan)
+        self.lng = np.full(capacity, np.nan)
+        self.owner = np.full(capacity, MISSING_CODE, dtype=np.int32)
+        self.category = np.full(capacity, MISSING_CODE, dtype=np.int32)
+        self.size = np.full(capacity, MISSING_CODE, dtype=np.int32)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.n_rows = 0
+        self._free_rows: List[int] = []
+        self._codes: Dict[str, Dict] = {"owner": {}, "category": {}, "size": {}}
+
+    def code(self, kind: str, value, create: bool = False) -> int:
+        if value is None:
+            return MISSING_CODE
+        codes = self._codes[kind]
+        code = codes.get(value)
+        if code is None:
+            if not create:
+                return MISSING_CODE
+            code = codes[value] = len(codes)
+        return code
+
+    def _grow(self, capacity: int):
+        extra = capacity - len(self.ids)
+        self.ids.extend([None] * extra)
+        self.lat = np.concatenate([self.lat, np.full(extra, np.nan)])
+        self.lng = np.concatenate([self.lng, np.full(extra, np.nan)])
+        self.owner = np.concatenate([self.owner, np.full(extra, MISSING_CODE, dtype=np.int32)])
+        self.category = np.concatenate([self.category, np.full(extra, MISSING_CODE, dtype=np.int32)])
+        self.size = np.concatenate([self.size, np.full(extra, MISSING_CODE, dtype=np.int32)])
+        self.alive = np.concatenate([self.alive, np.zeros(extra, dtype=bool)])
+
+    def allocate_row(self) -> int:
+        if self._free_rows:
+            return self._free_rows.pop()
+        if self.n_rows == len(self.ids):
+            self._grow(max(1024, 2 * len(self.ids)))
+        row = self.n_rows
+        self.n_rows += 1
+        return row
+
+    def set_row(self, row: int, item: dict):
+        point = get_lat_lng(item.get("location"))
+        self.ids[row] = item["id"]
+        self.lat[row], self.lng[row] = point if point else (np.nan, np.nan)
+        self.owner[row] = self.code("owner", item.get("ownerId"), create=True)
+        self.category[row] = self.code("category", item.get("category"), create=True)
+        self.size[row] = self.code("size", (item.get("category"), item.get("size")), create=True)
+        self.alive[row] = True
+
+    def free_row(self, row: int):
+        self.ids[row] = None
+        self.alive[row] = False
+        self._free_rows.append(row)
+
+
+def haversine_km(lat: float, lng: float, lats: np.ndarray, lngs: np.ndarray) -> np.ndarray:
+    """
+    Vectorized Haversine distance from (lat, lng) to every (lats[i], lngs[i]).
+    NaN coordinates give NaN distances.
+    """
+    lat1 = math.radians(lat)
+    lat2 = np.radians(lats)
+    dlat = lat2 - lat1
+    dlon = np.radians(lngs) - math.radians(lng)
+    a = np.sin(dlat / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def candidate_mask(cols: CandidateColumns, user_id: str, excluded_rows: Sequence[int] = (), size_prefs: Optional[dict] = None) -> np.ndarray:
+    """
+    Boolean mask over the rows of `cols`: alive, not owned by the user, not
+    excluded and, if size_prefs ({category: [sizes]}) is given, in an allowed size.
+    """
+    n = cols.n_rows
+    mask = cols.alive[:n].copy()
+    owner_code = cols.code("owner", user_id)
+    if owner_code != MISSING_CODE:
+        mask &= cols.owner[:n] != owner_code
+    excluded = np.asarray(excluded_rows, dtype=np.int64)
+    mask[excluded[excluded < n]] = False
+    if size_prefs:
+        allowed = [
+            cols.code("size", (category, size))
+            for category, sizes in size_prefs.items() if isinstance(sizes, list)
+            for size in sizes
+        ]
+        allowed = [c for c in allowed if c != MISSING_CODE]
+        mask &= np.isin(cols.size[:n], np.asarray(allowed, dtype=np.int32))
+    return mask
+
+
+def rank_nearest(cols: CandidateColumns, mask: np.ndarray, lat: float, lng: float, k: Optional[int] = None, max_km: Optional[float] = None) -> np.ndarray:
+    """
+    Rows selected by `mask`, nearest first. Unlocated rows come last unless
+    max_km is given. With k, only the top k rows are selected (argpartition)
+    and only those are sorted.
+    """
+    n = cols.n_rows
+    dist = haversine_km(lat, lng, cols.lat[:n], cols.lng[:n])
+    dist[np.isnan(dist)] = np.inf
+    if max_km is not None:
+        mask = mask & (dist <= max_km)
+    rows = np.flatnonzero(mask)
+    if not len(rows):
+        return rows
+    dist = dist[rows]
+    if k is not None and k < len(rows):
+        top = np.argpartition(dist, k - 1)[:k]
+        rows, dist = rows[top], dist[top]
+    return rows[np.argsort(dist, kind="stable")]
+
+
+def sample_rows(mask: np.ndarray, k: Optional[int] = None, rng: Optional[np.random.Generator] = None) -> np.ndarray:
+    """
+    Rows selected by `mask` in random order (k of them if given).
+    """
+    rng = rng or np.random.default_rng()
+    rows = np.flatnonzero(mask)
+    if k is not None and k < len(rows):
+        return rng.choice(rows, size=k, replace=False)
+    rng.shuffle(rows)
+    return rows
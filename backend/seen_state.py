@@ -0,0 +1,187 @@
+# seen_state.py
+# Per-user liked / recently passed items, updated incrementally on each swipe.
+import os
+import time
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from item_index import item_index
+
+
+SEEN_STATE_MAX_USERS = int(os.getenv("SEEN_STATE_MAX_USERS", 10000))
+
+
+def _to_epoch(ts) -> float:
+    if isinstance(ts, str):
+        ts = datetime.fromisoformat(ts.replace("Z", ""))
+    if isinstance(ts, datetime):
+        # Action timestamps are naive UTC ("...Z" stripped) or aware datetimes
+        if ts.tzinfo is None:
+            return (ts - datetime(1970, 1, 1)).total_seconds()
+        return ts.timestamp()
+    return float(ts)
+
+
+class SeenState:
+    """
+    Items a user should not be shown, stored as item ordinals (see
+    ItemIndex.ordinal): a sorted array('I') of liked ordinals plus a
+    time-ordered queue of pass expiries. Expired passes are evicted lazily,
+    so a lookup costs O(active passes + log likes), independent of history.
+    """
+
+    def __init__(self, pass_expiry_seconds: int):
+        self.pass_expiry_seconds = pass_expiry_seconds
+        self._lock = threading.Lock()
+        self.liked = array("I")
+        self.pass_expiry: Dict[int, float] = {}
+        self._pass_queue = deque()  # (expires_at, ordinal), oldest first
+
+    def _is_liked(self, ordinal: int) -> bool:
+        i = bisect_left(self.liked, ordinal)
+        return i < len(self.liked) and self.liked[i] == ordinal
+
+    def _unlike(self, ordinal: int):
+        i = bisect_left(self.liked, ordinal)
+        if i < len(self.liked) and self.liked[i] == ordinal:
+            del self.liked[i]
+
+    def record(self, ordinal: int, action: str, timestamp):
+        """
+        Apply a user action; the latest action on an item overrides earlier ones.
+        """
+        with self._lock:
+            self._record(ordinal, action, timestamp)
+
+    def _record(self, ordinal: int, action: str, timestamp):
+        self._unlike(ordinal)
+        self.pass_expiry.pop(ordinal, None)
+        if action == "like":
+            self.liked.insert(bisect_left(self.liked, ordinal), ordinal)
+        elif action == "pass":
+            expires_at = _to_epoch(timestamp) + self.pass_expiry_seconds
+            if expires_at > time.time():
+                self.pass_expiry[ordinal] = expires_at
+                self._pass_queue.append((expires_at, ordinal))
+
+    def remove_like(self, ordinal: int):
+        with self._lock:
+            self._unlike(ordinal)
+
+    def _evict_expired_passes(self, now: float):
+        queue = self._pass_queue
+        while queue and queue[0][0] <= now:
+            expires_at, ordinal = queue.popleft()
+            # Skip entries superseded by a later action on the same item
+            if self.pass_expiry.get(ordinal) == expires_at:
+                del self.pass_expiry[ordinal]
+
+    def excluded_ordinals(self, now: Optional[float] = None) -> np.ndarray:
+        with self._lock:
+            self._evict_expired_passes(now or time.time())
+            liked = np.array(self.liked, dtype=np.int64)
+            passed = np.fromiter(self.pass_expiry, dtype=np.int64, count=len(self.pass_expiry))
+        return np.concatenate([liked, passed])
+
+    def is_excluded(self, ordinal: int, now: Optional[float] = None) -> bool:
+        with self._lock:
+            if self._is_liked(ordinal):
+                return True
+            expires_at = self.pass_expiry.get(ordinal)
+        return expires_at is not None and expires_at > (now or time.time())
+
+
+class SeenStore:
+    """
+    LRU-bounded map of user_id -> SeenState. A user's state is built once from
+    their action history and then kept current by record()/remove_like().
+    """
+
+    def __init__(self, pass_expiry_seconds: int, max_users: int = SEEN_STATE_MAX_USERS):
+        self.pass_expiry_seconds = pass_expiry_seconds
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._states: "OrderedDict[str, SeenState]" = OrderedDict()
+        # user_id -> one op buffer per load in progress; changes made while the
+        # history is being read are replayed onto the loaded state
+        self._loading: Dict[str, List[list]] = {}
+
+    def get(self, user_id: str, load_actions: Callable[[str], Iterable[dict]]) -> SeenState:
+        with self._lock:
+            state = self._states.get(user_id)
+            if state is not None:
+                self._states.move_to_end(user_id)
+                return state
+
+            ops = []
+            self._loading.setdefault(user_id, []).append(ops)
+
+        try:
+            state = SeenState(self.pass_expiry_seconds)
+            latest: Dict[str, dict] = {}
+            for action in load_actions(user_id):
+                prev = latest.get(action["item_id"])
+                if not prev or action["timestamp"] > prev["timestamp"]:
+                    latest[action["item_id"]] = action
+            for item_id, action in latest.items():
+                state.record(item_index.ordinal(item_id), action["action"], action["timestamp"])
+        finally:
+            with self._lock:
+                buffers = self._loading[user_id]
+                buffers.remove(ops)
+                if not buffers:
+                    del self._loading[user_id]
+
+        with self._lock:
+            invalidated = False
+            for op, *args in ops:
+                if op == "record":
+                    state.record(item_index.ordinal(args[0]), *args[1:])
+                elif op == "remove_like":
+                    state.remove_like(item_index.ordinal(args[0]))
+                else:
+                    invalidated = True
+            if invalidated:
+                # Changed under the load in a way only a reload picks up
+                return state
+            # Another request may have loaded it meanwhile; keep the first one
+            state = self._states.setdefault(user_id, state)
+            self._states.move_to_end(user_id)
+            while len(self._states) > self.max_users:
+                self._states.popitem(last=False)
+        return state
+
+    def _buffer(self, user_id: str, *op):
+        for ops in self._loading.get(user_id, ()):
+            ops.append(op)
+
+    def record(self, user_id: str, item_id: str, action: str, timestamp):
+        """
+        Apply an action to a loaded state. Users not in memory are skipped: their
+        state is rebuilt from the stored history (which includes it) on next use.
+        A load in progress may have read the history before this action was
+        written, so the action is also replayed onto it.
+        """
+        with self._lock:
+            self._buffer(user_id, "record", item_id, action, timestamp)
+            state = self._states.get(user_id)
+            if state is not None:
+                state.record(item_index.ordinal(item_id), action, timestamp)
+
+    def remove_like(self, user_id: str, item_id: str):
+        with self._lock:
+            self._buffer(user_id, "remove_like", item_id)
+            state = self._states.get(user_id)
+            if state is not None:
+                state.remove_like(item_index.ordinal(item_id))
+
+    def invalidate(self, user_id: str):
+        with self._lock:
+            self._buffer(user_id, "invalidate")
+            self._states.pop(user_id, None)
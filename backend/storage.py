@@ -0,0 +1,84 @@
+# storage.py
+# Selects the document store behind FirestoreDB.
+#
+# CIRCLOTH_STORE=firestore (default) uses Cloud Firestore through the Firebase
+# Admin SDK. CIRCLOTH_STORE=memory uses the in-process MemoryClient, so the app
+# can boot and be load-tested without credentials.
+import os
+import logging
+
+
+STORE_BACKEND = os.getenv("CIRCLOTH_STORE", "firestore")
+
+# Same values as google.cloud.firestore.Query.ASCENDING / DESCENDING
+ASCENDING = "ASCENDING"
+DESCENDING = "DESCENDING"
+
+_client = None
+
+
+def init_firebase():
+    """
+    Initialize the Firebase Admin SDK once, from serviceAccountKey.json if present,
+    otherwise from application default credentials.
+    """
+    import firebase_admin
+    from firebase_admin import credentials
+    import google.auth
+
+    if firebase_admin._apps:
+        return
+    cred = None
+    local_path = "serviceAccountKey.json"
+    if os.path.exists(local_path):
+        cred = credentials.Certificate(local_path)
+    else:
+        try:
+            _, project_id = google.auth.default()
+            cred = credentials.ApplicationDefault()
+        except Exception as e:
+            logging.error(f"Firebase init failed: {e}")
+            raise
+    firebase_admin.initialize_app(cred)
+
+
+def get_client():
+    """
+    The process-wide document store client for the configured backend.
+    """
+    global _client
+    if _client is None:
+        if STORE_BACKEND == "memory":
+            from memory_store import MemoryClient
+            _client = MemoryClient()
+        elif STORE_BACKEND == "firestore":
+            from firebase_admin import firestore
+            init_firebase()
+            _client = firestore.client()
+        else:
+            raise ValueError(f"Unknown CIRCLOTH_STORE backend: {STORE_BACKEND}")
+    return _client
+
+
+def increment(value: int):
+    """
+    Atomic numeric increment transform (for set(merge=True) / update) of the
+    configured backend.
+    """
+    if STORE_BACKEND == "memory":
+        from memory_store import Increment
+    else:
+        from google.cloud.firestore import Increment
+    return Increment(value)
+
+
+def run_transaction(fn, *args, **kwargs):
+    """
+    Run fn(transaction, *args, **kwargs) as a read-write transaction of the
+    configured backend (reads first, then writes; retried on contention).
+    """
+    client = get_client()
+    if STORE_BACKEND == "memory":
+        return client.run_transaction(fn, *args, **kwargs)
+    from google.cloud import firestore
+    return firestore.transactional(fn)(client.transaction(), *args, **kwargs)
@@ -0,0 +1,105 @@
+# verdict_cache.py
+# On-disk cache of photo check verdicts, shared by the gunicorn workers.
+#
+# One SQLite table (WAL mode, so readers never wait on the writer) maps keys to
+# verdicts. image_checks looks up three keys in order:
+#   url:<url>      - the photo at this URL was checked (skips the download)
+#   sha:<sha256>   - these exact bytes were checked (skips decode and checks)
+#   phash:<dhash>  - a visually identical photo (re-encoded, resized) was checked
+# Every key is prefixed with a fingerprint of the check configuration, so
+# changing IMAGE_CHECKS or a threshold never reuses old verdicts. Entries are
+# evicted least recently used beyond IMAGE_VERDICT_CACHE_MAX_ENTRIES.
+import os
+import time
+import sqlite3
+import logging
+import tempfile
+import threading
+from collections import Counter
+from typing import Dict, Optional
+
+
+IMAGE_VERDICT_CACHE_PATH = os.getenv("IMAGE_VERDICT_CACHE_PATH", os.path.join(tempfile.gettempdir(), "circloth-image-verdicts.sqlite"))
+IMAGE_VERDICT_CACHE_MAX_ENTRIES = int(os.getenv("IMAGE_VERDICT_CACHE_MAX_ENTRIES", 200000))
+# last_used is refreshed at most this often per entry, so hits rarely write
+IMAGE_VERDICT_CACHE_TOUCH_SECONDS = int(os.getenv("IMAGE_VERDICT_CACHE_TOUCH_SECONDS", 3600))
+# Evict after this many inserts (COUNT(*) is a full scan)
+_EVICT_EVERY = 100
+
+
+class VerdictCache:
+    def __init__(self, path: str = IMAGE_VERDICT_CACHE_PATH, max_entries: int = IMAGE_VERDICT_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS verdicts (key TEXT PRIMARY KEY, verdict TEXT NOT NULL, last_used REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS verdicts_last_used ON verdicts (last_used)")
+        self._inserts = 0
+        self.stats: Counter = Counter()  # evicted
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT verdict, last_used FROM verdicts WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > IMAGE_VERDICT_CACHE_TOUCH_SECONDS:
+                self._conn.execute("UPDATE verdicts SET last_used = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def put_many(self, entries: Dict[str, str]):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO verdicts (key, verdict, last_used) VALUES (?, ?, ?)",
+                    [(key, verdict, now) for key, verdict in entries.items()],
+                )
+                self._inserts += len(entries)
+                if self._inserts >= _EVICT_EVERY:
+                    self._inserts = 0
+                    self._evict()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _evict(self):
+        excess = self._conn.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0] - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM verdicts WHERE key IN (SELECT key FROM verdicts ORDER BY last_used LIMIT ?)", (excess,)
+            )
+            self.stats["evicted"] += excess
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_cache: Optional[VerdictCache] = None
+_cache_pid: Optional[int] = None  # connections are not shared with forked children
+_cache_lock = threading.Lock()
+
+
+def get_verdict_cache() -> Optional[VerdictCache]:
+    """
+    This process's connection to the shared cache; None if disabled
+    (IMAGE_VERDICT_CACHE_PATH empty) or unusable.
+    """
+    global _cache, _cache_pid
+    if not IMAGE_VERDICT_CACHE_PATH:
+        return None
+    with _cache_lock:
+        if _cache_pid != os.getpid():
+            _cache_pid = os.getpid()
+            try:
+                _cache = VerdictCache()
+            except sqlite3.Error as e:
+                logging.error(f"[IMAGE] verdict cache at {IMAGE_VERDICT_CACHE_PATH} unavailable: {e}")
+                _cache = None
+        return _cache
@@ -195,6 +195,11 @@ function Chats({ user, onUnreadChange, refreshUnread, onChatClose }) {
     ws.onmessage = (event) => {
       try {
         const msg = JSON.parse(event.data);
+        if (msg && msg.type === "ping") {
+          // Heartbeat: the server drops connections that stop answering
+          ws.send(JSON.stringify({ type: "pong" }));
+          return;
+        }
         if (msg && msg.sender && msg.receiver && msg.content) {
           setMessages(prev => [...prev, { ...msg, timestamp: Date.now() }]);
           // Update chats state so ChatMatchCard gets latest lastMessage
@@ -0,0 +1,32 @@
+# conftest.py
+# Backend tests run against the in-memory store (no Firebase credentials).
+import os
+import sys
+
+os.environ.setdefault("CIRCLOTH_STORE", "memory")
+os.environ.setdefault("CIRCLOTH_BUS", "local")
+# Photo verdicts are not cached across tests
+os.environ.setdefault("IMAGE_VERDICT_CACHE_PATH", "")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+import pytest
+
+from storage import get_client
+from doc_cache import CACHES
+from item_index import item_index
+from match_engine import like_index
+
+
+@pytest.fixture
+def store():
+    """
+    An empty in-memory store, with the process-wide caches and indexes reset.
+    """
+    client = get_client()
+    client.reset()
+    for cache in CACHES:
+        cache.clear()
+    item_index.load([])
+    like_index.load([])
+    yield client
+    client.reset()
@@ -0,0 +1,43 @@
+from action_migration import check, migrate
+from db import FirestoreDB, get_action_id
+
+
+def _legacy(store, doc_id, user_id, item_id, action, timestamp):
+    store.collection("actions").document(doc_id).set(
+        {"user_id": user_id, "item_id": item_id, "action": action, "timestamp": timestamp}
+    )
+
+
+def _action(store, user_id, item_id):
+    return store.collection("actions").document(get_action_id(user_id, item_id)).get().to_dict()
+
+
+def test_migrate_then_check_reports_nothing_left(store):
+    db = FirestoreDB()
+    # Duplicates of one pair land on different pages (page_size=2, id order)
+    _legacy(store, "a-old", "u1", "i1", "like", "2026-01-01T00:00:00Z")
+    _legacy(store, "b-other", "u1", "i2", "pass", "2026-01-01T00:00:00Z")
+    _legacy(store, "c-other", "u2", "i1", "like", "2026-01-01T00:00:00Z")
+    _legacy(store, "d-new", "u1", "i1", "pass", "2026-01-02T00:00:00Z")
+    _legacy(store, "e-older", "u1", "i1", "like", "2025-12-31T00:00:00Z")
+    assert not check(db)
+
+    migrate(db, page_size=2)
+
+    assert check(db)
+    assert sorted(doc.id for doc in store.collection("actions").stream()) == sorted(
+        [get_action_id("u1", "i1"), get_action_id("u1", "i2"), get_action_id("u2", "i1")]
+    )
+    assert _action(store, "u1", "i1")["action"] == "pass"
+
+
+def test_migrate_keeps_newer_swipe_made_during_the_run(store):
+    db = FirestoreDB()
+    _legacy(store, "legacy", "u1", "i1", "like", "2026-01-01T00:00:00Z")
+    # Written by the app (deterministic id) after the migration started
+    db.save_user_action("u1", "i1", "pass", "2026-01-05T00:00:00Z")
+
+    migrate(db)
+
+    assert _action(store, "u1", "i1")["action"] == "pass"
+    assert check(db)
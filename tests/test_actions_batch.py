@@ -0,0 +1,81 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+import memory_store
+from db import FirestoreDB, get_action_id
+from match_engine import like_index
+
+
+def _seed(db):
+    for user_id in ("A", "B"):
+        db.create_user(user_id, {"id": user_id, "name": user_id})
+    for i in range(5):
+        db.create_item({"id": f"b{i}", "ownerId": "B", "category": "tops", "size": "M"})
+
+
+def _fail_commit(monkeypatch, on_call):
+    commit, calls = memory_store.WriteBatch.commit, []
+
+    def flaky_commit(batch):
+        calls.append(1)
+        if len(calls) == on_call:
+            raise RuntimeError("commit failed")
+        commit(batch)
+
+    monkeypatch.setattr(memory_store.WriteBatch, "commit", flaky_commit)
+
+
+@pytest.fixture
+def client(store):
+    _seed(FirestoreDB())
+    return TestClient(main.app)
+
+
+def _swipes(n):
+    return [{"item_id": f"b{i}", "action": "like"} for i in range(n)]
+
+
+def test_batch_over_the_cap_is_rejected(client, monkeypatch):
+    monkeypatch.setattr(main, "MAX_BATCH_ACTIONS", 3)
+
+    response = client.post("/actions/batch", json={"user_id": "A", "actions": _swipes(4)})
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "TOO_MANY_ACTIONS"
+
+
+def test_actions_on_the_same_item_are_coalesced_to_the_latest(client, store):
+    response = client.post("/actions/batch", json={"user_id": "A", "actions": [
+        {"item_id": "b0", "action": "like", "timestamp": "2026-01-01T00:00:02Z"},
+        {"item_id": "b0", "action": "pass", "timestamp": "2026-01-01T00:00:01Z"},
+        {"item_id": "b1", "action": "like"},
+    ], "last_like": 123})
+
+    assert response.json() == {"message_key": "ACTIONS_HANDLED", "applied": 2, "failed": []}
+    assert store.collection("actions").document(get_action_id("A", "b0")).get().to_dict()["action"] == "like"
+    assert FirestoreDB().get_user("A")["last_like"] == 123
+
+
+def test_failed_commit_reports_the_unsaved_actions(client, store, monkeypatch):
+    monkeypatch.setattr("db.BATCH_SIZE", 2)
+    _fail_commit(monkeypatch, on_call=2)
+
+    response = client.post("/actions/batch", json={"user_id": "A", "actions": _swipes(5)})
+
+    assert response.status_code == 200
+    assert response.json() == {"message_key": "ACTIONS_PARTIALLY_HANDLED", "applied": 2, "failed": ["b2", "b3", "b4"]}
+    saved = {doc.id for doc in store.collection("actions").stream()}
+    assert saved == {get_action_id("A", "b0"), get_action_id("A", "b1")}
+    # Only the committed likes reach the index
+    assert like_index.liked_items("A") == {"b0", "b1"}
+
+
+def test_batch_with_nothing_saved_fails(client, store, monkeypatch):
+    _fail_commit(monkeypatch, on_call=1)
+
+    response = client.post("/actions/batch", json={"user_id": "A", "actions": _swipes(2), "last_like": 123})
+
+    assert response.status_code == 503
+    assert response.json()["detail"] == "ACTIONS_NOT_SAVED"
+    assert "last_like" not in FirestoreDB().get_user("A")
@@ -0,0 +1,93 @@
+from chat_writer import ChatWriter
+from db import FirestoreDB, new_message_id
+
+BURST = "2026-01-01T00:00:00.000000Z"
+
+
+def _seed(db):
+    db._ensure_chat_doc("A", "B", BURST)
+    messages = [
+        {"id": new_message_id(timestamp), "sender": "A", "receiver": "B", "content": str(i), "timestamp": timestamp}
+        for i, timestamp in enumerate(["2025-12-31T23:59:59.000000Z"] + [BURST] * 7 + ["2026-01-01T00:00:01.000000Z"])
+    ]
+    # A message stored before ids embedded their timestamp
+    messages.append({"id": "legacy", "sender": "B", "receiver": "A", "content": "legacy", "timestamp": BURST})
+    db.add_chat_messages(db._get_conversation_id("A", "B"), messages)
+    return sorted(messages, key=lambda m: (m["timestamp"], m["id"]))
+
+
+def _ids(messages):
+    return [m["id"] for m in messages]
+
+
+def test_paging_back_through_a_burst_returns_every_message_once(store):
+    db = FirestoreDB()
+    expected = _seed(db)
+
+    pages, before = [], None
+    while True:
+        page = db.get_chat_messages("A", "B", limit=3, before=before)
+        pages = page["messages"] + pages
+        if not page["has_more"]:
+            break
+        before = db.get_message_cursor("A", "B", page["messages"][0]["id"])
+
+    assert _ids(pages) == _ids(expected)
+
+
+def test_paging_forward_through_a_burst_returns_every_message_once(store):
+    db = FirestoreDB()
+    expected = _seed(db)
+
+    pages, after = [], db.get_message_cursor("A", "B", expected[0]["id"])
+    while True:
+        page = db.get_chat_messages("A", "B", limit=3, after=after)
+        pages += page["messages"]
+        if not page["has_more"]:
+            break
+        after = db.get_message_cursor("A", "B", page["messages"][-1]["id"])
+
+    assert _ids(pages) == _ids(expected[1:])
+
+
+def test_since_last_seen_cursor_compares_timestamps_only(store):
+    db = FirestoreDB()
+    expected = _seed(db)
+
+    page = db.get_chat_messages("A", "B", limit=50, after=(BURST, None))
+
+    assert _ids(page["messages"]) == _ids(expected[-1:])
+
+
+def test_pending_messages_merge_in_cursor_order(store):
+    db = FirestoreDB()
+    expected = _seed(db)
+    writer = ChatWriter(db, journal_dir=None)
+    pending = writer.enqueue("A", "B", "pending", BURST)
+
+    cursor = db.get_message_cursor("A", "B", expected[4]["id"])
+    page = db.get_chat_messages("A", "B", limit=50, after=cursor)
+    page = writer.merge_pending("A", "B", page, 50, after=cursor)
+
+    merged = sorted(expected[5:] + [pending], key=lambda m: (m["timestamp"], m["id"]))
+    assert _ids(page["messages"]) == _ids([m for m in merged if (m["timestamp"], m["id"]) > (BURST, expected[4]["id"])])
+
+
+def test_polling_a_busy_chat_writes_last_access_once_per_interval(store, monkeypatch):
+    db = FirestoreDB()
+    _seed(db)
+    inbox = store.collection("users").document("B").collection("inbox").document(db._get_conversation_id("A", "B"))
+
+    db.update_chat_last_access("A", "B", "B")
+    first = inbox.get().to_dict()["last_access"]
+    # A keeps writing while B polls
+    db.add_chat_messages(db._get_conversation_id("A", "B"), [
+        {"id": new_message_id("2026-01-03T00:00:00.000000Z"), "sender": "A", "receiver": "B", "content": "more",
+         "timestamp": "2026-01-03T00:00:00.000000Z"}
+    ])
+    assert db.update_chat_last_access("A", "B", "B") == first
+    assert inbox.get().to_dict()["last_access"] == first
+
+    monkeypatch.setattr("db.CHAT_LAST_ACCESS_MIN_INTERVAL_SECONDS", 0)
+    db.update_chat_last_access("A", "B", "B")
+    assert inbox.get().to_dict()["last_access"] > first
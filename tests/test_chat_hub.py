@@ -0,0 +1,129 @@
+import asyncio
+
+from chat_hub import PING, ChatHub
+
+
+class FakeWebSocket:
+    """
+    Records what the hub sends; send_json blocks while `stalled` is set.
+    """
+
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+        self.stalled = False
+
+    async def send_json(self, message):
+        while self.stalled:
+            await asyncio.sleep(0.01)
+        self.sent.append(message)
+
+    async def close(self):
+        self.closed = True
+
+
+def _connected(hub):
+    return [conn for room in hub.rooms.values() for conn in room]
+
+
+def test_heartbeat_evicts_connections_the_client_stopped_answering():
+    async def run():
+        hub = ChatHub(heartbeat_seconds=10)
+        silent, answering = FakeWebSocket(), FakeWebSocket()
+        silent_conn = hub.connect(silent, "A_B")
+        answering_conn = hub.connect(answering, "A_B")
+        # Both connections accepted every ping sent so far; only one answered
+        silent_conn.last_received -= 25
+        answering_conn.last_received -= 25
+        answering_conn.received()
+
+        await hub.heartbeat()
+        await asyncio.sleep(0.05)
+
+        assert _connected(hub) == [answering_conn]
+        assert silent.closed and hub.stats["heartbeat_evictions"] == 1
+        assert answering.sent == [PING]
+        await hub.stop()
+
+    asyncio.run(run())
+
+
+def _messages(n):
+    return [{"n": i} for i in range(n)]
+
+
+async def _flood_stalled(hub):
+    """
+    Broadcast four messages to a room whose second client stalls on the first;
+    returns both websockets once the stalled one resumes.
+    """
+    fast, slow = FakeWebSocket(), FakeWebSocket()
+    hub.connect(fast, "A_B")
+    hub.connect(slow, "A_B")
+    slow.stalled = True
+    first, *rest = _messages(4)
+    hub.broadcast("A_B", first)
+    await asyncio.sleep(0.05)  # slow's writer is now blocked sending the first message
+    for message in rest:
+        hub.broadcast("A_B", message)
+        await asyncio.sleep(0.01)  # fast keeps up
+    slow.stalled = False
+    await asyncio.sleep(0.05)
+    return fast, slow
+
+
+def test_drop_oldest_keeps_the_latest_messages_for_a_slow_consumer():
+    async def run():
+        hub = ChatHub(queue_size=2, slow_consumer_policy="drop_oldest")
+        fast, slow = await _flood_stalled(hub)
+
+        assert fast.sent == _messages(4)
+        assert slow.sent == [{"n": 0}, {"n": 2}, {"n": 3}]
+        assert hub.stats["messages_dropped"] == 1
+        await hub.stop()
+
+    asyncio.run(run())
+
+
+def test_drop_newest_keeps_the_queued_messages_for_a_slow_consumer():
+    async def run():
+        hub = ChatHub(queue_size=2, slow_consumer_policy="drop_newest")
+        fast, slow = await _flood_stalled(hub)
+
+        assert fast.sent == _messages(4)
+        assert slow.sent == [{"n": 0}, {"n": 1}, {"n": 2}]
+        assert hub.stats["messages_dropped"] == 1
+        await hub.stop()
+
+    asyncio.run(run())
+
+
+def test_disconnect_policy_evicts_a_slow_consumer():
+    async def run():
+        hub = ChatHub(queue_size=2, slow_consumer_policy="disconnect")
+        fast, slow = await _flood_stalled(hub)
+
+        assert fast.sent == _messages(4)
+        assert slow.closed and len(_connected(hub)) == 1
+        assert hub.stats["slow_consumer_disconnects"] == 1
+        await hub.stop()
+
+    asyncio.run(run())
+
+
+def test_send_timeout_evicts_a_stalled_connection():
+    async def run():
+        hub = ChatHub(send_timeout=0.05)
+        stalled = FakeWebSocket()
+        stalled.stalled = True
+        hub.connect(stalled, "A_B")
+
+        hub.broadcast("A_B", {"n": 0})
+        await asyncio.sleep(0.2)
+
+        assert stalled.closed and _connected(hub) == []
+        assert hub.stats["send_errors"] == 1
+        assert hub.broadcast("A_B", {"n": 1}) == 0
+        await hub.stop()
+
+    asyncio.run(run())
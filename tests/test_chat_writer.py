@@ -0,0 +1,72 @@
+import os
+import glob
+import time
+
+import chat_writer
+from chat_writer import ChatWriter
+from db import FirestoreDB
+
+
+class FlakyDB(FirestoreDB):
+    """
+    Fails every message commit while `down` is set.
+    """
+    down = False
+
+    def add_chat_messages(self, conv_id, messages):
+        if self.down:
+            raise RuntimeError("Firestore unavailable")
+        super().add_chat_messages(conv_id, messages)
+
+
+def _journaled(directory):
+    lines = []
+    for path in glob.glob(os.path.join(directory, "*.jsonl")):
+        with open(path) as f:
+            lines += f.read().splitlines()
+    return lines
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+
+
+def _stored(store):
+    return store.collection("chats").document("A_B").collection("messages").stream()
+
+
+def test_messages_are_journaled_once_during_an_outage(store, tmp_path):
+    db = FlakyDB()
+    db.down = True
+    writer = ChatWriter(db, journal_dir=str(tmp_path))
+    writer.start()
+    for i in range(5):
+        writer.enqueue("A", "B", str(i), f"2026-01-01T00:00:0{i}.000000Z")
+    # Several failed flushes of the backlog
+    _wait_for(lambda: writer.stats["failures"] >= 2)
+
+    assert len(_journaled(str(tmp_path))) == 5
+
+    db.down = False
+    assert writer.stop()
+    assert len(list(_stored(store))) == 5
+    assert _journaled(str(tmp_path)) == []
+
+
+def test_committed_segments_are_deleted_as_they_rotate(store, tmp_path, monkeypatch):
+    monkeypatch.setattr(chat_writer, "CHAT_JOURNAL_SEGMENT_MESSAGES", 2)
+    db = FlakyDB()
+    writer = ChatWriter(db, journal_dir=str(tmp_path))
+    writer.start()
+    for i in range(7):
+        writer.enqueue("A", "B", str(i), f"2026-01-01T00:00:0{i}.000000Z")
+        _wait_for(lambda: writer.stats["persisted"] == i + 1)
+
+    # Only the current segment is left
+    _wait_for(lambda: len(glob.glob(os.path.join(str(tmp_path), "*.jsonl"))) == 1)
+    assert writer.stop()
+    assert len(list(_stored(store))) == 7
+    assert glob.glob(os.path.join(str(tmp_path), "*.jsonl")) == []
@@ -0,0 +1,71 @@
+from datetime import datetime
+
+import deletion_jobs
+from db import FirestoreDB, BATCH_SIZE
+from deletion_jobs import DeletionJobs, get_user_deletion_job_id
+
+ACTIONS = 2 * BATCH_SIZE + 200
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat() + "Z"
+
+
+def _seed(db):
+    for user_id in ("U", "V"):
+        db.create_user(user_id, {"id": user_id, "name": user_id})
+    db.create_item({"id": "u-item", "ownerId": "U", "category": "tops", "size": "M"})
+    db.create_item({"id": "v-item", "ownerId": "V", "category": "tops", "size": "M"})
+    db.save_user_actions_batch("U", [{"item_id": f"x{i}", "action": "pass", "timestamp": _now()} for i in range(ACTIONS)])
+    db.save_user_action("V", "u-item", "like", _now())
+    db.add_chat_message("U", "V", "hi", _now())
+
+
+def _count(store, collection, field, value):
+    return len(list(store.collection(collection).where(field, "==", value).stream()))
+
+
+def test_deletion_resumes_after_crash_mid_step(store, monkeypatch):
+    db = FirestoreDB()
+    _seed(db)
+    job_id = get_user_deletion_job_id("U")
+
+    # First worker dies after committing one page of the 'actions' step
+    crashing = FirestoreDB()
+    delete_user_actions = crashing.delete_user_actions
+
+    def delete_one_page_then_die(user_id, on_page=None):
+        def on_first_page(count):
+            on_page(count)
+            raise KeyboardInterrupt
+
+        return delete_user_actions(user_id, on_first_page)
+
+    crashing.delete_user_actions = delete_one_page_then_die
+    jobs = DeletionJobs(crashing)
+    jobs.start_user_deletion("U")
+    jobs.shutdown(wait=True)
+
+    job = jobs.get(job_id)
+    assert (job["status"], job["step"]) == ("running", "actions")
+    # V's like on u-item went with the item in the 'items' step
+    assert job["deleted"]["actions"] == 1 + BATCH_SIZE
+    assert _count(store, "actions", "user_id", "U") == ACTIONS - BATCH_SIZE
+    assert _count(store, "items", "ownerId", "U") == 0
+
+    # Nothing is resumed while the lease is still held
+    restarted = DeletionJobs(FirestoreDB())
+    assert restarted.resume_pending() == 0
+
+    monkeypatch.setattr(deletion_jobs, "DELETION_JOB_LEASE_SECONDS", 0)
+    assert restarted.resume_pending() == 1
+    restarted.shutdown(wait=True)
+
+    job = restarted.get(job_id)
+    assert job["status"] == "done"
+    assert job["deleted"]["actions"] == 1 + ACTIONS
+    assert _count(store, "actions", "user_id", "U") == 0
+    assert _count(store, "chats", "participants", "U") == 0
+    assert not store.collection("users").document("U").get().exists
+    assert store.collection("users").document("V").get().exists
+    assert store.collection("items").document("v-item").get().exists
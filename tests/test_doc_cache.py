@@ -0,0 +1,68 @@
+import doc_cache
+from db import FirestoreDB
+from doc_cache import TTLCache, user_cache
+
+
+def test_entry_expires_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(doc_cache.time, "monotonic", lambda: now[0])
+    cache = TTLCache("test", max_entries=10, ttl=60)
+    loads = []
+
+    def load():
+        loads.append(1)
+        return {"n": len(loads)}
+
+    assert cache.get_or_load("a", load) == {"n": 1}
+    now[0] += 59
+    assert cache.get_or_load("a", load) == {"n": 1}
+    now[0] += 2
+    assert cache.get_or_load("a", load) == {"n": 2}
+    assert cache.stats["hits"] == 1
+    assert cache.stats["expirations"] == 1
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache("test", max_entries=2, ttl=60)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get_or_load("a", lambda: None)  # a is now the most recently used
+    cache.put("c", 3)
+
+    assert cache.stats["evictions"] == 1
+    assert cache.get_many_or_load(["a", "b", "c"], lambda keys: {k: "loaded" for k in keys}) == {"a": 1, "b": "loaded", "c": 3}
+
+
+def test_load_racing_an_invalidation_is_not_cached():
+    cache = TTLCache("test", max_entries=10, ttl=60)
+
+    def load():
+        cache.invalidate("a")  # a write lands while the read is in flight
+        return "stale"
+
+    assert cache.get_or_load("a", load) == "stale"
+    assert cache.get_or_load("a", lambda: "fresh") == "fresh"
+
+
+def test_user_write_invalidates_cached_user(store):
+    db = FirestoreDB()
+    db.create_user("u1", {"name": "Ann"})
+    assert db.get_user("u1")["name"] == "Ann"
+    assert len(user_cache) == 1
+
+    db.update_user("u1", {"name": "Bea"})
+
+    assert db.get_user("u1")["name"] == "Bea"
+
+
+def test_item_write_invalidates_cached_item_and_owner_listing(store):
+    db = FirestoreDB()
+    db.create_item({"id": "i1", "ownerId": "u1", "title": "Coat"})
+    assert db.get_item("i1")["title"] == "Coat"
+    assert [i["id"] for i in db.list_user_items("u1")] == ["i1"]
+
+    db.update_item("i1", {"title": "Jacket"})
+    db.create_item({"id": "i2", "ownerId": "u1", "title": "Scarf"})
+
+    assert db.get_item("i1")["title"] == "Jacket"
+    assert sorted(i["id"] for i in db.list_user_items("u1")) == ["i1", "i2"]
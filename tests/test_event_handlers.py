@@ -0,0 +1,25 @@
+from db import register_event_handlers
+from event_bus import EventBus
+from item_index import item_index
+
+ITEM = {"ownerId": "A", "category": "tops", "size": "M", "photoURLs": ["p"]}
+
+
+def _bus():
+    bus = EventBus()
+    register_event_handlers(bus)
+    return bus
+
+
+def test_merge_event_for_an_unindexed_item_is_dropped(store):
+    _bus()._dispatch("item_updated", {"item_id": "i1", "owner_id": None, "data": {"locked_for": "B"}, "merge": True})
+
+    assert item_index.get("i1") is None
+
+
+def test_merge_event_updates_an_indexed_item(store):
+    bus = _bus()
+    bus._dispatch("item_updated", {"item_id": "i1", "owner_id": "A", "data": ITEM, "merge": False})
+    bus._dispatch("item_updated", {"item_id": "i1", "owner_id": "A", "data": {"locked_for": "B"}, "merge": True})
+
+    assert item_index.get("i1") == {**ITEM, "id": "i1", "locked_for": "B"}
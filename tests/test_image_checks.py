@@ -0,0 +1,177 @@
+import io
+import time
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import image_checks
+from benchmarks.bench_image_checks import make_photos, start_server
+from image_checks import ImageCheckPipeline, check_face, decode_image, run_checks
+
+
+def _encode(pixels: np.ndarray, fmt: str = "PNG") -> bytes:
+    buffer = io.BytesIO()
+    Image.fromarray(pixels.astype(np.uint8)).save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def _noise(height: int, width: int) -> np.ndarray:
+    return np.random.default_rng(0).integers(0, 256, (height, width, 3))
+
+
+@pytest.fixture(scope="module")
+def photos(tmp_path_factory):
+    """
+    A local HTTP stand-in for the photo bucket: (base URL, directory).
+    """
+    directory = tmp_path_factory.mktemp("photos")
+    make_photos(str(directory), 6, 640, 480)
+    (directory / "notes.txt").write_text("not a photo")
+    (directory / "album").mkdir()  # requested without a slash: answered with a redirect
+    server, base_url = start_server(str(directory), 0)
+    yield base_url, directory
+    server.shutdown()
+
+
+def _pipeline(**kwargs) -> ImageCheckPipeline:
+    kwargs.setdefault("max_workers", 0)
+    return ImageCheckPipeline(["size", "blank"], allowed_hosts=["127.0.0.1"], allow_local=True, **kwargs)
+
+
+async def _check(pipeline: ImageCheckPipeline, urls):
+    pipeline.start()
+    try:
+        return await pipeline.check_images(urls)
+    finally:
+        await pipeline.stop()
+
+
+# --- Checks ---
+def test_size_check_verdicts():
+    assert run_checks(_encode(_noise(300, 400)), ["size"]) is True
+    assert run_checks(_encode(_noise(100, 400)), ["size"]) == "IMAGE_TOO_SMALL"
+    assert run_checks(_encode(_noise(300, 1200)), ["size"]) == "IMAGE_BAD_ASPECT_RATIO"
+
+
+def test_blank_check_verdicts():
+    assert run_checks(_encode(_noise(300, 400)), ["blank"]) is True
+    assert run_checks(_encode(np.full((300, 400, 3), 128)), ["blank"]) == "IMAGE_BLANK"
+
+
+def test_unreadable_photo():
+    assert run_checks(b"not a photo", ["size"]) == "IMAGE_UNREADABLE"
+
+
+def test_face_check_passes_photos_without_faces():
+    # Without OpenCV the check is skipped, i.e. always passes
+    assert check_face(decode_image(_encode(_noise(300, 400)))) is None
+
+
+def test_face_check_rejects_detected_faces(monkeypatch):
+    pytest.importorskip("cv2")
+
+    class OneFace:
+        def detectMultiScale(self, *args, **kwargs):
+            return [(10, 10, 50, 50)]
+
+    monkeypatch.setattr(image_checks, "_face_cascade", OneFace())
+    assert check_face(decode_image(_encode(_noise(300, 400)))) == "FACE_DETECTED"
+
+
+# --- Fetching ---
+def test_photos_from_the_stand_in_pass(photos):
+    base_url, _ = photos
+    assert asyncio.run(_check(_pipeline(), [f"{base_url}/photo0.jpg", f"{base_url}/photo1.jpg"])) is True
+
+
+def test_non_image_download(photos):
+    base_url, _ = photos
+    assert asyncio.run(_check(_pipeline(), [f"{base_url}/notes.txt"])) == "IMAGE_UNREADABLE"
+
+
+def test_oversize_download(photos, monkeypatch):
+    base_url, _ = photos
+    monkeypatch.setattr(image_checks, "IMAGE_MAX_BYTES", 1000)
+    assert asyncio.run(_check(_pipeline(), [f"{base_url}/photo0.jpg"])) == "IMAGE_TOO_LARGE"
+
+
+def test_oversize_file_is_capped_while_reading(monkeypatch):
+    # Reports size 0 on disk and never ends
+    monkeypatch.setattr(image_checks, "IMAGE_MAX_BYTES", 1000)
+    assert asyncio.run(_check(_pipeline(), ["file:///dev/zero"])) == "IMAGE_TOO_LARGE"
+
+
+def test_download_timeout(photos):
+    _, directory = photos
+    data = (directory / "photo0.jpg").read_bytes()
+
+    class Trickle(BaseHTTPRequestHandler):
+        # Every read is quick, the whole download is not: only the per-photo deadline stops it
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            for start in range(0, len(data), 1000):
+                self.wfile.write(data[start:start + 1000])
+                time.sleep(0.05)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Trickle)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/photo0.jpg"
+        assert asyncio.run(_check(_pipeline(timeout=0.5), [url])) == "IMAGE_CHECK_TIMEOUT"
+    finally:
+        server.shutdown()
+
+
+def test_failed_downloads_and_redirects(photos):
+    base_url, _ = photos
+    assert asyncio.run(_check(_pipeline(), [f"{base_url}/missing.jpg"])) == "IMAGE_DOWNLOAD_FAILED"
+    assert asyncio.run(_check(_pipeline(), [f"{base_url}/album"])) == "IMAGE_DOWNLOAD_FAILED"
+
+
+@pytest.mark.parametrize("url", [
+    "file:///etc/hostname",
+    "file:///no/such/file",
+    "http://firebasestorage.googleapis.com/v0/b/bucket/o/photo.jpg",
+    "https://example.com/photo.jpg",
+    "https://169.254.169.254/computeMetadata/v1/",
+    "https://firebasestorage.googleapis.com:8443/v0/b/bucket/o/photo.jpg",
+    "ftp://firebasestorage.googleapis.com/photo.jpg",
+])
+def test_urls_outside_the_bucket_host_are_refused(url):
+    pipeline = ImageCheckPipeline(["size"], max_workers=0, allow_local=False)
+    assert asyncio.run(_check(pipeline, [url])) == "IMAGE_URL_INVALID"
+
+
+def test_allowed_host_resolving_to_a_local_address_is_refused():
+    pipeline = ImageCheckPipeline(["size"], max_workers=0, allowed_hosts=["localhost"], allow_local=False)
+    assert asyncio.run(_check(pipeline, ["https://localhost/photo.jpg"])) == "IMAGE_URL_INVALID"
+
+
+# --- Process pool ---
+def test_concurrent_items_through_the_process_pool(photos):
+    base_url, _ = photos
+    good = [f"{base_url}/photo{i}.jpg" for i in range(6)]
+
+    async def run():
+        pipeline = _pipeline(max_workers=2)
+        pipeline.start()
+        try:
+            return await asyncio.gather(
+                *(pipeline.check_images(good[i:] + good[:i]) for i in range(6)),
+                pipeline.check_images(good + [f"{base_url}/notes.txt"]),
+            ), pipeline.stats
+        finally:
+            await pipeline.stop()
+
+    results, stats = asyncio.run(run())
+    assert results == [True] * 6 + ["IMAGE_UNREADABLE"]
+    assert stats["ok"] >= 36 and stats["IMAGE_UNREADABLE"] == 1
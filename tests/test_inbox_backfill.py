@@ -0,0 +1,35 @@
+from db import FirestoreDB, new_message_id
+from inbox_backfill import check, rebuild
+
+
+def _seed(db):
+    for user_id in ("A", "B", "C"):
+        db.create_user(user_id, {"id": user_id, "name": user_id})
+    for other, timestamps in (("B", ["2026-01-01T00:00:00.000000Z", "2026-01-01T00:00:01.000000Z"]),
+                              ("C", ["2026-01-02T00:00:00.000000Z"])):
+        db._ensure_chat_doc("A", other, timestamps[0])
+        db.add_chat_messages(db._get_conversation_id("A", other), [
+            {"id": new_message_id(timestamp), "sender": "A", "receiver": other, "content": "hi", "timestamp": timestamp}
+            for timestamp in timestamps
+        ])
+
+
+def _inbox(store, user_id):
+    return store.collection("users").document(user_id).collection("inbox")
+
+
+def test_check_reports_no_drift_after_rebuild(store):
+    db = FirestoreDB()
+    _seed(db)
+    chat_id = db._get_conversation_id("A", "B")
+    # Drift: a lost entry, a wrong unread count and an entry for a deleted chat
+    _inbox(store, "A").document(chat_id).delete()
+    _inbox(store, "B").document(chat_id).update({"unread_count": 7})
+    _inbox(store, "C").document("A_Z").set({"chat_id": "A_Z", "unread_count": 0})
+    assert not check(db)
+
+    rebuild(db)
+
+    assert check(db)
+    assert _inbox(store, "B").document(chat_id).get().to_dict()["unread_count"] == 2
+    assert not _inbox(store, "C").document("A_Z").get().exists
@@ -0,0 +1,52 @@
+from item_index import ItemIndex
+
+
+def _item(item_id, **fields):
+    return {"id": item_id, "ownerId": "A", "category": "tops", "size": "M", **fields}
+
+
+def test_writes_during_a_resync_read_are_kept():
+    index = ItemIndex()
+    index.load([_item("kept"), _item("deleted"), _item("locked")])
+
+    def read_items():
+        # The snapshot is read before these writes land
+        snapshot = [_item("kept"), _item("deleted"), _item("locked")]
+        index.remove("deleted")
+        index.upsert("locked", {"locked_for": "B"}, merge=True)
+        index.upsert("created", _item("created"))
+        return snapshot
+
+    index.reload(read_items)
+
+    assert index.get("deleted") is None
+    assert index.get("locked")["locked_for"] == "B"
+    assert index.get("created") is not None
+    assert index.get("kept") is not None
+
+
+def test_failed_resync_keeps_the_index():
+    index = ItemIndex()
+    index.load([_item("kept")])
+
+    def read_items():
+        raise RuntimeError("read failed")
+
+    try:
+        index.reload(read_items)
+    except RuntimeError:
+        pass
+    index.upsert("created", _item("created"))
+
+    assert {item["id"] for item in index.items(["kept", "created"])} == {"kept", "created"}
+
+
+def test_patch_of_an_unknown_item_is_not_indexed():
+    index = ItemIndex()
+    index.load([])
+
+    index.upsert("unknown", {"locked_for": "B"}, merge=True)
+    index.upsert("unknown", {"status": "visible"}, merge=True)
+
+    assert index.get("unknown") is None
+    assert index.select("B") == []
@@ -0,0 +1,19 @@
+from item_index import item_index
+from match_engine import LikeIndex
+
+
+def test_likes_written_during_a_resync_read_are_kept(store):
+    item_index.load([{"id": "a1", "ownerId": "A"}, {"id": "b1", "ownerId": "B"}, {"id": "b2", "ownerId": "B"}])
+    index = LikeIndex()
+    index.load([{"user_id": "B", "item_id": "a1"}, {"user_id": "A", "item_id": "b2"}])
+
+    def read_likes():
+        # Read before A likes b1 and takes back the like of b2
+        snapshot = [{"user_id": "B", "item_id": "a1"}, {"user_id": "A", "item_id": "b2"}]
+        index.add_like("A", "b1")
+        index.remove_like("A", "b2")
+        yield from snapshot
+
+    index.reload(read_likes)
+
+    assert index.pair_likes("A", "B") == {"A": ["b1"], "B": ["a1"]}
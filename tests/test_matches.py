@@ -0,0 +1,59 @@
+from db import FirestoreDB, get_action_id
+from match_engine import get_pair_id, like_index
+from matching_service import handle_user_action
+
+
+def _seed(db):
+    for user_id in ("A", "B"):
+        db.create_user(user_id, {"id": user_id, "name": user_id})
+    db.create_item({"id": "a1", "ownerId": "A", "category": "tops", "size": "M"})
+    db.create_item({"id": "b1", "ownerId": "B", "category": "tops", "size": "M"})
+
+
+def _match(store):
+    doc = store.collection("matches").document(get_pair_id("A", "B")).get()
+    return doc.to_dict() if doc.exists else None
+
+
+def test_match_created_when_like_index_missed_the_other_like(store):
+    db = FirestoreDB()
+    _seed(db)
+    # B's like was saved by another worker whose event never reached this one
+    store.collection("actions").document(get_action_id("B", "a1")).set(
+        {"user_id": "B", "item_id": "a1", "action": "like", "timestamp": "2026-01-01T00:00:00Z"}
+    )
+    assert like_index.pair_likes("A", "B") is None
+
+    handle_user_action("A", "b1", "like")
+
+    assert _match(store)["likes"] == {"A": ["b1"], "B": ["a1"]}
+
+
+def test_stale_like_index_does_not_keep_a_match(store):
+    db = FirestoreDB()
+    _seed(db)
+    handle_user_action("A", "b1", "like")
+    handle_user_action("B", "a1", "like")
+    assert _match(store) is not None
+
+    # B's like is undone by another worker; this worker's index still has it
+    store.collection("actions").document(get_action_id("B", "a1")).delete()
+    assert like_index.pair_likes("A", "B") is not None
+
+    db.refresh_match_record("A", "B")
+
+    assert _match(store) is None
+
+
+def test_deleting_an_item_removes_the_match_the_like_index_missed(store):
+    db = FirestoreDB()
+    _seed(db)
+    handle_user_action("A", "b1", "like")
+    handle_user_action("B", "a1", "like")
+    assert _match(store) is not None
+    # This worker's index lost the likes (e.g. restarted before its resync)
+    like_index.load([])
+
+    db.delete_item_cascade("b1")
+
+    assert _match(store) is None
@@ -0,0 +1,26 @@
+from storage import ASCENDING, DESCENDING
+
+
+def _ids(query):
+    return [doc.id for doc in query.stream()]
+
+
+def test_null_sorts_before_every_other_value(store):
+    inbox = store.collection("inbox")
+    inbox.document("new").set({"updated_at": None})
+    inbox.document("newer").set({"updated_at": None})
+    inbox.document("b").set({"updated_at": "2026-01-02T00:00:00Z"})
+    inbox.document("a").set({"updated_at": "2026-01-01T00:00:00Z"})
+    inbox.document("n").set({"updated_at": 5})
+
+    assert _ids(inbox.order_by("updated_at", direction=ASCENDING)) == ["new", "newer", "n", "a", "b"]
+    assert _ids(inbox.order_by("updated_at", direction=DESCENDING)) == ["b", "a", "n", "newer", "new"]
+
+
+def test_cursor_past_a_null_value(store):
+    inbox = store.collection("inbox")
+    inbox.document("new").set({"updated_at": None})
+    inbox.document("a").set({"updated_at": "2026-01-01T00:00:00Z"})
+
+    query = inbox.order_by("updated_at", direction=DESCENDING)
+    assert _ids(query.start_after(inbox.document("a").get())) == ["new"]
@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+import moderation
+from async_db import AsyncFirestoreDB
+from db import FirestoreDB
+from image_checks import ImageCheckPipeline
+from image_derivatives import ImageDerivatives
+from item_index import ITEM_STATUS_PENDING_REVIEW, ITEM_STATUS_REJECTED, ITEM_STATUS_VISIBLE
+from moderation import ModerationQueue, ModerationWorker
+
+PHOTOS = ["https://firebasestorage.googleapis.com/v0/b/bucket/o/a.jpg"]
+
+
+def _moderate(store, tmp_path, monkeypatch, verdict):
+    """
+    Run one queued job with the given photo verdict: (item status, on_visible calls).
+    """
+    adb = AsyncFirestoreDB(FirestoreDB())
+    adb.sync.create_item({"id": "i1", "ownerId": "A", "photoURLs": PHOTOS, "status": ITEM_STATUS_PENDING_REVIEW})
+
+    async def check_images(urls):
+        return verdict
+
+    monkeypatch.setattr(moderation, "check_images", check_images)
+    listed = []
+    worker = ModerationWorker(adb, mode="async", on_visible=lambda item_id, urls: listed.append((item_id, urls)))
+    worker.queue = ModerationQueue(str(tmp_path / "queue.sqlite"))
+    try:
+        worker.queue.enqueue("i1", PHOTOS)
+        asyncio.run(worker._run(worker.queue.claim()))
+    finally:
+        worker.queue.close()
+    return adb.sync.get_item("i1")["status"], listed
+
+
+def test_visible_items_are_handed_on(store, tmp_path, monkeypatch):
+    assert _moderate(store, tmp_path, monkeypatch, True) == (ITEM_STATUS_VISIBLE, [("i1", PHOTOS)])
+
+
+def test_rejected_items_are_not_handed_on(store, tmp_path, monkeypatch):
+    assert _moderate(store, tmp_path, monkeypatch, "IMAGE_BLANK") == (ITEM_STATUS_REJECTED, [])
+
+
+@pytest.mark.parametrize("url, renderable", [
+    (PHOTOS[0], True),
+    ("https://example.com/a.jpg", False),
+    ("file:///etc/hostname", False),
+])
+def test_derivatives_only_from_allowed_remote_urls(url, renderable):
+    # Even a pipeline that may read local files never renders them
+    pipeline = ImageCheckPipeline(["size"], max_workers=0, allow_local=True)
+    assert ImageDerivatives(AsyncFirestoreDB(FirestoreDB()), pipeline).is_renderable(url) is renderable
+
+
+def test_derivatives_are_not_scheduled_when_disabled():
+    async def run():
+        derivatives = ImageDerivatives(AsyncFirestoreDB(FirestoreDB()), enabled=False)
+        derivatives.submit("i1", PHOTOS)
+        return len(derivatives._tasks)
+
+    assert asyncio.run(run()) == 0
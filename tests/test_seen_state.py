@@ -0,0 +1,76 @@
+import time
+from datetime import datetime, timedelta
+
+from item_index import item_index
+from seen_state import SeenState, SeenStore
+
+
+def _iso(seconds_ago: float) -> str:
+    return (datetime.utcnow() - timedelta(seconds=seconds_ago)).isoformat() + "Z"
+
+
+def test_pass_excludes_item_until_it_expires():
+    state = SeenState(pass_expiry_seconds=60)
+    state.record(1, "pass", _iso(0))
+    state.record(2, "pass", _iso(120))  # already expired when recorded
+
+    assert state.is_excluded(1)
+    assert not state.is_excluded(2)
+    assert not state.is_excluded(1, now=time.time() + 61)
+    assert list(state.excluded_ordinals(now=time.time() + 61)) == []
+
+
+def test_later_action_overrides_pass():
+    state = SeenState(pass_expiry_seconds=60)
+    state.record(1, "pass", _iso(0))
+    state.record(1, "like", _iso(0))
+
+    # The like stays excluded after the pass would have expired
+    assert list(state.excluded_ordinals(now=time.time() + 61)) == [1]
+
+
+def test_like_is_excluded_until_removed():
+    state = SeenState(pass_expiry_seconds=60)
+    state.record(3, "like", _iso(3600))
+    assert state.is_excluded(3)
+    state.remove_like(3)
+    assert not state.is_excluded(3)
+
+
+def test_store_loads_latest_action_per_item():
+    store = SeenStore(pass_expiry_seconds=60)
+    history = [
+        {"item_id": "seen-a", "action": "like", "timestamp": _iso(30)},
+        {"item_id": "seen-a", "action": "pass", "timestamp": _iso(600)},
+        {"item_id": "seen-b", "action": "pass", "timestamp": _iso(600)},
+    ]
+    state = store.get("u1", lambda user_id: history)
+
+    assert state.is_excluded(item_index.ordinal("seen-a"))
+    assert not state.is_excluded(item_index.ordinal("seen-b"))
+
+
+def test_record_during_cold_load_is_not_lost():
+    store = SeenStore(pass_expiry_seconds=60)
+
+    def load_actions(user_id):
+        # A swipe saved after the history was read, but before the load finished
+        store.record(user_id, "race-item", "like", _iso(0))
+        return []
+
+    state = store.get("u1", load_actions)
+
+    assert state.is_excluded(item_index.ordinal("race-item"))
+    assert store.get("u1", lambda user_id: []) is state
+
+
+def test_invalidate_during_cold_load_is_not_cached():
+    store = SeenStore(pass_expiry_seconds=60)
+
+    def load_actions(user_id):
+        store.invalidate(user_id)
+        return [{"item_id": "stale-item", "action": "like", "timestamp": _iso(0)}]
+
+    store.get("u1", load_actions)
+    reloaded = store.get("u1", lambda user_id: [])
+    assert not reloaded.is_excluded(item_index.ordinal("stale-item"))
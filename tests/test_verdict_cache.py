@@ -0,0 +1,100 @@
+import io
+import asyncio
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import image_checks
+import verdict_cache
+from benchmarks.bench_image_checks import make_photos, start_server
+from image_checks import ImageCheckPipeline
+from verdict_cache import VerdictCache
+
+
+def _photo(height: int, width: int, fmt: str) -> bytes:
+    """
+    A 9x8 grid of well-separated gray blocks, whose dhash survives re-encoding.
+    """
+    blocks = (np.random.default_rng(0).permutation(72).reshape(8, 9) * 3 + 20).astype(np.uint8)
+    image = Image.fromarray(blocks).resize((width, height), Image.NEAREST).convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = VerdictCache(str(tmp_path / "verdicts.sqlite"))
+    monkeypatch.setattr(image_checks, "get_verdict_cache", lambda: cache)
+    yield cache
+    cache.close()
+
+
+def _pipeline() -> ImageCheckPipeline:
+    return ImageCheckPipeline(["size", "blank"], max_workers=0, allowed_hosts=["127.0.0.1"], allow_local=True)
+
+
+def test_same_bytes_hit_by_sha(cache):
+    pipeline = _pipeline()
+    data = _photo(300, 400, "PNG")
+
+    assert asyncio.run(pipeline.check_data(data)) is True
+    assert asyncio.run(pipeline.check_data(data)) is True
+    assert pipeline.cache_stats == {"miss": 1, "sha_hit": 1}
+
+
+def test_reencoded_photo_hits_by_phash(cache):
+    pipeline = _pipeline()
+
+    assert asyncio.run(pipeline.check_data(_photo(300, 400, "PNG"))) is True
+    assert asyncio.run(pipeline.check_data(_photo(300, 400, "JPEG"))) is True
+    assert pipeline.cache_stats == {"miss": 1, "phash_hit": 1}
+
+
+def test_verdicts_of_another_check_configuration_are_not_reused(cache):
+    data = _photo(300, 400, "PNG")
+    asyncio.run(_pipeline().check_data(data))
+    pipeline = ImageCheckPipeline(["size"], max_workers=0)
+
+    asyncio.run(pipeline.check_data(data))
+
+    assert pipeline.cache_stats == {"miss": 1}
+
+
+def test_photo_url_hit_skips_the_download(cache, tmp_path):
+    make_photos(str(tmp_path), 1, 640, 480)
+    server, base_url = start_server(str(tmp_path), 0)
+    pipeline = _pipeline()
+    url = f"{base_url}/photo0.jpg"
+
+    async def run():
+        pipeline.start()
+        try:
+            first = await pipeline.check_url(url)
+            server.shutdown()  # a second download would now fail
+            server.server_close()
+            return first, await pipeline.check_url(url)
+        finally:
+            await pipeline.stop()
+
+    assert asyncio.run(run()) == (True, True)
+    assert pipeline.cache_stats == {"miss": 1, "url_hit": 1}
+
+
+def test_least_recently_used_verdicts_are_evicted(tmp_path, monkeypatch):
+    clock = iter(range(1000, 2000))
+    monkeypatch.setattr(verdict_cache.time, "time", lambda: next(clock))
+    monkeypatch.setattr(verdict_cache, "IMAGE_VERDICT_CACHE_TOUCH_SECONDS", 0)
+    monkeypatch.setattr(verdict_cache, "_EVICT_EVERY", 1)
+    cache = VerdictCache(str(tmp_path / "verdicts.sqlite"), max_entries=3)
+
+    for key in ("a", "b", "c"):
+        cache.put_many({key: "ok"})
+    assert cache.get("a") == "ok"  # a is now more recently used than b
+    cache.put_many({"d": "IMAGE_BLANK"})
+
+    assert cache.get("b") is None
+    assert [cache.get(key) for key in ("a", "c", "d")] == ["ok", "ok", "IMAGE_BLANK"]
+    assert cache.stats["evicted"] == 1
+    cache.close()